@@ -52,7 +52,7 @@ def main():
     print("✨ جاري تشغيل البوت...")
     try:
         # Execute the main module as a package to solve relative import issues
-        subprocess.run([sys.executable, "-m", "src.main"], check=True)
+        subprocess.run([sys.executable, "-m", "src"], check=True)
     except KeyboardInterrupt:
         print("\n🛑 تم إيقاف البوت بواسطة المستخدم")
     except subprocess.CalledProcessError as e:
@@ -0,0 +1,7 @@
+"""
+__main__.py - نقطة تشغيل البوت: python -m src
+"""
+
+from .main import run
+
+run()
@@ -2,13 +2,16 @@
 # ai_agent.py - وكيل الذكاء الاصطناعي المتطور
 import os
 import json
-import requests
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Callable, Optional
 from langchain.agents import AgentExecutor, create_openai_tools_agent
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from langchain.memory import ConversationBufferWindowMemory
 from .tools import ALL_TOOLS
+from .llm_transport import get_transport
+from .conversation_memory import ConversationMemory
+from .response_cache import response_cache
+from .config_manager import AIConfig, config_manager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -82,11 +85,18 @@ class MultiModelAIManager:
         if self.active_provider == 'google':
             return self._create_gemini_instance(api_key)
         else:
+            # عملاء HTTP مشتركون لكل موفر: اتصالات دائمة ومهل وحد تزامن بدلاً من عميل جديد لكل مثيل
+            transport = get_transport(self.active_provider)
             return ChatOpenAI(
                 model=self.active_model,
                 openai_api_key=api_key,
                 openai_api_base=config['base_url'],
-                temperature=0.7
+                temperature=0.7,
+                streaming=True,
+                timeout=transport.httpx_timeout(),
+                max_retries=transport.max_retries,
+                http_client=transport.http_client(),
+                http_async_client=transport.async_http_client()
             )
     
     def _create_gemini_instance(self, api_key: str):
@@ -96,43 +106,131 @@ class MultiModelAIManager:
                 self.api_key = api_key
                 self.model = model
                 self.base_url = "https://generativelanguage.googleapis.com/v1beta"
+                self.transport = get_transport('google')
+                self.headers = {
+                    'Content-Type': 'application/json',
+                    'X-goog-api-key': self.api_key
+                }
+            
+            @staticmethod
+            def _payload(messages) -> Dict[str, Any]:
+                """تحويل الرسائل إلى صيغة Gemini: تعليمات النظام منفصلة والأدوار user/model"""
+                contents, system = [], []
+                for msg in messages:
+                    if isinstance(msg, tuple):
+                        role, text = msg
+                    else:
+                        role, text = getattr(msg, 'type', 'human'), getattr(msg, 'content', str(msg))
+                    if role == 'system':
+                        system.append(text)
+                    else:
+                        contents.append({"role": "model" if role == 'ai' else "user", "parts": [{"text": text}]})
+                payload = {"contents": contents}
+                if system:
+                    payload["systemInstruction"] = {"parts": [{"text": "\n\n".join(system)}]}
+                return payload
+            
+            @staticmethod
+            def _text(result: Dict[str, Any]) -> str:
+                parts = result.get('candidates', [{}])[0].get('content', {}).get('parts', [])
+                return ''.join(part.get('text', '') for part in parts)
+            
+            @staticmethod
+            def _sse_data(line) -> Optional[Dict[str, Any]]:
+                """سطر بيانات واحد من استجابة streamGenerateContent بصيغة SSE"""
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.startswith('data:'):
+                    return None
+                try:
+                    return json.loads(line[5:].strip())
+                except ValueError:
+                    return None
             
             def invoke(self, messages):
                 """استدعاء Gemini API"""
                 try:
-                    # تحويل الرسائل إلى صيغة Gemini
-                    content = []
-                    for msg in messages:
-                        if hasattr(msg, 'content'):
-                            content.append({"parts": [{"text": msg.content}]})
-                        else:
-                            content.append({"parts": [{"text": str(msg)}]})
-                    
-                    payload = {"contents": content}
+                    response = self.transport.post(
+                        f"{self.base_url}/models/{self.model}:generateContent",
+                        headers=self.headers,
+                        json=self._payload(messages)
+                    )
                     
-                    response = requests.post(
+                    if response.status_code == 200:
+                        return type('Response', (), {'content': self._text(response.json())})()
+                    else:
+                        return type('Response', (), {'content': f'خطأ في Gemini API: {response.text}'})()
+                
+                except Exception as e:
+                    return type('Response', (), {'content': f'خطأ في الاتصال بـ Gemini: {str(e)}'})()
+            
+            async def ainvoke(self, messages):
+                """استدعاء Gemini API بعميل HTTP غير متزامن"""
+                try:
+                    response = await self.transport.apost(
                         f"{self.base_url}/models/{self.model}:generateContent",
-                        headers={
-                            'Content-Type': 'application/json',
-                            'X-goog-api-key': self.api_key
-                        },
-                        json=payload
+                        headers=self.headers,
+                        json=self._payload(messages)
                     )
                     
                     if response.status_code == 200:
-                        result = response.json()
-                        text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-                        return type('Response', (), {'content': text})()
+                        return type('Response', (), {'content': self._text(response.json())})()
                     else:
                         return type('Response', (), {'content': f'خطأ في Gemini API: {response.text}'})()
                 
                 except Exception as e:
                     return type('Response', (), {'content': f'خطأ في الاتصال بـ Gemini: {str(e)}'})()
+            
+            def stream(self, messages):
+                """توليد الرد على أجزاء عبر streamGenerateContent"""
+                url = f"{self.base_url}/models/{self.model}:streamGenerateContent?alt=sse"
+                with self.transport.stream(url, headers=self.headers, json=self._payload(messages)) as response:
+                    if response.status_code != 200:
+                        yield f'خطأ في Gemini API: {response.text}'
+                        return
+                    for line in response.iter_lines():
+                        data = self._sse_data(line)
+                        if data:
+                            yield self._text(data)
+            
+            async def astream(self, messages):
+                """النسخة غير المتزامنة من stream"""
+                url = f"{self.base_url}/models/{self.model}:streamGenerateContent?alt=sse"
+                client = self.transport.async_http_client()
+                async with client.stream('POST', url, headers=self.headers, json=self._payload(messages)) as response:
+                    if response.status_code != 200:
+                        yield f'خطأ في Gemini API: {(await response.aread()).decode("utf-8", "replace")}'
+                        return
+                    async for line in response.aiter_lines():
+                        data = self._sse_data(line)
+                        if data:
+                            yield self._text(data)
         
         return GeminiWrapper(api_key, self.active_model)
 
+class _TokenRelay(BaseCallbackHandler):
+    """تجميع رموز ChatOpenAI المتدفقة وتمرير النص حتى الآن
+    
+    الوكيل قد يستدعي النموذج أكثر من مرة (استدعاء أداة ثم الرد)، فيبدأ النص من جديد مع كل استدعاء.
+    """
+    
+    def __init__(self, on_text: Callable[[str], None]):
+        self.on_text = on_text
+        self.text = ""
+    
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.text = ""
+    
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.text = ""
+    
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.text += token
+            self.on_text(self.text)
+
 class SmartMediaAgent:
-    def __init__(self):
+    def __init__(self, ai_config: Optional[AIConfig] = None):
         """تهيئة وكيل الذكاء الاصطناعي المتطور"""
         self.model_manager = MultiModelAIManager()
         
@@ -142,11 +240,14 @@ class SmartMediaAgent:
         # إعداد نموذج الذكاء الاصطناعي
         self.llm = self.model_manager.create_llm_instance()
         
-        # إعداد الذاكرة (محدث للنسخة الجديدة)
-        from langchain_community.chat_message_histories import ChatMessageHistory
-        from langchain_core.runnables.history import RunnableWithMessageHistory
-        
-        self.memory = ChatMessageHistory()
+        # ذاكرة مستقلة لكل مستخدم بنافذة محدودة بدلاً من سجل واحد مشترك ينمو بلا حد
+        ai_config = ai_config or config_manager.get_ai_config()
+        self.memory = ConversationMemory(
+            max_users=ai_config.memory_max_users,
+            window_turns=ai_config.memory_window_size,
+            max_context_tokens=ai_config.max_context_length,
+            idle_ttl=ai_config.memory_idle_minutes * 60
+        ) if ai_config.enable_memory else None
         self.memory_key = "chat_history"
         
         # إعداد القالب
@@ -158,16 +259,20 @@ class SmartMediaAgent:
         ])
         
         # إنشاء الوكيل
-        if self.llm:
-            agent = create_openai_tools_agent(self.llm, ALL_TOOLS, self.prompt)
-            self.agent_executor = AgentExecutor(
-                agent=agent,
-                tools=ALL_TOOLS,
-                verbose=True,
-                handle_parsing_errors=True
-            )
-        else:
-            self.agent_executor = None
+        self.agent_executor = self._create_agent_executor()
+    
+    def _create_agent_executor(self) -> Optional[AgentExecutor]:
+        """وكيل الأدوات يحتاج نموذجاً يدعم استدعاء الأدوات؛ غلاف Gemini يُستخدم للمحادثة المباشرة"""
+        if not self.llm or not hasattr(self.llm, 'bind_tools'):
+            return None
+        agent = create_openai_tools_agent(self.llm, ALL_TOOLS, self.prompt)
+        return AgentExecutor(
+            agent=agent,
+            tools=ALL_TOOLS,
+            verbose=True,
+            handle_parsing_errors=True,
+            return_intermediate_steps=True
+        )
     
     def _get_system_prompt(self):
         """الحصول على تعليمات النظام"""
@@ -184,7 +289,7 @@ class SmartMediaAgent:
 2. advanced_video_info - استخراج معلومات تفصيلية عن الفيديوهات  
 3. file_converter - تحويل بين صيغ مختلفة
 4. image_processor - معالجة وتحويل الصور
-5. zip_manager - ضغط وفك ضغط الملفات
+5. zip_manager - ضغط عدة ملفات في أرشيف ZIP مقسم تحت حد الإرسال
 6. video_editor - تقطيع وتحرير الفيديوهات
 
 📋 **قواعد التفاعل:**
@@ -225,15 +330,60 @@ class SmartMediaAgent:
 - اشرح العمليات التقنية بطريقة مبسطة
         """
     
+    def _agent_input(self, user_message: str, user_id: Optional[str]) -> Dict[str, Any]:
+        """مدخلات الوكيل مع سجل محادثة المستخدم نفسه فقط"""
+        return {"input": user_message, self.memory_key: self._history(user_id)}
+    
+    def _chat_messages(self, user_message: str, user_id: Optional[str]) -> List[tuple]:
+        """رسائل المحادثة المباشرة مع النموذج (دون أدوات)"""
+        return [("system", self._get_system_prompt()), *self._history(user_id), ("human", user_message)]
+    
+    def _history(self, user_id: Optional[str]) -> List[tuple]:
+        return self.memory.messages(user_id) if self.memory and user_id else []
+    
+    def _remember(self, user_id: Optional[str], user_message: str, output: str):
+        if self.memory and user_id:
+            self.memory.add_turn(user_id, user_message, output)
+    
+    @property
+    def cache_partition(self) -> str:
+        """ردود كل نموذج مخزنة منفصلة عن غيره"""
+        return f"{self.model_manager.active_provider}/{self.model_manager.active_model}"
+    
+    def _cached_response(self, user_message: str, user_id: Optional[str]) -> Optional[str]:
+        """رد مخزن لسؤال متكرر أو مشابه دون استدعاء النموذج"""
+        if not self.llm:
+            return None
+        cached = response_cache.get(self.cache_partition, user_message, self._history(user_id))
+        if cached is not None:
+            self._remember(user_id, user_message, cached)
+        return cached
+    
+    def _complete(self, user_id: Optional[str], user_message: str, output: str,
+                  response: Optional[Dict[str, Any]] = None):
+        """حفظ الدور في ذاكرة المستخدم وتخزين الرد للأسئلة المتكررة"""
+        # السجل قبل إضافة الدور الحالي: هو السياق الذي تولد فيه الرد
+        history = self._history(user_id)
+        self._remember(user_id, user_message, output)
+        # ردود الأدوات تخص رابطاً أو ملفاً بعينه، وردود الأخطاء لا تُعاد
+        if (response or {}).get("intermediate_steps") or output.lstrip().startswith(("❌", "خطأ")):
+            return
+        response_cache.set(self.cache_partition, user_message, output, history)
+    
     def process_message(self, user_message: str, user_id: str = None) -> str:
         """معالجة رسالة المستخدم وإرجاع الرد"""
         try:
-            # إضافة معرف المستخدم للسياق إذا كان متاحاً
-            context = f"[المستخدم {user_id}]: {user_message}" if user_id else user_message
-            
+            cached = self._cached_response(user_message, user_id)
+            if cached is not None:
+                return cached
             if self.agent_executor:
-                response = self.agent_executor.invoke({"input": context})
+                response = self.agent_executor.invoke(self._agent_input(user_message, user_id))
+                self._complete(user_id, user_message, response["output"], response)
                 return response["output"]
+            elif self.llm:
+                output = self.llm.invoke(self._chat_messages(user_message, user_id)).content
+                self._complete(user_id, user_message, output)
+                return output
             else:
                 # وضع التشغيل بدون AI (للاختبار)
                 return self._fallback_response(user_message)
@@ -253,6 +403,81 @@ class SmartMediaAgent:
 """ + self._fallback_response(user_message)
             return f"❌ حدث خطأ في معالجة طلبك: {str(e)}\n💡 حاول مرة أخرى أو جرب صيغة مختلفة للطلب."
     
+    async def aprocess_message(self, user_message: str, user_id: str = None) -> str:
+        """النسخة غير المتزامنة من process_message لوضع asyncio"""
+        try:
+            cached = self._cached_response(user_message, user_id)
+            if cached is not None:
+                return cached
+            if self.agent_executor:
+                response = await self.agent_executor.ainvoke(self._agent_input(user_message, user_id))
+                self._complete(user_id, user_message, response["output"], response)
+                return response["output"]
+            elif self.llm:
+                output = (await self.llm.ainvoke(self._chat_messages(user_message, user_id))).content
+                self._complete(user_id, user_message, output)
+                return output
+            else:
+                return self._fallback_response(user_message)
+                
+        except Exception as e:
+            return f"❌ حدث خطأ في معالجة طلبك: {str(e)}\n💡 حاول مرة أخرى أو جرب صيغة مختلفة للطلب."
+    
+    def stream_message(self, user_message: str, user_id: str = None,
+                       on_text: Optional[Callable[[str], None]] = None) -> str:
+        """معالجة الرسالة مع تمرير النص المتولد حتى الآن إلى on_text فور وصول كل جزء
+        
+        يعيد الرد الكامل كما في process_message، فزمن أول جزء هو ما ينتظره المستخدم.
+        """
+        on_text = on_text or (lambda text: None)
+        try:
+            cached = self._cached_response(user_message, user_id)
+            if cached is not None:
+                return cached
+            response = None
+            if self.agent_executor:
+                relay = _TokenRelay(on_text)
+                response = self.agent_executor.invoke(self._agent_input(user_message, user_id),
+                                                      config={"callbacks": [relay]})
+                output = response["output"]
+            elif self.llm:
+                output = ""
+                for piece in self.llm.stream(self._chat_messages(user_message, user_id)):
+                    output += piece
+                    on_text(output)
+            else:
+                return self._fallback_response(user_message)
+            self._complete(user_id, user_message, output, response)
+            return output
+        except Exception as e:
+            return f"❌ حدث خطأ في معالجة طلبك: {str(e)}\n💡 حاول مرة أخرى أو جرب صيغة مختلفة للطلب."
+    
+    async def astream_message(self, user_message: str, user_id: str = None,
+                              on_text: Optional[Callable[[str], None]] = None) -> str:
+        """النسخة غير المتزامنة من stream_message"""
+        on_text = on_text or (lambda text: None)
+        try:
+            cached = self._cached_response(user_message, user_id)
+            if cached is not None:
+                return cached
+            response = None
+            if self.agent_executor:
+                relay = _TokenRelay(on_text)
+                response = await self.agent_executor.ainvoke(self._agent_input(user_message, user_id),
+                                                             config={"callbacks": [relay]})
+                output = response["output"]
+            elif self.llm:
+                output = ""
+                async for piece in self.llm.astream(self._chat_messages(user_message, user_id)):
+                    output += piece
+                    on_text(output)
+            else:
+                return self._fallback_response(user_message)
+            self._complete(user_id, user_message, output, response)
+            return output
+        except Exception as e:
+            return f"❌ حدث خطأ في معالجة طلبك: {str(e)}\n💡 حاول مرة أخرى أو جرب صيغة مختلفة للطلب."
+    
     def _fallback_response(self, message: str) -> str:
         """رد احتياطي عند عدم توفر AI"""
         import re
@@ -359,10 +584,10 @@ class SmartMediaAgent:
 /clear - مسح الذاكرة
         """
     
-    def clear_memory(self) -> str:
-        """مسح ذاكرة المحادثة"""
-        if self.memory:
-            self.memory.clear()
+    def clear_memory(self, user_id: str = None) -> str:
+        """مسح ذاكرة محادثة المستخدم"""
+        if self.memory and user_id:
+            self.memory.clear(user_id)
         return "🧹 تم مسح ذاكرة المحادثة بنجاح!"
     
     def _setup_default_model(self):
@@ -386,21 +611,17 @@ class SmartMediaAgent:
         
         print("⚠️ لم يتم العثور على نماذج متاحة")
     
+    def rebuild_llm(self):
+        """إعادة إنشاء LLM والوكيل، مثلاً بعد تطبيق إعدادات النقل التي تأخذ العملاء نسخة منها عند إنشائها"""
+        self.llm = self.model_manager.create_llm_instance()
+        self.agent_executor = self._create_agent_executor()
+    
     def switch_model(self, provider: str, model: str) -> str:
         """تبديل النموذج المستخدم"""
         result = self.model_manager.set_active_model(provider, model)
         
         if result['success']:
-            # إعادة إنشاء LLM والوكيل
-            self.llm = self.model_manager.create_llm_instance()
-            if self.llm:
-                agent = create_openai_tools_agent(self.llm, ALL_TOOLS, self.prompt)
-                self.agent_executor = AgentExecutor(
-                    agent=agent,
-                    tools=ALL_TOOLS,
-                    verbose=True,
-                    handle_parsing_errors=True
-                )
+            self.rebuild_llm()
             return f"✅ {result['message']}"
         else:
             return f"❌ {result['error']}"
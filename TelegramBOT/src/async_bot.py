@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+async_bot.py - وضع التشغيل غير المتزامن (asyncio) للبوت
+This module runs the bot on AsyncTeleBot: link inspection and AI chat run as coroutines with
+blocking work in bounded per-stage executors; every other update goes to the shared handlers.
+"""
+
+import asyncio
+import logging
+from typing import Dict
+
+from telebot import util
+from telebot.async_telebot import AsyncTeleBot
+
+# Import local modules
+from .ai_agent import smart_agent
+from . import keyboards
+from . import utils
+from .stages import StageBusyError, StageExecutor, create_stages
+from .progress import render_partial, split_message
+from .intent_router import intent_router
+from .main import bot as threaded_bot, user_states, log_error, system_settings
+
+logger = logging.getLogger(__name__)
+
+
+def register_async_handlers(bot: AsyncTeleBot, stages: Dict[str, StageExecutor]):
+    """تسجيل المعالجات غير المتزامنة
+
+    المساران الأكثر ضغطاً (فحص رابط واحد ومحادثة النموذج) يعملان هنا كـ coroutines؛ الأوامر والأزرار
+    والصور والأوضاع (قص، دمج، تحميل مجمع...) تمر إلى معالجات handlers.py نفسها المسجلة على البوت
+    المتعدد الخيوط، فلا توجد نسخة ثانية منها. التحميلات تمر عبر طابور التحميل وحدوده لكل مستخدم.
+    """
+
+    async def stream_reply(chat_id, message_id, text, user_id) -> str:
+        """عرض رد النموذج تدريجياً: تعديل واحد كل فترة بأحدث نص متولد حتى اكتمال الرد"""
+        interval = system_settings.get("stream_update_interval", 1)
+        latest = {'text': ''}
+        generation = asyncio.ensure_future(stages['llm'].guard(
+            smart_agent.astream_message(text, user_id, lambda partial: latest.update(text=partial))))
+        shown = ""
+        while not generation.done():
+            await asyncio.wait({generation}, timeout=interval)
+            partial = latest['text']
+            if generation.done() or not partial.strip() or partial == shown:
+                continue
+            shown = partial
+            try:
+                await bot.edit_message_text(render_partial(partial), chat_id, message_id, parse_mode='Markdown')
+            except Exception as e:
+                logger.debug(f"تعذر تحديث الرد الجزئي: {e}")
+        return generation.result()
+
+    async def send_reply(chat_id, message_id, text):
+        """الرد النهائي: يُقسم إن تجاوز حد الرسالة، وبنص عادي إن كان Markdown غير صالح"""
+        for index, chunk in enumerate(split_message(text or "…")):
+            for parse_mode in ('Markdown', None):
+                try:
+                    if index == 0:
+                        await bot.edit_message_text(chunk, chat_id, message_id, parse_mode=parse_mode)
+                    else:
+                        await bot.send_message(chat_id, chunk, parse_mode=parse_mode)
+                    break
+                except Exception as e:
+                    if parse_mode is None or "can't parse" not in str(e).lower():
+                        raise
+
+    @bot.message_handler(func=lambda message: True, content_types=util.content_type_media)
+    async def handle_message(message):
+        """رابط واحد أو سؤال للنموذج يُعالجان هنا، وكل ما عداهما يمر إلى المعالجات المشتركة"""
+        try:
+            user_id = message.from_user.id
+            text = message.text if message.text else ""
+            url = utils.extract_url(text)
+            pending_mode = (user_states.get(user_id) or {}).get('mode')
+
+            if (message.content_type != 'text' or text.startswith('/') or pending_mode
+                    or len(utils.extract_urls(text)) > 1):
+                # إضافة إلى مجمع عمال البوت المتعدد الخيوط دون انتظار
+                threaded_bot.process_new_messages([message])
+            elif url:
+                user_states[user_id] = {'url': url}
+                info_msg = await bot.send_message(message.chat.id, "🔍 جاري فحص الرابط...")
+                keyboard = await stages['extract'].run(keyboards.create_dynamic_download_options, url)
+                await bot.edit_message_text("اختر خيارات التحميل:", message.chat.id, info_msg.message_id, reply_markup=keyboard)
+            else:
+                # الطلبات الشائعة الواضحة تُجاب محلياً دون استدعاء النموذج
+                intent = intent_router.route(text)
+                if intent:
+                    await bot.send_message(message.chat.id, intent_router.response(intent.intent),
+                                           reply_markup=keyboards.create_intent_keyboard(intent.intent), parse_mode='Markdown')
+                    return
+                thinking_msg = await bot.send_message(message.chat.id, "🤖 جاري التفكير...")
+                ai_response = await stream_reply(message.chat.id, thinking_msg.message_id, text, str(user_id))
+                await send_reply(message.chat.id, thinking_msg.message_id, ai_response)
+                suggested_keyboard = utils.suggest_actions_based_on_query(text)
+                if suggested_keyboard:
+                    await bot.send_message(message.chat.id, "💡 إجراءات مقترحة:", reply_markup=suggested_keyboard)
+
+        except StageBusyError:
+            await bot.send_message(message.chat.id, "⏳ البوت مشغول حالياً، حاول بعد قليل.")
+        except Exception as e:
+            log_error(f"خطأ في معالجة الرسالة: {str(e)}\n{message.text}")
+            await bot.send_message(message.chat.id, "❌ حدث خطأ في معالجة طلبك.")
+
+    @bot.callback_query_handler(func=lambda call: True)
+    async def handle_callback(call):
+        """الأزرار كلها تمر إلى المعالجات المشتركة (أزرار التحميل تضيف المهام إلى طابور التحميل)"""
+        threaded_bot.process_new_callback_query([call])
+
+
+async def run_async(token: str):
+    """تشغيل البوت في وضع asyncio"""
+    bot = AsyncTeleBot(token)
+    stages = create_stages(system_settings)
+    register_async_handlers(bot, stages)
+
+    logger.info("⚡ وضع asyncio نشط")
+    try:
+        await bot.delete_webhook()
+        await bot.infinity_polling(interval=1, timeout=60)
+    finally:
+        for stage in stages.values():
+            stage.shutdown()
+        await bot.close_session()
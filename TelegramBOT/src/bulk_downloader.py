@@ -0,0 +1,180 @@
+"""
+bulk_downloader.py - محرك التحميل المجمع وقوائم التشغيل: تحميل متوازٍ محدود وتسليم بالترتيب مع استئناف
+"""
+
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_KEY = "active"
+
+
+class BulkDownloadEngine:
+    """تحميل عدة روابط بالتوازي وإرسال النتائج بترتيبها الأصلي
+
+    حالة كل مهمة تُحفظ في مخزن الحالة بعد كل عنصر يُسلم، فتُستأنف المهام
+    غير المكتملة من أول عنصر لم يُرسل بعد إعادة التشغيل.
+    """
+
+    def __init__(self, download_item: Callable[[str, str], Dict[str, Any]],
+                 deliver_item: Callable[[Dict[str, Any], int, Dict[str, Any]], None],
+                 state, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 max_parallel: int = 3, max_items: int = 50,
+                 on_complete: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 slots: Optional[threading.Semaphore] = None, max_jobs_per_user: Optional[int] = None,
+                 on_abort: Optional[Callable[[Dict[str, Any], List[Dict[str, Any]]], None]] = None):
+        self.download_item = download_item
+        self.deliver_item = deliver_item
+        self.state = state
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        # يُستدعى إن توقفت المهمة قبل اكتمالها مع نتائج التحميلات التي لم تُسلم (لتحرير ملفاتها)
+        self.on_abort = on_abort
+        self.max_parallel = max_parallel
+        self.max_items = max_items
+        # حد التحميل العام المشترك مع طابور التحميل، وعدد المهام المجمعة النشطة لكل مستخدم
+        self.slots = slots
+        self.max_jobs_per_user = max_jobs_per_user
+        # عدد العناصر المسموح بتحميلها قبل تسليم العنصر الحالي
+        self.window = max_parallel * 2
+        self._threads: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def start(self, chat_id: int, user_id: int, urls: List[str], download_type: str = "download_best",
+              title: Optional[str] = None, **extra) -> Dict[str, Any]:
+        """إنشاء مهمة مجمعة وتشغيلها في الخلفية"""
+        if not urls:
+            return {'success': False, 'error': "لا توجد روابط للتحميل"}
+
+        job = {
+            'job_id': uuid.uuid4().hex[:8],
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'title': title,
+            'download_type': download_type,
+            'urls': list(urls)[:self.max_items],
+            'truncated': len(urls) > self.max_items,
+            'delivered': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'finished': False
+        }
+        job.update(extra)
+        with self._lock:
+            active_jobs = self.get_user_jobs(user_id)
+            if self.max_jobs_per_user and len(active_jobs) >= self.max_jobs_per_user:
+                return {'success': False, 'error': f"لديك {len(active_jobs)} مهمة مجمعة جارية، انتظر انتهاءها"}
+            self._save(job)
+            active = self.state.get(ACTIVE_KEY) or []
+            self.state[ACTIVE_KEY] = active + [job['job_id']]
+        self._launch(job)
+        return {'success': True, 'job': job}
+
+    def resume_all(self) -> int:
+        """استئناف المهام غير المكتملة بعد إعادة التشغيل"""
+        resumed = 0
+        for job_id in self.state.get(ACTIVE_KEY) or []:
+            job = self.state.get(job_id)
+            if job and not job.get('finished') and job_id not in self._threads:
+                logger.info(f"🔁 استئناف مهمة مجمعة {job_id} من العنصر {job['delivered'] + 1}/{len(job['urls'])}")
+                self._launch(job)
+                resumed += 1
+        return resumed
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.state.get(job_id)
+
+    def get_user_jobs(self, user_id: int) -> List[Dict[str, Any]]:
+        """المهام المجمعة غير المكتملة للمستخدم"""
+        jobs = (self.state.get(job_id) for job_id in self.state.get(ACTIVE_KEY) or [])
+        return [job for job in jobs if job and job['user_id'] == user_id and not job.get('finished')]
+
+    def wait(self, job_id: str, timeout: Optional[float] = None):
+        """انتظار انتهاء مهمة (للاختبارات والإيقاف)"""
+        thread = self._threads.get(job_id)
+        if thread:
+            thread.join(timeout)
+
+    def _launch(self, job: Dict[str, Any]):
+        thread = threading.Thread(target=self._run, args=(job,), name=f"bulk-{job['job_id']}", daemon=True)
+        with self._lock:
+            self._threads[job['job_id']] = thread
+        thread.start()
+
+    def _run(self, job: Dict[str, Any]):
+        urls = job['urls']
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix=f"bulk-{job['job_id']}") as pool:
+                next_submit = job['delivered']
+                for index in range(job['delivered'], len(urls)):
+                    # نافذة منزلقة: التحميل يسبق التسليم بعدد محدود من العناصر
+                    while next_submit < len(urls) and next_submit - index < self.window:
+                        futures[next_submit] = pool.submit(self._download, urls[next_submit], job['download_type'])
+                        next_submit += 1
+
+                    result = futures.pop(index).result()
+                    try:
+                        self.deliver_item(job, index, result)
+                    except Exception as e:
+                        logger.error(f"❌ خطأ في تسليم العنصر {index + 1} من المهمة {job['job_id']}: {e}")
+                        result = {'success': False, 'error': str(e)}
+
+                    job['delivered'] = index + 1
+                    job['succeeded' if result.get('success') else 'failed'] += 1
+                    self._save(job)
+                    self._notify(job)
+        finally:
+            job['finished'] = job['delivered'] >= len(urls)
+            if not job['finished']:
+                # التحرير يسبق الحفظ حتى لا يمنعه تعطل مخزن الحالة نفسه الذي أوقف المهمة
+                self._abort(job, [future.result() for future in futures.values()])
+            self._save(job)
+            if job['finished']:
+                self._complete(job)
+                with self._lock:
+                    active = self.state.get(ACTIVE_KEY) or []
+                    self.state[ACTIVE_KEY] = [j for j in active if j != job['job_id']]
+            self._notify(job)
+            with self._lock:
+                self._threads.pop(job['job_id'], None)
+
+    def _download(self, url: str, download_type: str) -> Dict[str, Any]:
+        try:
+            if self.slots is None:
+                return self.download_item(url, download_type)
+            with self.slots:
+                return self.download_item(url, download_type)
+        except Exception as e:
+            return {'success': False, 'error': f"خطأ في التحميل: {str(e)}"}
+
+    def _complete(self, job: Dict[str, Any]):
+        """تنفيذ خطوة ما بعد اكتمال كل العناصر (مثل إنشاء أرشيف) قبل إزالة المهمة من النشطة"""
+        if self.on_complete:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                logger.error(f"❌ خطأ في إنهاء المهمة المجمعة {job['job_id']}: {e}")
+
+    def _abort(self, job: Dict[str, Any], undelivered: List[Dict[str, Any]]):
+        """تحرير موارد مهمة توقفت قبل اكتمالها (التحميلات المنتهية موجودة لأن المجمع ينتظرها عند الإغلاق)"""
+        logger.warning(f"⚠️ توقفت المهمة المجمعة {job['job_id']} عند العنصر {job['delivered'] + 1}/{len(job['urls'])}")
+        if self.on_abort:
+            try:
+                self.on_abort(job, undelivered)
+            except Exception as e:
+                logger.error(f"❌ خطأ في تحرير موارد المهمة المجمعة {job['job_id']}: {e}")
+
+    def _notify(self, job: Dict[str, Any]):
+        if self.on_progress:
+            try:
+                self.on_progress(job)
+            except Exception as e:
+                logger.warning(f"⚠️ خطأ في تحديث تقدم المهمة المجمعة: {e}")
+
+    def _save(self, job: Dict[str, Any]):
+        self.state[job['job_id']] = job
@@ -34,6 +34,9 @@ class AIConfig:
     temperature: float = 0.7
     enable_memory: bool = True
     memory_window_size: int = 10
+    memory_max_users: int = 1000
+    memory_idle_minutes: int = 60
+    memory_persist: bool = True
 
 class ConfigManager:
     """مدير الإعدادات المتقدم"""
@@ -0,0 +1,116 @@
+"""
+conversation_memory.py - ذاكرة محادثة مستقلة لكل مستخدم بنافذة محدودة وملخص للأدوار القديمة
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+Turn = Tuple[str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """تقدير تقريبي لعدد الرموز (حوالي 3 أحرف لكل رمز للنصوص العربية والإنجليزية)"""
+    return max(1, len(text) // 3)
+
+
+_SUMMARY_LABELS = {'human': ("المستخدم", 120), 'ai': ("المساعد", 200)}
+
+
+def extractive_summary(summary: str, turns: List[Turn], max_chars: int) -> str:
+    """ملخص سريع دون استدعاء نموذج: أول سطر من كل سؤال وجوابه مع الاحتفاظ بالأحدث عند امتلاء الحد"""
+    lines = [line for line in summary.split('\n') if line] if summary else []
+    for role, text in turns:
+        if role in _SUMMARY_LABELS:
+            label, limit = _SUMMARY_LABELS[role]
+            first_line = text.strip().split('\n')[0]
+            lines.append(f"- {label}: {first_line[:limit]}")
+    while lines and len('\n'.join(lines)) > max_chars:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+class ConversationMemory:
+    """سجلات محادثة لكل مستخدم في ذاكرة LRU محدودة
+
+    كل سجل محدود بعدد أدوار وعدد رموز؛ الأدوار الأقدم تُطوى في ملخص قصير. السجلات الخاملة
+    تُطرد من الذاكرة وتُستعاد من المخزن الدائم (إن وُجد) عند عودة المستخدم.
+    """
+
+    def __init__(self, max_users: int = 1000, window_turns: int = 10, max_context_tokens: int = 4000,
+                 idle_ttl: Optional[float] = 3600, store=None,
+                 summarizer: Optional[Callable[[str, List[Turn], int], str]] = None):
+        self.window_turns = window_turns
+        self.max_context_tokens = max_context_tokens
+        # الملخص لا يتجاوز ربع ميزانية السياق
+        self.max_summary_chars = max_context_tokens * 3 // 4
+        self.store = store
+        self.summarizer = summarizer or extractive_summary
+        self._active = TTLCache(max_size=max_users, ttl=idle_ttl)
+        self._lock = threading.RLock()
+
+    def attach_store(self, store):
+        """ربط مخزن دائم (مثل StateNamespace) لحفظ السجلات بعد طردها من الذاكرة"""
+        self.store = store
+
+    def messages(self, user_id: Any) -> List[Turn]:
+        """الرسائل التي تُمرر للنموذج: الملخص (إن وُجد) ثم الأدوار الأخيرة"""
+        record = self._load(user_id)
+        history: List[Turn] = []
+        if record['summary']:
+            history.append(('system', f"ملخص ما سبق من المحادثة:\n{record['summary']}"))
+        history.extend((role, text) for role, text in record['turns'])
+        return history
+
+    def add_turn(self, user_id: Any, user_message: str, ai_message: str):
+        """إضافة سؤال وجواب ثم قص السجل إلى النافذة وميزانية الرموز"""
+        with self._lock:
+            record = self._load(user_id)
+            record['turns'].extend([['human', user_message], ['ai', ai_message]])
+            self._trim(record)
+            self._active.set(str(user_id), record)
+            if self.store is not None:
+                # نسخة مستقلة حتى لا يتغير السجل أثناء الكتابة المؤجلة إلى المخزن
+                self.store[user_id] = {'summary': record['summary'], 'turns': [list(turn) for turn in record['turns']]}
+
+    def clear(self, user_id: Any):
+        with self._lock:
+            self._active.pop(str(user_id))
+            if self.store is not None:
+                self.store.pop(user_id)
+
+    def context_tokens(self, user_id: Any) -> int:
+        return sum(estimate_tokens(text) for _, text in self.messages(user_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._active.stats(), window_turns=self.window_turns, max_context_tokens=self.max_context_tokens)
+
+    def _load(self, user_id: Any) -> Dict[str, Any]:
+        key = str(user_id)
+        with self._lock:
+            record = self._active.get(key)
+            if record is None:
+                stored = self.store.get(user_id) if self.store is not None else None
+                record = {'summary': stored.get('summary', ''), 'turns': list(stored.get('turns', []))} if stored \
+                    else {'summary': '', 'turns': []}
+                self._active.set(key, record)
+            return record
+
+    def _trim(self, record: Dict[str, Any]):
+        """طي أقدم الأدوار في الملخص حتى يعود السجل ضمن الحدود"""
+        turns = record['turns']
+        removed: List[Turn] = []
+        budget = self.max_context_tokens - estimate_tokens(record['summary'])
+        while len(turns) > 2 and (len(turns) > self.window_turns * 2
+                                  or sum(estimate_tokens(text) for _, text in turns) > budget):
+            removed.extend(tuple(turn) for turn in turns[:2])
+            del turns[:2]
+        if removed:
+            try:
+                record['summary'] = self.summarizer(record['summary'], removed, self.max_summary_chars)
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر تلخيص المحادثة: {e}")
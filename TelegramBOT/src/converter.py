@@ -0,0 +1,143 @@
+"""
+converter.py - محرك تحويل الوسائط عبر FFmpeg مع نسخ المسارات المتوافقة وتخزين النتائج
+"""
+
+import os
+import json
+import uuid
+import logging
+import subprocess
+from typing import Any, Dict, List, Optional
+
+from .ffmpeg_pool import ffmpeg_pool
+from .media_store import media_store
+
+logger = logging.getLogger(__name__)
+
+# لكل صيغة إخراج: الترميزات المقبولة بنسخ مباشر (None = أي ترميز) والمرمز الافتراضي عند الحاجة للتحويل
+OUTPUT_FORMATS: Dict[str, Dict[str, Any]] = {
+    'mp4': {'video': ('h264', 'hevc', 'av1', 'mpeg4'), 'audio': ('aac', 'mp3', 'alac', 'opus'),
+            'vencoder': ['libx264', '-preset', 'veryfast', '-crf', '23'], 'aencoder': ['aac', '-b:a', '192k'],
+            'extra': ['-movflags', '+faststart']},
+    'mov': {'video': ('h264', 'hevc', 'prores', 'mpeg4'), 'audio': ('aac', 'alac', 'pcm_s16le'),
+            'vencoder': ['libx264', '-preset', 'veryfast', '-crf', '23'], 'aencoder': ['aac', '-b:a', '192k'],
+            'extra': ['-movflags', '+faststart']},
+    'mkv': {'video': None, 'audio': None,
+            'vencoder': ['libx264', '-preset', 'veryfast', '-crf', '23'], 'aencoder': ['aac', '-b:a', '192k']},
+    'webm': {'video': ('vp8', 'vp9', 'av1'), 'audio': ('opus', 'vorbis'),
+             'vencoder': ['libvpx-vp9', '-b:v', '0', '-crf', '32', '-row-mt', '1'], 'aencoder': ['libopus', '-b:a', '128k']},
+    'avi': {'video': ('mpeg4', 'h264', 'mjpeg'), 'audio': ('mp3', 'ac3', 'pcm_s16le'),
+            'vencoder': ['mpeg4', '-q:v', '3'], 'aencoder': ['libmp3lame', '-q:a', '2']},
+    'gif': {'video': (), 'audio': False,
+            'vencoder': ['gif', '-vf', 'fps=12,scale=480:-1:flags=lanczos']},
+    'mp3': {'video': False, 'audio': ('mp3',), 'aencoder': ['libmp3lame', '-q:a', '0']},
+    'm4a': {'video': False, 'audio': ('aac', 'alac'), 'aencoder': ['aac', '-b:a', '192k']},
+    'aac': {'video': False, 'audio': ('aac',), 'aencoder': ['aac', '-b:a', '192k']},
+    'opus': {'video': False, 'audio': ('opus',), 'aencoder': ['libopus', '-b:a', '128k']},
+    'ogg': {'video': False, 'audio': ('vorbis', 'opus'), 'aencoder': ['libvorbis', '-q:a', '5']},
+    'flac': {'video': False, 'audio': ('flac',), 'aencoder': ['flac']},
+    'wav': {'video': False, 'audio': ('pcm_s16le',), 'aencoder': ['pcm_s16le']},
+}
+
+
+class MediaConverter:
+    """تحويل الملفات بين الصيغ: نسخ المسار عند توافق الترميز وإعادة الترميز فقط عند الحاجة"""
+
+    def __init__(self, pool=None, store=None, output_dir: str = "media/processed",
+                 ffprobe_path: str = "ffprobe", default_timeout: float = 600):
+        self.pool = pool or ffmpeg_pool
+        self.store = store or media_store
+        self.output_dir = output_dir
+        self.ffprobe_path = ffprobe_path
+        self.default_timeout = default_timeout
+
+    def probe(self, path: str) -> Dict[str, Any]:
+        """قراءة ترميزات المسارات بواسطة ffprobe"""
+        command = [self.ffprobe_path, '-v', 'error', '-show_entries', 'stream=index,codec_type,codec_name',
+                   '-of', 'json', path]
+        completed = subprocess.run(command, capture_output=True, timeout=30)
+        if completed.returncode != 0:
+            raise ValueError(completed.stderr.decode('utf-8', 'replace').strip() or "ffprobe failed")
+
+        streams = json.loads(completed.stdout or b'{}').get('streams', [])
+        first = lambda kind: next((s.get('codec_name') for s in streams if s.get('codec_type') == kind), None)
+        return {'video': first('video'), 'audio': first('audio')}
+
+    def build_command(self, source: str, codecs: Dict[str, Optional[str]], output_format: str,
+                      output: str) -> Dict[str, Any]:
+        """بناء معاملات FFmpeg لكل (ترميز الإدخال، صيغة الإخراج)"""
+        spec = OUTPUT_FORMATS[output_format]
+        args: List[str] = ['-i', source]
+        copied: List[str] = []
+        transcoded: List[str] = []
+
+        for kind, flag, encoder_key in (('video', 'v', 'vencoder'), ('audio', 'a', 'aencoder')):
+            accepted = spec.get(kind)
+            if accepted is False or not codecs.get(kind):
+                args.append(f'-{flag}n')
+                continue
+
+            args += ['-map', f'0:{flag}:0']
+            if accepted is None or codecs[kind] in accepted:
+                args += [f'-c:{flag}', 'copy']
+                copied.append(kind)
+            else:
+                encoder = spec[encoder_key]
+                args += [f'-c:{flag}', encoder[0], *encoder[1:]]
+                transcoded.append(kind)
+
+        args += spec.get('extra', [])
+        args.append(output)
+        return {'args': args, 'stream_copy': copied, 'transcoded': transcoded}
+
+    def convert(self, input_file: str, output_format: str, timeout: Optional[float] = None,
+                job_id: Optional[str] = None) -> Dict[str, Any]:
+        """تحويل ملف مع إعادة استخدام نتيجة التحويل نفسه إن سبق تنفيذه"""
+        output_format = output_format.lower().lstrip('.')
+        if output_format not in OUTPUT_FORMATS:
+            return {'success': False, 'error': f"صيغة غير مدعومة: {output_format}"}
+        if not os.path.exists(input_file):
+            return {'success': False, 'error': f"الملف غير موجود: {input_file}"}
+
+        source_key = f"convert|{self.store.hash_file(input_file)}|{output_format}"
+        cached = self.store.lookup(source_key)
+        if cached:
+            return {'success': True, 'filepath': cached['path'], 'from_cache': True,
+                    'stream_copy': cached['metadata'].get('stream_copy', []),
+                    'transcoded': cached['metadata'].get('transcoded', [])}
+
+        try:
+            codecs = self.probe(input_file)
+        except (ValueError, OSError, subprocess.TimeoutExpired) as e:
+            return {'success': False, 'error': f"تعذر قراءة الملف: {e}"}
+        if not codecs['video'] and not codecs['audio']:
+            return {'success': False, 'error': "لا توجد مسارات صوت أو فيديو في الملف"}
+        if OUTPUT_FORMATS[output_format].get('audio') is False and not codecs['video']:
+            return {'success': False, 'error': f"الملف لا يحتوي على فيديو للتحويل إلى {output_format}"}
+        if OUTPUT_FORMATS[output_format].get('video') is False and not codecs['audio']:
+            return {'success': False, 'error': f"الملف لا يحتوي على صوت للتحويل إلى {output_format}"}
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        output = os.path.join(self.output_dir, f"{base_name}_{uuid.uuid4().hex[:6]}.{output_format}")
+        command = self.build_command(input_file, codecs, output_format, output)
+
+        result = self.pool.run(command['args'], timeout or self.default_timeout, job_id)
+        if not result['success']:
+            if os.path.exists(output):
+                os.remove(output)
+            return result
+
+        stored = self.store.put(output, source_key, {'stream_copy': command['stream_copy'],
+                                                     'transcoded': command['transcoded'],
+                                                     'source': os.path.basename(input_file)})
+        return {'success': True, 'filepath': stored, 'from_cache': False,
+                'stream_copy': command['stream_copy'], 'transcoded': command['transcoded']}
+
+    def cancel(self, job_id: str) -> bool:
+        """إلغاء تحويل جارٍ"""
+        return self.pool.cancel(job_id)
+
+
+# إنشاء مثيل وحيد
+converter = MediaConverter()
@@ -0,0 +1,150 @@
+"""
+ffmpeg_pool.py - مجمع محدود لعمليات FFmpeg بحجم أنوية المعالج
+"""
+
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# صيغ الإخراج الصوتية المدعومة للتحويل الصريح
+AUDIO_CODECS = {
+    'mp3': ('libmp3lame', 'mp3'),
+    'aac': ('aac', 'm4a'),
+    'm4a': ('aac', 'm4a'),
+    'opus': ('libopus', 'opus'),
+    'ogg': ('libvorbis', 'ogg'),
+}
+
+
+class FFmpegPool:
+    """تشغيل عمليات FFmpeg بعدد متزامن لا يتجاوز أنوية المعالج مع حد لطابور الانتظار
+
+    لكل عملية مهلة اختيارية وعدد خيوط محدود (-threads)، ويمكن إلغاء عملية جارية بمعرفها.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: int = 100, ffmpeg_path: str = "ffmpeg",
+                 threads_per_job: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_pending = max_pending
+        self.ffmpeg_path = ffmpeg_path
+        self.threads_per_job = threads_per_job or max(1, (os.cpu_count() or 2) // self.max_workers)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._cancelled: set = set()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def configure(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                  threads_per_job: Optional[int] = None):
+        """تحديث حجم المجمع (قبل بدء الاستخدام)"""
+        with self._lock:
+            if max_workers:
+                self.max_workers = max_workers
+                self._slots = threading.BoundedSemaphore(max_workers)
+                self.threads_per_job = max(1, (os.cpu_count() or 2) // max_workers)
+            if threads_per_job:
+                self.threads_per_job = threads_per_job
+            if max_pending is not None:
+                self.max_pending = max_pending
+
+    def is_available(self) -> bool:
+        return shutil.which(self.ffmpeg_path) is not None
+
+    def run(self, args: List[str], timeout: Optional[float] = None, job_id: Optional[str] = None) -> Dict[str, Any]:
+        """تشغيل FFmpeg بالمعاملات المعطاة بعد حجز مكان في المجمع"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                return {'success': False, 'error': "طابور المعالجة ممتلئ، حاول لاحقاً"}
+            self._pending += 1
+
+        try:
+            with self._slots:
+                if job_id and job_id in self._cancelled:
+                    return {'success': False, 'cancelled': True, 'error': "تم إلغاء المعالجة"}
+                # -threads قبل ملف الإخراج (آخر معامل) يحد خيوط الترميز لكل عملية
+                command = [self.ffmpeg_path, '-hide_banner', '-nostdin', '-y',
+                           *args[:-1], '-threads', str(self.threads_per_job), *args[-1:]]
+                process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                if job_id:
+                    with self._lock:
+                        self._processes[job_id] = process
+                try:
+                    _, stderr = process.communicate(timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.communicate()
+                    self.failed += 1
+                    return {'success': False, 'error': "انتهت مهلة المعالجة"}
+        except OSError as e:
+            self.failed += 1
+            return {'success': False, 'error': f"تعذر تشغيل FFmpeg: {e}"}
+        finally:
+            with self._lock:
+                self._pending -= 1
+                if job_id:
+                    self._processes.pop(job_id, None)
+                    self._cancelled.discard(job_id)
+
+        if job_id and self._was_killed(process):
+            return {'success': False, 'cancelled': True, 'error': "تم إلغاء المعالجة"}
+
+        if process.returncode != 0:
+            self.failed += 1
+            lines = stderr.decode('utf-8', 'replace').strip().splitlines()
+            return {'success': False, 'error': lines[-1] if lines else f"FFmpeg exit {process.returncode}"}
+
+        self.completed += 1
+        return {'success': True}
+
+    def cancel(self, job_id: str) -> bool:
+        """إلغاء عملية جارية أو منتظرة بمعرفها"""
+        with self._lock:
+            self._cancelled.add(job_id)
+            process = self._processes.get(job_id)
+        if process and process.poll() is None:
+            process.kill()
+            return True
+        return False
+
+    @staticmethod
+    def _was_killed(process: subprocess.Popen) -> bool:
+        return process.returncode in (-9, -15)
+
+    def transcode_audio(self, source: str, output_base: str, codec: str = 'mp3', quality: str = '0',
+                        timeout: Optional[float] = None) -> Dict[str, Any]:
+        """تحويل ملف صوتي إلى ترميز آخر؛ quality هي '0' لأفضل VBR أو معدل بت بالكيلوبت"""
+        if codec not in AUDIO_CODECS:
+            return {'success': False, 'error': f"ترميز غير مدعوم: {codec}"}
+
+        encoder, ext = AUDIO_CODECS[codec]
+        output = f"{output_base}.{ext}"
+        quality_args = ['-q:a', '0'] if quality == '0' and codec == 'mp3' else ['-b:a', f"{quality if quality != '0' else '192'}k"]
+        result = self.run(['-i', source, '-vn', '-c:a', encoder, *quality_args, output], timeout)
+        if result['success']:
+            result['output'] = output
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'threads_per_job': self.threads_per_job,
+                'pending': self._pending,
+                'running': len(self._processes),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+
+# إنشاء مثيل وحيد
+ffmpeg_pool = FFmpegPool()
@@ -0,0 +1,134 @@
+"""
+file_id_cache.py - ذاكرة دائمة لمعرفات ملفات تيليجرام لإعادة الإرسال دون رفع جديد
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramFileIdCache:
+    """ربط (الرابط الموحد، الصيغة، نوع الوسائط) بمعرف الملف الذي أعاده تيليجرام بعد أول رفع"""
+
+    def __init__(self, path: str = "data/file_id_cache.json", max_entries: int = 5000,
+                 max_age: float = 30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(canonical_url: str, format_spec: str, media_kind: str) -> str:
+        """بناء مفتاح الذاكرة"""
+        return f"{canonical_url}|{format_spec}|{media_kind}"
+
+    def get(self, canonical_url: str, format_spec: str, media_kind: str) -> Optional[Dict[str, Any]]:
+        """البحث عن معرف ملف صالح"""
+        key = self.make_key(canonical_url, format_spec, media_kind)
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry and time.time() - entry['created_at'] > self.max_age:
+                del self._entries[key]
+                self._save()
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry['last_used'] = time.time()
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, canonical_url: str, format_spec: str, media_kind: str, file_id: str,
+            send_as: str, title: str = "", file_size: int = 0):
+        """حفظ معرف الملف بعد رفعه"""
+        key = self.make_key(canonical_url, format_spec, media_kind)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            self._entries[key] = {
+                'file_id': file_id,
+                'send_as': send_as,
+                'title': title,
+                'file_size': file_size,
+                'created_at': now,
+                'last_used': now
+            }
+            self._evict()
+            self._save()
+
+    def invalidate(self, canonical_url: str, format_spec: Optional[str] = None,
+                   media_kind: Optional[str] = None) -> int:
+        """حذف المعرفات الخاصة برابط (أو صيغة محددة منه)"""
+        prefix = f"{canonical_url}|"
+        with self._lock:
+            self._ensure_loaded()
+            keys = [
+                key for key in self._entries
+                if key.startswith(prefix)
+                and (format_spec is None or key.split('|')[-2] == format_spec)
+                and (media_kind is None or key.split('|')[-1] == media_kind)
+            ]
+            for key in keys:
+                del self._entries[key]
+            if keys:
+                self._save()
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """إحصائيات الذاكرة"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+    def _evict(self):
+        """حذف المنتهية صلاحيتها ثم الأقل استخداماً عند تجاوز الحد"""
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e['created_at'] > self.max_age]:
+            del self._entries[key]
+
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            oldest = sorted(self._entries, key=lambda k: self._entries[k]['last_used'])[:excess]
+            for key in oldest:
+                del self._entries[key]
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+        except Exception as e:
+            logger.error(f"❌ خطأ في تحميل ذاكرة معرفات الملفات: {e}")
+            self._entries = {}
+
+    def _save(self):
+        """حفظ ذري للملف"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"❌ خطأ في حفظ ذاكرة معرفات الملفات: {e}")
@@ -4,6 +4,7 @@ This module contains all the message and callback handlers for the bot.
 يحتوي هذا الملف على جميع معالجات الرسائل والأزرار الخاصة بالبوت.
 """
 import time
+import threading
 import psutil
 from datetime import datetime
 from telebot import types
@@ -12,7 +13,30 @@ from telebot import types
 from .ai_agent import smart_agent
 from . import keyboards
 from . import utils
-from .main import bot, user_states, get_completed_operations, count_downloaded_files, start_time, handle_download_request, log_error
+from .main import (bot, user_states, get_completed_operations, count_downloaded_files, start_time, download_queue,
+                   log_error, start_bulk_download, start_playlist_download, handle_edit_request,
+                   get_oversize_strategy, set_oversize_strategy, save_uploaded_file, handle_image_request,
+                   system_settings)
+from .progress import StreamingMessageEditor
+from .intent_router import intent_router
+from .response_cache import response_cache
+from .job_queue import JobState
+from .yt_dlp_wrapper import downloader
+
+# صور الألبوم تصل في خيوط متوازية وتعدل حالة المستخدم نفسها
+image_batch_lock = threading.Lock()
+
+# أزرار التحويل تحدد نوع التحميل مسبقاً فيُنفذ مباشرة عند إرسال الرابط
+CONVERT_DOWNLOAD_TYPES = {'convert_mp3': "download_audio_mp3", 'convert_audio': "download_audio_best"}
+
+def submit_job(chat_id, user_id, url, download_type, task=None):
+    """إضافة مهمة إلى طابور التحميل (بحدوده العامة وحد المستخدم) وإبلاغ المستخدم بالرفض أو الترتيب"""
+    submission = download_queue.submit(chat_id, user_id, url, download_type, task=task)
+    if not submission['success']:
+        bot.send_message(chat_id, f"⚠️ {submission['error']}")
+    elif submission['position'] > 1:
+        bot.send_message(chat_id, f"⏳ تمت إضافة طلبك إلى قائمة الانتظار (الترتيب: {submission['position']})\n📋 تابع الحالة عبر /jobs")
+    return submission['success']
 
 def register_handlers():
     """Register all handlers for the bot."""
@@ -30,6 +54,9 @@ def register_handlers():
         uptime = time.time() - start_time
         cpu_percent = psutil.cpu_percent()
         memory = psutil.virtual_memory()
+        paused = [name for name, state in downloader.platform_stats().items() if state['state'] != 'closed']
+        routed = intent_router.stats()
+        cached = response_cache.stats()
         status_text = f"""
     📊 **حالة Smart Media AI Assistant:**
     ⏰ **وقت التشغيل:** {uptime/3600:.1f} ساعة
@@ -40,10 +67,73 @@ def register_handlers():
     • المستخدمين النشطين: {len(user_states)}
     • العمليات المكتملة: {get_completed_operations()}
     • الملفات المحملة: {count_downloaded_files()}
+    • منصات متوقفة مؤقتاً: {', '.join(paused) if paused else 'لا يوجد'}
+    • ردود محلية دون الذكاء الاصطناعي: {routed['local']} من {routed['local'] + routed['llm']}
+    • نسبة الإجابة من ذاكرة الردود: {cached['hit_rate'] * 100:.0f}% ({cached['size']} سؤال)
     ✅ **الحالة:** نشط ويعمل بشكل مثالي!
         """
         bot.send_message(message.chat.id, status_text, parse_mode='Markdown')
 
+    @bot.message_handler(commands=['jobs', 'مهام'])
+    def show_jobs(message):
+        """عرض حالة مهام التحميل الخاصة بالمستخدم"""
+        jobs = download_queue.get_user_jobs(message.from_user.id)
+        if not jobs:
+            bot.send_message(message.chat.id, "📭 لا توجد مهام تحميل حالياً")
+            return
+
+        state_labels = {
+            JobState.QUEUED: "⏳ في الانتظار",
+            JobState.RUNNING: "⚡ قيد التحميل",
+            JobState.DONE: "✅ مكتملة",
+            JobState.FAILED: "❌ فشلت",
+        }
+        lines = ["📋 **مهام التحميل:**"]
+        for job in jobs[-10:]:
+            label = state_labels.get(job.state, job.state)
+            position = download_queue.get_position(job.job_id)
+            suffix = f" (الترتيب: {position})" if position else ""
+            lines.append(f"• `{job.job_id}` - {label}{suffix}")
+        bot.send_message(message.chat.id, "\n".join(lines), parse_mode='Markdown')
+
+    @bot.message_handler(commands=['clear', 'new', 'جديد'])
+    def clear_conversation(message):
+        """بدء محادثة جديدة مع المساعد الذكي"""
+        bot.send_message(message.chat.id, smart_agent.clear_memory(str(message.from_user.id)))
+
+    @bot.message_handler(commands=['oversize', 'حجم'])
+    def choose_oversize_strategy(message):
+        """اختيار طريقة إرسال الملفات الأكبر من حد الإرسال"""
+        keyboard = keyboards.create_oversize_menu(get_oversize_strategy(message.from_user.id))
+        bot.send_message(message.chat.id, "📦 **الملفات الكبيرة:** كيف تريد استلام الملفات التي تتجاوز حد الإرسال؟",
+                         reply_markup=keyboard, parse_mode='Markdown')
+
+    @bot.message_handler(content_types=['photo', 'document'])
+    def handle_image_upload(message):
+        """استقبال الصور (فردية أو ألبوم) وإضافتها إلى دفعة المستخدم"""
+        try:
+            user_id = message.from_user.id
+            if message.photo:
+                file_id, filename = message.photo[-1].file_id, f"photo_{message.message_id}.jpg"
+            elif message.document and (message.document.mime_type or "").startswith("image/"):
+                file_id, filename = message.document.file_id, message.document.file_name or f"image_{message.message_id}"
+            else:
+                bot.send_message(message.chat.id, "⚠️ هذا النوع من الملفات غير مدعوم حالياً")
+                return
+
+            path = save_uploaded_file(file_id, filename)
+            with image_batch_lock:
+                state = user_states.get(user_id) or {}
+                images = state.get('images', []) if state.get('mode') == 'image' else []
+                user_states[user_id] = {'mode': 'image', 'images': images + [path]}
+            # صور الألبوم تصل كرسائل منفصلة: نعرض القائمة مرة واحدة لأول صورة فقط
+            if not images:
+                bot.reply_to(message, "🖼️ اختر العملية (يمكنك إرسال صور أخرى لإضافتها إلى الدفعة):",
+                             reply_markup=keyboards.create_image_processing_menu())
+        except Exception as e:
+            log_error(f"خطأ في استقبال الصورة: {str(e)}")
+            bot.send_message(message.chat.id, "❌ تعذر استلام الصورة.")
+
     @bot.message_handler(func=lambda message: True)
     def handle_message(message):
         """معالجة جميع الرسائل النصية"""
@@ -51,16 +141,54 @@ def register_handlers():
             user_id = message.from_user.id
             text = message.text if message.text else ""
             url = utils.extract_url(text)
+            urls = utils.extract_urls(text)
+            mode = (user_states.get(user_id) or {}).get('mode')
 
-            if url:
+            if urls and mode == 'trim':
+                time_range = utils.extract_time_range(text)
+                if not time_range:
+                    bot.send_message(message.chat.id, utils.handle_trim_action('trim_video'), parse_mode='Markdown')
+                    return
+                user_states.pop(user_id)
+                submit_job(message.chat.id, user_id, urls[0], 'edit_trim',
+                           lambda: handle_edit_request(message.chat.id, user_id, urls[:1], 'trim', *time_range))
+            elif urls and mode == 'merge':
+                if len(urls) < 2:
+                    bot.send_message(message.chat.id, "⚠️ أرسل رابطين على الأقل للدمج")
+                    return
+                user_states.pop(user_id)
+                submit_job(message.chat.id, user_id, urls[0], 'edit_merge',
+                           lambda: handle_edit_request(message.chat.id, user_id, urls, 'merge'))
+            elif url and mode == 'convert':
+                download_type = user_states.pop(user_id)['download_type']
+                submit_job(message.chat.id, user_id, url, download_type)
+            elif urls and mode == 'bulk_zip':
+                user_states.pop(user_id)
+                start_bulk_download(message.chat.id, user_id, urls, deliver_as="zip")
+            elif len(urls) > 1 or (urls and mode == 'bulk'):
+                user_states.pop(user_id)
+                start_bulk_download(message.chat.id, user_id, urls)
+            elif urls and mode == 'playlist':
+                user_states.pop(user_id)
+                start_playlist_download(message.chat.id, user_id, urls[0])
+            elif url:
                 user_states[user_id] = {'url': url}
                 info_msg = bot.send_message(message.chat.id, "🔍 جاري فحص الرابط...")
                 keyboard = keyboards.create_dynamic_download_options(url)
                 bot.edit_message_text("اختر خيارات التحميل:", message.chat.id, info_msg.message_id, reply_markup=keyboard)
             else:
+                # الطلبات الشائعة الواضحة تُجاب محلياً دون استدعاء النموذج
+                intent = intent_router.route(text)
+                if intent:
+                    bot.send_message(message.chat.id, intent_router.response(intent.intent),
+                                     reply_markup=keyboards.create_intent_keyboard(intent.intent), parse_mode='Markdown')
+                    return
                 thinking_msg = bot.send_message(message.chat.id, "🤖 جاري التفكير...")
-                ai_response = smart_agent.query(text)
-                bot.edit_message_text(ai_response, message.chat.id, thinking_msg.message_id, parse_mode='Markdown')
+                # الرد يظهر تدريجياً أثناء توليده بدلاً من انتظار اكتماله
+                reply = StreamingMessageEditor(bot, message.chat.id, thinking_msg.message_id,
+                                               min_interval=system_settings.get("stream_update_interval", 1))
+                ai_response = smart_agent.stream_message(text, str(user_id), reply.feed)
+                reply.finish(ai_response)
                 suggested_keyboard = utils.suggest_actions_based_on_query(text)
                 if suggested_keyboard:
                     bot.send_message(message.chat.id, "💡 إجراءات مقترحة:", reply_markup=suggested_keyboard)
@@ -81,9 +209,58 @@ def register_handlers():
             keyboard = keyboards.create_main_menu()
             bot.edit_message_text("🏠 القائمة الرئيسية - اختر الخدمة المطلوبة:", chat_id, call.message.message_id, reply_markup=keyboard)
         
+        elif data == "bulk_download":
+            user_states[user_id] = {'mode': 'bulk'}
+            bot.send_message(chat_id, utils.handle_bulk_action(data), parse_mode='Markdown')
+        
+        elif data == "playlist_download":
+            user_states[user_id] = {'mode': 'playlist'}
+            bot.send_message(chat_id, utils.handle_playlist_action(data), parse_mode='Markdown')
+        
+        elif data in ("oversize_split", "oversize_compress"):
+            set_oversize_strategy(user_id, data.replace("oversize_", ""))
+            keyboard = keyboards.create_oversize_menu(get_oversize_strategy(user_id))
+            bot.edit_message_reply_markup(chat_id, call.message.message_id, reply_markup=keyboard)
+        
+        elif data == "compress_files":
+            user_states[user_id] = {'mode': 'bulk_zip'}
+            bot.send_message(chat_id, utils.handle_compress_action(data), parse_mode='Markdown')
+        
+        elif data in CONVERT_DOWNLOAD_TYPES:
+            user_states[user_id] = {'mode': 'convert', 'download_type': CONVERT_DOWNLOAD_TYPES[data]}
+            bot.send_message(chat_id, utils.handle_convert_action(data), parse_mode='Markdown')
+        
+        elif data == "image_tools":
+            bot.send_message(chat_id, utils.handle_image_action(data), parse_mode='Markdown')
+        
+        elif data.startswith("process_image_"):
+            # الفحص والسحب تحت القفل نفسه حتى لا تعالج ضغطتان متزامنتان الدفعة مرتين
+            with image_batch_lock:
+                state = user_states.get(user_id) or {}
+                images = user_states.pop(user_id)['images'] if state.get('mode') == 'image' else None
+            if not images:
+                bot.send_message(chat_id, "⚠️ لا توجد صور بانتظار المعالجة، أرسل الصور أولاً")
+            else:
+                operation = data.replace("process_image_", "")
+                if not submit_job(chat_id, user_id, images[0], f"image_{operation}",
+                                  lambda: handle_image_request(chat_id, user_id, images, operation)):
+                    # رُفضت المهمة: نعيد الصور إلى الدفعة ليتمكن المستخدم من المحاولة لاحقاً
+                    with image_batch_lock:
+                        state = user_states.get(user_id) or {}
+                        pending = state.get('images', []) if state.get('mode') == 'image' else []
+                        user_states[user_id] = {'mode': 'image', 'images': images + pending}
+        
+        elif data == "trim_video":
+            user_states[user_id] = {'mode': 'trim'}
+            bot.send_message(chat_id, utils.handle_trim_action(data), parse_mode='Markdown')
+        
+        elif data == "merge_files":
+            user_states[user_id] = {'mode': 'merge'}
+            bot.send_message(chat_id, utils.handle_merge_action(data), parse_mode='Markdown')
+        
         elif data.startswith("download_") and user_id in user_states and 'url' in user_states[user_id]:
             url = user_states[user_id]['url']
-            handle_download_request(chat_id, user_id, url, data)
+            submit_job(chat_id, user_id, url, data)
         
         else:
             bot.answer_callback_query(call.id, f"⚠️ الوظيفة {data} قيد التطوير")
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+image_processor.py - معالجة الصور فردياً ودفعياً بـ Pillow مع فك ترميز مصغر وذاكرة محدودة
+"""
+
+import os
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ('convert', 'resize', 'enhance', 'crop', 'filters', 'compress')
+SAVE_FORMATS = {'jpeg': 'jpg', 'jpg': 'jpg', 'png': 'png', 'webp': 'webp'}
+FILTERS = ('grayscale', 'sepia', 'blur', 'sharpen', 'contour', 'edges')
+
+# فلاتر الالتفاف تحتاج هامشاً حول كل مربع حتى لا تظهر الحدود بين المربعات
+_TILE_MARGIN = 8
+
+
+class ImageProcessor:
+    """تنفيذ عمليات الصور في مجمع خيوط بحجم الأنوية
+
+    الصور الكبيرة لا تُفك بكامل دقتها عند الحاجة لنسخة أصغر: draft() لـ JPEG ثم reduce()
+    قبل إعادة التحجيم، والفلاتر تُطبق على مربعات حتى تبقى الذاكرة المؤقتة محدودة.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, output_dir: str = "media/processed",
+                 max_pixels: int = 40_000_000, tile_size: int = 1024):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.output_dir = output_dir
+        self.max_pixels = max_pixels
+        self.tile_size = tile_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def configure(self, max_workers: Optional[int] = None, max_pixels: Optional[int] = None):
+        """تحديث حجم المجمع وحد البكسلات (قبل بدء الاستخدام)"""
+        if max_workers:
+            self.max_workers = max_workers
+        if max_pixels:
+            self.max_pixels = max_pixels
+
+    # --- Public API ---
+
+    def process(self, path: str, operation: str, **options) -> Dict[str, Any]:
+        """معالجة صورة واحدة وإرجاع مسار الناتج"""
+        if not PIL_AVAILABLE:
+            return {'success': False, 'error': "مكتبة Pillow غير مثبتة"}
+        if operation not in OPERATIONS:
+            return {'success': False, 'error': f"عملية غير مدعومة: {operation}"}
+        if not os.path.exists(path):
+            return {'success': False, 'error': f"الملف غير موجود: {path}"}
+
+        try:
+            return getattr(self, f"_{operation}")(path, **options)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.error(f"خطأ في معالجة الصورة {os.path.basename(path)}: {e}")
+            return {'success': False, 'error': f"تعذر معالجة الصورة: {e}", 'source': path}
+
+    def process_batch(self, paths: List[str], operation: str, **options) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """معالجة عدة صور بالتوازي وإرجاع (الترتيب، النتيجة) فور اكتمال كل صورة
+
+        عدد الصور قيد المعالجة لا يتجاوز ضعف عدد العمال حتى لا تتضخم الذاكرة مع الدفعات الكبيرة.
+        """
+        executor = self._get_executor()
+        window = self.max_workers * 2
+        pending = {}
+        queue = list(enumerate(paths))
+        while queue or pending:
+            while queue and len(pending) < window:
+                index, path = queue.pop(0)
+                pending[executor.submit(self.process, path, operation, **options)] = index
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    # --- Loading ---
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image")
+        return self._executor
+
+    def load(self, path: str, target: Optional[Tuple[int, int]] = None) -> "Image.Image":
+        """فتح صورة بأصغر دقة تكفي للهدف (أو لحد البكسلات) مع تصحيح الاتجاه"""
+        image = Image.open(path)
+        width, height = image.size
+        if target is None and width * height > self.max_pixels:
+            scale = (self.max_pixels / (width * height)) ** 0.5
+            target = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+        if target:
+            # draft يفك ترميز JPEG مباشرة بمقياس 1/2 أو 1/4 أو 1/8 دون تحميل الدقة الكاملة
+            image.draft('RGB' if image.mode not in ('L', 'RGB') else image.mode, target)
+            image = self._downscale(image, target)
+        return ImageOps.exif_transpose(image)
+
+    @staticmethod
+    def _downscale(image: "Image.Image", target: Tuple[int, int]) -> "Image.Image":
+        """تصغير ليتسع داخل الهدف: reduce() بعامل صحيح أولاً ثم LANCZOS للدقة النهائية"""
+        width, height = image.size
+        ratio = min(target[0] / width, target[1] / height)
+        if ratio >= 1:
+            return image
+        factor = int(1 / ratio / 2)
+        if factor >= 2:
+            image = image.reduce(factor)
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        return image.resize(size, Image.LANCZOS)
+
+    def _apply_tiled(self, image: "Image.Image", func: Callable[["Image.Image"], "Image.Image"]) -> "Image.Image":
+        """تطبيق فلتر على مربعات مع هامش، فالذاكرة المؤقتة للفلتر بحجم مربع واحد فقط"""
+        width, height = image.size
+        if width * height <= self.tile_size ** 2:
+            return func(image)
+
+        output = Image.new(image.mode, image.size)
+        for top in range(0, height, self.tile_size):
+            for left in range(0, width, self.tile_size):
+                box = (max(0, left - _TILE_MARGIN), max(0, top - _TILE_MARGIN),
+                       min(width, left + self.tile_size + _TILE_MARGIN), min(height, top + self.tile_size + _TILE_MARGIN))
+                tile = func(image.crop(box))
+                inner = (left - box[0], top - box[1],
+                         left - box[0] + min(self.tile_size, width - left), top - box[1] + min(self.tile_size, height - top))
+                output.paste(tile.crop(inner), (left, top))
+        return output
+
+    def _save(self, image: "Image.Image", source: str, fmt: Optional[str] = None, quality: int = 90,
+              suffix: str = "") -> Dict[str, Any]:
+        fmt = (fmt or (image.format or os.path.splitext(source)[1].lstrip('.') or 'jpeg')).lower()
+        ext = SAVE_FORMATS.get(fmt, 'png')
+        if ext == 'jpg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.splitext(os.path.basename(source))[0]
+        output = os.path.join(self.output_dir, f"{base}{suffix}_{uuid.uuid4().hex[:6]}.{ext}")
+        params = {'jpg': {'quality': quality, 'optimize': True, 'progressive': True},
+                  'webp': {'quality': quality, 'method': 4},
+                  'png': {'optimize': True}}[ext]
+        image.save(output, **params)
+        return {'success': True, 'filepath': output, 'size': image.size, 'source': source}
+
+    # --- Operations ---
+
+    def _convert(self, path: str, format: Optional[str] = None) -> Dict[str, Any]:
+        with Image.open(path) as probe:
+            source_format = (probe.format or '').lower()
+        target = (format or ('png' if source_format == 'jpeg' else 'jpeg')).lower()
+        if target not in SAVE_FORMATS:
+            return {'success': False, 'error': f"صيغة غير مدعومة: {target}"}
+        return self._save(self.load(path), path, target)
+
+    def _resize(self, path: str, max_side: int = 1280) -> Dict[str, Any]:
+        image = self.load(path, (max_side, max_side))
+        return self._save(image, path, suffix=f"_{max_side}")
+
+    def _enhance(self, path: str) -> Dict[str, Any]:
+        image = self.load(path)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image = ImageOps.autocontrast(image, cutoff=1)
+        image = self._apply_tiled(image, lambda tile: tile.filter(ImageFilter.UnsharpMask(radius=2, percent=80, threshold=3)))
+        return self._save(image, path, suffix="_enhanced")
+
+    def _crop(self, path: str, aspect: str = "1:1") -> Dict[str, Any]:
+        try:
+            ratio_w, ratio_h = (float(part) for part in aspect.split(':'))
+        except ValueError:
+            return {'success': False, 'error': f"نسبة غير صحيحة: {aspect}"}
+        image = self.load(path)
+        image = ImageOps.fit(image, self._fit_box(image.size, ratio_w / ratio_h), Image.LANCZOS)
+        return self._save(image, path, suffix="_cropped")
+
+    def _filters(self, path: str, name: str = 'sepia') -> Dict[str, Any]:
+        if name not in FILTERS:
+            return {'success': False, 'error': f"فلتر غير مدعوم: {name}"}
+        image = self.load(path)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        if name == 'grayscale':
+            image = ImageOps.grayscale(image)
+        elif name == 'sepia':
+            image = ImageOps.colorize(ImageOps.grayscale(image), '#2e1f0f', '#f5e6c8', mid='#a0785a')
+        else:
+            kernel = {'blur': ImageFilter.GaussianBlur(2), 'sharpen': ImageFilter.SHARPEN,
+                      'contour': ImageFilter.CONTOUR, 'edges': ImageFilter.FIND_EDGES}[name]
+            image = self._apply_tiled(image, lambda tile: tile.filter(kernel))
+        return self._save(image, path, suffix=f"_{name}")
+
+    def _compress(self, path: str, quality: int = 75, format: str = 'jpeg') -> Dict[str, Any]:
+        image = self.load(path)
+        return self._save(image, path, format, quality=quality, suffix="_compressed")
+
+    @staticmethod
+    def _fit_box(size: Tuple[int, int], ratio: float) -> Tuple[int, int]:
+        width, height = size
+        if width / height > ratio:
+            return max(1, round(height * ratio)), height
+        return width, max(1, round(width / ratio))
+
+
+# إنشاء مثيل وحيد
+image_processor = ImageProcessor()
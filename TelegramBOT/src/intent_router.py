@@ -0,0 +1,246 @@
+"""
+intent_router.py - تصنيف محلي سريع لنية المستخدم يجيب الطلبات الشائعة دون استدعاء وكيل الذكاء الاصطناعي
+"""
+
+import re
+import math
+import logging
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# النية 'other' تعني أن الرسالة تحتاج النموذج
+FALLBACK_INTENT = 'other'
+
+# جداول الكلمات المفتاحية بعد التطبيع (بدون همزات وتاء مربوطة وألف مقصورة)
+INTENT_PATTERNS: Dict[str, List[str]] = {
+    'greeting': [r'مرحبا', r'اهلا', r'السلام عليكم', r'سلام', r'هلا', r'صباح الخير', r'مساء الخير',
+                 r'hi', r'hello', r'hey', r'good (?:morning|evening)'],
+    'thanks': [r'شكرا', r'مشكور', r'يعطيك العافيه', r'thanks?', r'thank you', r'thx'],
+    'help': [r'مساعده', r'ساعدني', r'help', r'كيف استخدم', r'ماذا تستطيع', r'وش تسوي', r'what can you do'],
+    'menu': [r'القائمه', r'قائمه', r'الرئيسيه', r'menu', r'start', r'ابدا'],
+    'tools': [r'الادوات', r'ادوات', r'tools'],
+    'audio': [r'صوت', r'اغنيه', r'اغاني', r'موسيقى', r'mp3', r'audio', r'music', r'song'],
+    'download': [r'تحميل', r'حمل', r'حملي', r'نزل', r'نزلي', r'تنزيل', r'download', r'فيديو', r'video',
+                 r'يوتيوب', r'youtube', r'تيك ?توك', r'tiktok', r'انستا(?:جرام)?', r'instagram'],
+    'convert': [r'تحويل', r'حول', r'صيغه', r'convert', r'format'],
+    'edit': [r'قص', r'تقطيع', r'قطع', r'دمج', r'تحرير', r'trim', r'cut', r'merge', r'edit'],
+    'image': [r'صوره', r'صور', r'image', r'photo', r'فلتر'],
+    'compress': [r'ضغط', r'zip', r'compress', r'ارشيف']
+}
+
+# مشاكل وأسئلة مفتوحة: النموذج أقدر على إجابتها من الرد الجاهز
+DEFER_PATTERNS = [r'لماذا', r'ليش', r'مشكله', r'خطا', r'فشل', r'لا يعمل', r'ما يشتغل', r'الفرق',
+                  r'why', r'error', r'fail', r'problem', r"doesn'?t work", r'difference', r'explain', r'اشرح']
+
+# أدوات الاستفهام: الأسئلة ("ما أفضل صيغة فيديو لانستجرام") تحتاج إجابة وليس قائمة أزرار
+QUESTION_PATTERNS = [r'ما', r'ماذا', r'ماهو', r'ماهي', r'ايش', r'شو', r'كيف', r'هل', r'متى', r'اين', r'وين',
+                     r'كم', r'ايهما', r'what', r'which', r'how', r'when', r'where', r'who', r'is', r'are',
+                     r'can', r'could', r'should', r'does']
+
+# النوايا التي يصلح ردها الجاهز حتى لو جاءت بصيغة سؤال ("ماذا تستطيع؟"، "how does this work")
+QUESTION_SAFE_INTENTS = ('greeting', 'thanks', 'help', 'menu', 'tools')
+
+# النوايا الاجتماعية تُهمل إذا جاءت مع نية عمل في الرسالة نفسها ("مرحبا، حمل فيديو")
+SOCIAL_INTENTS = ('greeting', 'thanks')
+
+# النوايا العامة تتنحى للأكثر تحديداً: "قص الفيديو" تحرير وليست تحميلاً، و"حوله إلى mp3" تحويل
+YIELDS_TO: Dict[str, Tuple[str, ...]] = {
+    'download': ('audio', 'convert', 'edit', 'image', 'compress'),
+    'audio': ('convert', 'edit'),
+    'help': ('download', 'audio', 'convert', 'edit', 'image', 'compress')
+}
+
+# أمثلة تدريب المصنف الاحتياطي (يُستخدم فقط عندما لا تطابق القواعد شيئاً)
+TRAINING_EXAMPLES: List[Tuple[str, str]] = [
+    ("ابي انزل مقطع", 'download'), ("ممكن تجيب لي المقطع", 'download'), ("احفظ الفيديو", 'download'),
+    ("جيب لي الريلز", 'download'), ("save this clip", 'download'), ("grab the reel", 'download'),
+    ("ابي الاغنيه بس", 'audio'), ("استخرج الصوت من المقطع", 'audio'), ("ابي الصوت فقط", 'audio'),
+    ("extract sound only", 'audio'), ("get the track", 'audio'),
+    ("غير الامتداد", 'convert'), ("ابي الملف mp4", 'convert'), ("change it to mkv", 'convert'),
+    ("اقطع اول دقيقه", 'edit'), ("ابي جزء من المقطع", 'edit'), ("اجمع المقاطع", 'edit'),
+    ("clip the first minute", 'edit'), ("join these clips", 'edit'),
+    ("حسن الصوره", 'image'), ("كبر الصوره", 'image'), ("enhance my picture", 'image'), ("resize picture", 'image'),
+    ("اجمع الملفات في ملف واحد", 'compress'), ("pack the files", 'compress'),
+    ("وش تقدر تسوي", 'help'), ("كيف اشتغل معك", 'help'), ("how does this work", 'help'),
+    ("هلا والله", 'greeting'), ("يا هلا", 'greeting'), ("howdy", 'greeting'), ("yo", 'greeting'),
+    ("تسلم", 'thanks'), ("الله يعطيك العافيه", 'thanks'), ("appreciate it", 'thanks'),
+    ("اكتب لي قصه قصيره", FALLBACK_INTENT), ("ما رايك في الذكاء الاصطناعي", FALLBACK_INTENT),
+    ("ترجم هذه الجمله للانجليزيه", FALLBACK_INTENT), ("من انت ومن صنعك", FALLBACK_INTENT),
+    ("لخص لي هذا النص", FALLBACK_INTENT), ("اعطني فكره لمحتوى", FALLBACK_INTENT),
+    ("what is the capital of france", FALLBACK_INTENT), ("write me a poem", FALLBACK_INTENT),
+    ("tell me a joke", FALLBACK_INTENT), ("summarize this text", FALLBACK_INTENT),
+    ("ما افضل جوده للرفع", FALLBACK_INTENT), ("which quality should i pick", FALLBACK_INTENT)
+]
+
+_TASHKEEL = re.compile(r'[ً-ْـ]')
+_NORMALIZE = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي'})
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """تطبيع النص للمطابقة: أحرف صغيرة وحذف التشكيل وتوحيد الهمزات والتاء المربوطة"""
+    return _TASHKEEL.sub('', text.lower()).translate(_NORMALIZE).strip()
+
+
+def _compile(patterns: Iterable[str]) -> "re.Pattern":
+    # تعبير واحد لكل نية بحدود كلمات، مع السماح بأداة التعريف وحروف العطف والجر الملتصقة بالكلمة العربية
+    alternatives = '|'.join(pattern.translate(_NORMALIZE) for pattern in patterns)
+    return re.compile(r'(?<!\w)(?:[وفبل]?(?:ال)?)(?:' + alternatives + r')(?!\w)', re.UNICODE)
+
+
+@dataclass
+class IntentMatch:
+    """نتيجة التصنيف المحلي"""
+    intent: str
+    confidence: float
+    source: str  # 'rules' أو 'classifier'
+
+
+class NaiveBayesIntentClassifier:
+    """مصنف Naive Bayes صغير على الكلمات ومقاطع الأحرف الثلاثية (يتحمل اختلاف تصريف الكلمة العربية)"""
+
+    def __init__(self, alpha: float = 0.5):
+        self.alpha = alpha
+        self._priors: Dict[str, float] = {}
+        self._likelihoods: Dict[str, Dict[str, float]] = {}
+        self._unseen: Dict[str, float] = {}
+
+    @staticmethod
+    def features(text: str) -> List[str]:
+        words = _TOKEN.findall(normalize_text(text))
+        grams = [f"#{word}#"[i:i + 3] for word in words for i in range(len(word))]
+        return words + grams
+
+    def train(self, examples: Iterable[Tuple[str, str]]) -> "NaiveBayesIntentClassifier":
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        docs: Counter = Counter()
+        for text, intent in examples:
+            counts[intent].update(self.features(text))
+            docs[intent] += 1
+        vocabulary = set().union(*counts.values()) if counts else set()
+        total_docs = sum(docs.values())
+        for intent, feature_counts in counts.items():
+            denominator = sum(feature_counts.values()) + self.alpha * (len(vocabulary) + 1)
+            self._priors[intent] = math.log(docs[intent] / total_docs)
+            self._likelihoods[intent] = {f: math.log((c + self.alpha) / denominator) for f, c in feature_counts.items()}
+            self._unseen[intent] = math.log(self.alpha / denominator)
+        return self
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """النية الأرجح واحتمالها"""
+        features = self.features(text)
+        if not self._priors or not features:
+            return FALLBACK_INTENT, 0.0
+        scores = {
+            intent: prior + sum(self._likelihoods[intent].get(f, self._unseen[intent]) for f in features)
+            for intent, prior in self._priors.items()
+        }
+        best = max(scores, key=scores.get)
+        # softmax مستقر عددياً
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+
+class IntentRouter:
+    """مرحلة تصنيف أمام وكيل الذكاء الاصطناعي: الرسائل القصيرة الواضحة تُجاب محلياً والباقي يذهب للنموذج"""
+
+    def __init__(self, enabled: bool = True, max_words: int = 8, classifier_threshold: float = 0.85,
+                 use_classifier: bool = True):
+        self.enabled = enabled
+        self.max_words = max_words
+        self.classifier_threshold = classifier_threshold
+        self._patterns = [(intent, _compile(patterns)) for intent, patterns in INTENT_PATTERNS.items()]
+        self._defer = _compile(DEFER_PATTERNS)
+        self._question = _compile(QUESTION_PATTERNS)
+        self.classifier = NaiveBayesIntentClassifier().train(TRAINING_EXAMPLES) if use_classifier else None
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    def configure(self, enabled: Optional[bool] = None, max_words: Optional[int] = None,
+                  classifier_threshold: Optional[float] = None, use_classifier: Optional[bool] = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if max_words:
+            self.max_words = max_words
+        if classifier_threshold:
+            self.classifier_threshold = classifier_threshold
+        if use_classifier is not None:
+            self.classifier = NaiveBayesIntentClassifier().train(TRAINING_EXAMPLES) if use_classifier else None
+
+    def classify(self, text: str) -> Optional[IntentMatch]:
+        """تصنيف الرسالة؛ None يعني أنها غامضة أو مفتوحة ويجب تمريرها للنموذج"""
+        normalized = normalize_text(text)
+        words = _TOKEN.findall(normalized)
+        if not words or len(words) > self.max_words or self._defer.search(normalized):
+            return None
+
+        question = '?' in text or '؟' in text or bool(self._question.search(normalized))
+        matches = [intent for intent, pattern in self._patterns if pattern.search(normalized)]
+        if len(matches) > 1:
+            matches = [intent for intent in matches if intent not in SOCIAL_INTENTS] or matches[:1]
+            matches = [intent for intent in matches
+                       if not any(other in matches for other in YIELDS_TO.get(intent, ()))]
+        if len(matches) == 1:
+            return self._answerable(IntentMatch(matches[0], 1.0, 'rules'), question)
+        if matches:
+            return None
+
+        if self.classifier:
+            intent, probability = self.classifier.predict(normalized)
+            if intent != FALLBACK_INTENT and probability >= self.classifier_threshold:
+                return self._answerable(IntentMatch(intent, probability, 'classifier'), question)
+        return None
+
+    @staticmethod
+    def _answerable(match: IntentMatch, question: bool) -> Optional[IntentMatch]:
+        """أسئلة الخدمات تذهب للنموذج؛ الرد الجاهز لها قائمة لا تجيب السؤال"""
+        return None if question and match.intent not in QUESTION_SAFE_INTENTS else match
+
+    def route(self, text: str) -> Optional[IntentMatch]:
+        """تصنيف مع تسجيل الإحصائيات؛ لا يصنف شيئاً إذا كان الموجه معطلاً"""
+        if not self.enabled:
+            return None
+        match = self.classify(text)
+        with self._lock:
+            self._counts[match.intent if match else FALLBACK_INTENT] += 1
+        return match
+
+    @staticmethod
+    def response(intent: str) -> str:
+        return INTENT_RESPONSES[intent]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._counts)
+        deferred = counts.pop(FALLBACK_INTENT, 0)
+        return {'local': sum(counts.values()), 'llm': deferred, 'by_intent': counts}
+
+
+INTENT_RESPONSES: Dict[str, str] = {
+    'greeting': "👋 **أهلاً وسهلاً!**\nأنا Smart Media AI Assistant - أرسل رابط فيديو أو اختر خدمة من القائمة:",
+    'thanks': "😊 العفو! إذا احتجت شيئاً آخر فأنا هنا.",
+    'help': ("❓ **كيف أساعدك:**\n"
+             "📹 أرسل رابطاً لتحميل الفيديو أو الصوت\n"
+             "🔄 حول الملفات بين الصيغ\n"
+             "✂️ قص ودمج المقاطع\n"
+             "🖼️ عالج الصور وأرسلها دفعة واحدة\n"
+             "💬 أو اسألني أي سؤال وسأجيبك"),
+    'menu': "🏠 القائمة الرئيسية - اختر الخدمة المطلوبة:",
+    'tools': "🛠️ **جميع الأدوات:**",
+    'download': ("📹 **جاهز للتحميل!**\n"
+                 "أرسل الرابط (YouTube, TikTok, Instagram, X وأكثر من 1000 منصة) وسأعرض لك الجودات المتاحة.\n"
+                 "📦 لعدة روابط أرسلها في رسالة واحدة."),
+    'audio': "🎵 **استخراج الصوت:** اختر الصيغة ثم أرسل رابط المقطع، أو أرسل الرابط مباشرة واختر \"صوت فقط\".",
+    'convert': "🔄 **تحويل الملفات:** اختر نوع التحويل:",
+    'edit': "✂️ **تحرير الفيديو:** اختر العملية:",
+    'image': "🖼️ **معالجة الصور:** أرسل صورة أو عدة صور (ألبوم) ثم اختر العملية.",
+    'compress': "🗜️ **ضغط الملفات:** اضغط الزر ثم أرسل الروابط لتصلك في أرشيف ZIP."
+}
+
+
+# إنشاء مثيل وحيد
+intent_router = IntentRouter()
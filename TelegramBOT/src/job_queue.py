@@ -0,0 +1,172 @@
+"""
+job_queue.py - طابور مهام التحميل مع مجموعة عمال محدودة
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobState:
+    """حالات مهمة التحميل"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+@dataclass
+class DownloadJob:
+    """مهمة تحميل واحدة"""
+    chat_id: int
+    user_id: int
+    url: str
+    download_type: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    state: str = JobState.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    # مهمة مخصصة (قص، دمج، معالجة صور) تُنفذ بدلاً من معالج التحميل الافتراضي
+    task: Optional[Callable[[], Any]] = field(default=None, repr=False)
+
+
+class DownloadJobQueue:
+    """طابور غير حاجب: الأزرار تضيف المهام وتعود فوراً والعمال ينفذونها بالترتيب"""
+
+    def __init__(self, handler: Callable[..., Any], max_workers: int = 3,
+                 max_queue_size: int = 100, max_jobs_per_user: int = 2,
+                 history_size: int = 500):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_jobs_per_user = max_jobs_per_user
+        self.history_size = history_size
+
+        self._pending: deque = deque()
+        self._jobs: "OrderedDict[str, DownloadJob]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._running = False
+        # حد عام لعمليات التحميل المتزامنة تتشاركه مكونات أخرى (مثل التحميل المجمع)
+        self.slots = threading.BoundedSemaphore(max_workers)
+
+    def start(self):
+        """تشغيل العمال"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"download-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"✅ تم تشغيل {self.max_workers} عامل تحميل")
+
+    def stop(self, timeout: float = 5.0):
+        """إيقاف العمال بعد إنهاء المهام المعلقة والجارية"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def submit(self, chat_id: int, user_id: int, url: str, download_type: str,
+               task: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+        """إضافة مهمة إلى الطابور وإرجاع ترتيبها (task يستبدل معالج التحميل لهذه المهمة فقط)"""
+        if not self._running:
+            self.start()
+
+        with self._cond:
+            if len(self._pending) >= self.max_queue_size:
+                return {'success': False, 'error': 'قائمة الانتظار ممتلئة، حاول بعد قليل'}
+
+            active = self._active_jobs_for(user_id)
+            if len(active) >= self.max_jobs_per_user:
+                return {
+                    'success': False,
+                    'error': f'لديك {len(active)} تحميلات جارية، انتظر انتهاء إحداها'
+                }
+
+            job = DownloadJob(chat_id=chat_id, user_id=user_id, url=url, download_type=download_type, task=task)
+            self._jobs[job.job_id] = job
+            self._pending.append(job)
+            position = len(self._pending)
+            self._trim_history()
+            self._cond.notify()
+
+        return {'success': True, 'job': job, 'position': position}
+
+    def get_job(self, job_id: str) -> Optional[DownloadJob]:
+        """الحصول على مهمة بمعرفها"""
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def get_position(self, job_id: str) -> int:
+        """ترتيب المهمة في الطابور (0 إذا لم تعد في الانتظار)"""
+        with self._cond:
+            for index, job in enumerate(self._pending, start=1):
+                if job.job_id == job_id:
+                    return index
+        return 0
+
+    def get_user_jobs(self, user_id: int) -> List[DownloadJob]:
+        """جميع مهام المستخدم المحفوظة"""
+        with self._cond:
+            return [job for job in self._jobs.values() if job.user_id == user_id]
+
+    def stats(self) -> Dict[str, int]:
+        """إحصائيات الطابور"""
+        with self._cond:
+            counts = {JobState.QUEUED: 0, JobState.RUNNING: 0, JobState.DONE: 0, JobState.FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            counts['workers'] = len(self._workers)
+            return counts
+
+    def _active_jobs_for(self, user_id: int) -> List[DownloadJob]:
+        return [job for job in self._jobs.values()
+                if job.user_id == user_id and job.state in (JobState.QUEUED, JobState.RUNNING)]
+
+    def _trim_history(self):
+        """الاحتفاظ بعدد محدود من المهام المنتهية"""
+        excess = len(self._jobs) - self.history_size
+        if excess <= 0:
+            return
+        for job_id in [jid for jid, job in self._jobs.items()
+                       if job.state in (JobState.DONE, JobState.FAILED)][:excess]:
+            del self._jobs[job_id]
+
+    def _worker_loop(self):
+        """حلقة العامل"""
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+                job.state = JobState.RUNNING
+                job.started_at = time.time()
+
+            try:
+                with self.slots:
+                    if job.task:
+                        succeeded = job.task()
+                    else:
+                        succeeded = self.handler(job.chat_id, job.user_id, job.url, job.download_type)
+                job.state = JobState.FAILED if succeeded is False else JobState.DONE
+            except Exception as e:
+                job.state = JobState.FAILED
+                job.error = str(e)
+                logger.error(f"❌ فشلت مهمة التحميل {job.job_id}: {e}")
+            finally:
+                job.finished_at = time.time()
@@ -37,6 +37,14 @@ def create_main_menu():
 
     return keyboard
 
+def format_size_label(fmt: dict) -> str:
+    """عرض الحجم الفعلي أو المقدر للصيغة"""
+    if fmt.get('filesize_mb'):
+        return str(fmt['filesize_mb'])
+    if fmt.get('estimated_mb'):
+        return f"~{fmt['estimated_mb']}"
+    return 'غير معروف'
+
 def create_dynamic_download_options(url: str):
     """إنشاء خيارات تحميل ديناميكية حسب الفيديو"""
     keyboard = types.InlineKeyboardMarkup(row_width=2)
@@ -48,8 +56,10 @@ def create_dynamic_download_options(url: str):
         if 'error' in video_info:
             # خيارات افتراضية في حالة الخطأ
             btn_best = types.InlineKeyboardButton("🏆 أفضل جودة متاحة", callback_data="download_best")
-            btn_audio = types.InlineKeyboardButton("🎵 صوت فقط MP3", callback_data="download_audio_best")
+            btn_audio = types.InlineKeyboardButton("🎵 صوت فقط", callback_data="download_audio_best")
+            btn_mp3 = types.InlineKeyboardButton("🎼 تحويل إلى MP3", callback_data="download_audio_mp3")
             keyboard.add(btn_best, btn_audio)
+            keyboard.add(btn_mp3)
             return keyboard
 
         formats = video_info.get('available_formats', {})
@@ -58,12 +68,12 @@ def create_dynamic_download_options(url: str):
         btn_info = types.InlineKeyboardButton("📊 معلومات مفصلة", callback_data="get_detailed_info")
         keyboard.add(btn_info)
 
-        # الصيغ المدمجة (فيديو + صوت)
-        combined = formats.get('combined', [])[:6]  # أول 6 جودات
+        # الصيغ المدمجة (فيديو + صوت) مسبوقة بالجودات العالية التي تُدمج بنسخ المسارات
+        combined = (formats.get('merged', [])[:3] + formats.get('combined', []))[:6]  # أول 6 جودات
         for fmt in combined:
             quality = fmt.get('quality', 'غير معروف')
-            size = fmt.get('filesize_mb', 'غير معروف')
-            btn_text = f"📹 {quality} - {size}MB"
+            size = format_size_label(fmt)
+            btn_text = f"📹 {quality} - {size}MB" + (" 🔗" if fmt.get('merge_output_format') else "")
             btn_data = f"download_format_{fmt.get('format_id')}"
             keyboard.add(types.InlineKeyboardButton(btn_text, callback_data=btn_data))
 
@@ -75,10 +85,14 @@ def create_dynamic_download_options(url: str):
         audio_formats = formats.get('audio_only', [])[:4]  # أول 4 جودات صوت
         for fmt in audio_formats:
             quality = fmt.get('quality', 'غير معروف')
-            size = fmt.get('filesize_mb', 'غير معروف')
+            size = format_size_label(fmt)
             btn_text = f"🎶 {quality} - {size}MB"
             btn_data = f"download_audio_format_{fmt.get('format_id')}"
             keyboard.add(types.InlineKeyboardButton(btn_text, callback_data=btn_data))
+        keyboard.add(
+            types.InlineKeyboardButton("🎵 أفضل صوت (دون تحويل)", callback_data="download_audio_best"),
+            types.InlineKeyboardButton("🎼 تحويل إلى MP3", callback_data="download_audio_mp3")
+        )
 
         # خيارات إضافية
         keyboard.add(
@@ -90,7 +104,7 @@ def create_dynamic_download_options(url: str):
         logger.error(f"خطأ في إنشاء الخيارات الديناميكية: {e}")
         # خيارات احتياطية
         btn_best = types.InlineKeyboardButton("🏆 أفضل جودة", callback_data="download_best")
-        btn_audio = types.InlineKeyboardButton("🎵 صوت MP3", callback_data="download_audio_best")
+        btn_audio = types.InlineKeyboardButton("🎵 صوت فقط", callback_data="download_audio_best")
         keyboard.add(btn_best, btn_audio)
 
     keyboard.add(types.InlineKeyboardButton("⬅️ العودة", callback_data="back_to_main"))
@@ -226,6 +240,16 @@ def create_model_switch_menu():
 
     return keyboard
 
+def create_oversize_menu(current: str = "split"):
+    """قائمة اختيار طريقة إرسال الملفات الأكبر من حد الإرسال"""
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    options = (("split", "✂️ تقسيم إلى أجزاء (دون فقدان الجودة)"), ("compress", "🗜️ ضغط إلى ملف واحد"))
+    for strategy, label in options:
+        mark = "✅ " if strategy == current else ""
+        keyboard.add(types.InlineKeyboardButton(f"{mark}{label}", callback_data=f"oversize_{strategy}"))
+    keyboard.add(types.InlineKeyboardButton("⬅️ القائمة الرئيسية", callback_data="back_to_main"))
+    return keyboard
+
 def create_audio_processing_menu():
     """قائمة معالجة الصوت المرفوع"""
     keyboard = types.InlineKeyboardMarkup(row_width=2)
@@ -301,4 +325,29 @@ def create_video_processing_menu():
     )
     keyboard.add(types.InlineKeyboardButton("⬅️ القائمة الرئيسية", callback_data="back_to_main"))
 
-    return keyboard
\ No newline at end of file
+    return keyboard
+
+
+def create_intent_keyboard(intent: str):
+    """لوحة الرد المحلي لنية مصنفة دون الذكاء الاصطناعي"""
+    if intent in ('greeting', 'menu'):
+        return create_main_menu()
+    if intent in ('help', 'tools'):
+        return create_tools_menu()
+    if intent == 'thanks':
+        return None
+
+    actions = {
+        'download': [("📦 تحميل مجمع", "bulk_download"), ("📋 قوائم التشغيل", "playlist_download")],
+        'audio': [("🎵 صوت فقط", "convert_audio"), ("🎼 تحويل إلى MP3", "convert_mp3")],
+        'convert': [("🎼 تحويل إلى MP3", "convert_mp3"), ("🎵 صوت فقط", "convert_audio")],
+        'edit': [("✂️ قص فيديو", "trim_video"), ("🔗 دمج ملفات", "merge_files")],
+        'image': [("🖼️ معالجة صور", "image_tools")],
+        'compress': [("🗜️ ضغط ملفات", "compress_files")]
+    }
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    buttons = [types.InlineKeyboardButton(label, callback_data=data) for label, data in actions.get(intent, [])]
+    if buttons:
+        keyboard.add(*buttons)
+    keyboard.add(types.InlineKeyboardButton("🏠 القائمة الرئيسية", callback_data="back_to_main"))
+    return keyboard
@@ -0,0 +1,365 @@
+"""
+llm_transport.py - طبقة نقل مشتركة لموفري الذكاء الاصطناعي: جلسات دائمة ومهل وحدود تزامن وإعادة محاولة
+"""
+
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ProviderBusyError(Exception):
+    """كل اتصالات الموفر مشغولة ولم يتحرر مكان خلال مهلة الانتظار"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        super().__init__(f"خدمة {provider} مشغولة حالياً، حاول بعد قليل")
+
+
+class ProviderTransport:
+    """اتصالات HTTP دائمة (keep-alive) لموفر واحد مع مهل اتصال وقراءة وحد لعدد الطلبات المتزامنة
+
+    الطلبات المتزامنة تمر عبر requests.Session، والطلبات غير المتزامنة وعملاء ChatOpenAI عبر httpx،
+    وكلها تتشارك حد التزامن نفسه وعدد مرات إعادة المحاولة نفسه (max_retries).
+    """
+
+    def __init__(self, provider: str, max_concurrency: int = 8, connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0, max_retries: int = 3, backoff_factor: float = 0.5,
+                 queue_timeout: float = 30.0):
+        self.provider = provider
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.queue_timeout = queue_timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._http_client: Optional[httpx.Client] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def configure(self, max_concurrency: Optional[int] = None, connect_timeout: Optional[float] = None,
+                  read_timeout: Optional[float] = None, max_retries: Optional[int] = None):
+        """تحديث الإعدادات؛ الطلبات الجارية تكمل بالإعدادات القديمة
+
+        عملاء httpx تُعاد إنشاؤها عند تغير حد التزامن أو إعادة المحاولة (مبنيان في ناقلها)، لذا يجب
+        إعادة بناء عملاء النماذج التي أخذت نسخة منها (انظر SmartMediaAgent.rebuild_llm).
+        """
+        with self._lock:
+            rebuild_clients = False
+            if max_concurrency and max_concurrency != self.max_concurrency:
+                self.max_concurrency = max_concurrency
+                self._semaphore = threading.BoundedSemaphore(max_concurrency)
+                rebuild_clients = True
+            if connect_timeout:
+                self.connect_timeout = connect_timeout
+            if read_timeout:
+                self.read_timeout = read_timeout
+            if max_retries is not None and max_retries != self.max_retries:
+                self.max_retries = max_retries
+                rebuild_clients = True
+                if self._session:
+                    self._mount(self._session)
+            if rebuild_clients:
+                self._http_client = self._async_http_client = None
+            for client in (self._http_client, self._async_http_client):
+                if client is not None:
+                    client.timeout = self.httpx_timeout()
+
+    # --- Timeouts and slots ---
+
+    @property
+    def timeout(self):
+        """مهلة requests بصيغة (اتصال، قراءة)"""
+        return self.connect_timeout, self.read_timeout
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def acquire(self) -> Callable[[], None]:
+        """حجز مكان ضمن حد تزامن الموفر وإرجاع دالة تحريره (آمنة للاستدعاء أكثر من مرة)"""
+        semaphore = self._semaphore
+        if not semaphore.acquire(timeout=self.queue_timeout):
+            self.rejected += 1
+            raise ProviderBusyError(self.provider)
+        return self._releaser(semaphore)
+
+    async def aacquire(self) -> Callable[[], None]:
+        """مثل acquire دون حجب حلقة الأحداث: الانتظار على حد التزامن نفسه يتم في خيط منفصل"""
+        semaphore = self._semaphore
+        acquiring = asyncio.ensure_future(asyncio.to_thread(semaphore.acquire, timeout=self.queue_timeout))
+        try:
+            acquired = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # الخيط قد يحجز المكان بعد إلغاء الطلب: نحرره فور حصوله عليه
+            acquiring.add_done_callback(
+                lambda future: semaphore.release() if not future.cancelled() and future.result() else None)
+            raise
+        if not acquired:
+            self.rejected += 1
+            raise ProviderBusyError(self.provider)
+        return self._releaser(semaphore)
+
+    def _releaser(self, semaphore: threading.BoundedSemaphore) -> Callable[[], None]:
+        self.requests += 1
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                semaphore.release()
+        return release
+
+    @contextmanager
+    def slot(self):
+        release = self.acquire()
+        try:
+            yield
+        finally:
+            release()
+
+    # --- requests (sync) ---
+
+    def _mount(self, session: requests.Session):
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'GET', 'POST'}),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                self._session = requests.Session()
+                self._mount(self._session)
+            return self._session
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """طلب POST عبر الجلسة الدائمة مع المهل وإعادة المحاولة لـ 429/5xx"""
+        kwargs.setdefault('timeout', self.timeout)
+        with self.slot():
+            return self.session.post(url, **kwargs)
+
+    @contextmanager
+    def stream(self, url: str, **kwargs):
+        """طلب POST متدفق؛ المكان يبقى محجوزاً حتى إغلاق الاستجابة"""
+        kwargs.setdefault('timeout', self.timeout)
+        with self.slot():
+            response = self.session.post(url, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    # --- httpx (sync + async) ---
+
+    def http_client(self) -> httpx.Client:
+        """عميل httpx مشترك (لـ ChatOpenAI) يمر عبر حد التزامن نفسه
+
+        ناقل httpx يعيد المحاولة عند فشل الاتصال فقط؛ إعادة المحاولة لـ 429/5xx يتولاها عميل
+        OpenAI نفسه عبر max_retries الذي يُضبط من transport.max_retries (llm_max_retries).
+        """
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    timeout=self.httpx_timeout(),
+                    transport=_BoundedTransport(self, httpx.HTTPTransport(
+                        retries=self.max_retries, limits=httpx.Limits(max_keepalive_connections=self.max_concurrency)))
+                )
+            return self._http_client
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        """النسخة غير المتزامنة من http_client (إعادة المحاولة لـ 429/5xx في apost أو عميل OpenAI)"""
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    timeout=self.httpx_timeout(),
+                    transport=_AsyncBoundedTransport(self, httpx.AsyncHTTPTransport(
+                        retries=self.max_retries, limits=httpx.Limits(max_keepalive_connections=self.max_concurrency)))
+                )
+            return self._async_http_client
+
+    async def apost(self, url: str, **kwargs) -> httpx.Response:
+        """طلب POST غير متزامن مع إعادة المحاولة لـ 429/5xx بتأخير أسي عشوائي"""
+        client = self.async_http_client()
+        for attempt in range(self.max_retries + 1):
+            response = await client.post(url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            self.retries += 1
+            delay = self._retry_after(response) or backoff_delay(attempt, self.backoff_factor * 2, 30.0)
+            logger.warning(f"⚠️ {self.provider} أعاد {response.status_code}، إعادة المحاولة بعد {delay:.1f}ث")
+            await asyncio.sleep(delay)
+        return response
+
+    @staticmethod
+    def _retry_after(response) -> Optional[float]:
+        try:
+            return min(float(response.headers.get('Retry-After')), 30.0)
+        except (TypeError, ValueError):
+            return None
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            # العميل غير المتزامن يُغلق مع حلقة الأحداث
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'timeout': self.timeout,
+            'requests': self.requests,
+            'retries': self.retries,
+            'rejected': self.rejected
+        }
+
+
+class _BoundedTransport(httpx.BaseTransport):
+    """ناقل httpx يحجز مكاناً في حد تزامن الموفر حتى إغلاق الاستجابة (بما فيها الاستجابات المتدفقة)"""
+
+    def __init__(self, owner: ProviderTransport, transport: httpx.BaseTransport):
+        self.owner = owner
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        release = self.owner.acquire()
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_ReleasingStream(response.stream, release))
+
+    def close(self):
+        self.transport.close()
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream, release: Callable[[], None]):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+
+class _AsyncBoundedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, owner: ProviderTransport, transport: httpx.AsyncBaseTransport):
+        self.owner = owner
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        release = await self.owner.aacquire()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_AsyncReleasingStream(response.stream, release))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release: Callable[[], None]):
+        self.stream = stream
+        self.release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self.release()
+
+
+# --- Registry ---
+
+_transports: Dict[str, ProviderTransport] = {}
+_registry_lock = threading.Lock()
+_defaults: Dict[str, Any] = {}
+_provider_limits: Dict[str, int] = {}
+
+
+def get_transport(provider: str) -> ProviderTransport:
+    """طبقة النقل المشتركة للموفر (تُنشأ مرة واحدة لكل موفر)"""
+    with _registry_lock:
+        transport = _transports.get(provider)
+        if transport is None:
+            limit = _provider_limits.get(provider, _provider_limits.get('default', 8))
+            transport = _transports[provider] = ProviderTransport(provider, max_concurrency=limit, **_defaults)
+        return transport
+
+
+def configure_transports(settings: Dict[str, Any]):
+    """تطبيق إعدادات النظام على الموفرين الحاليين والمستقبليين"""
+    with _registry_lock:
+        _provider_limits.clear()
+        _provider_limits.update(settings.get("llm_provider_concurrency", {}))
+        _defaults.update({
+            'connect_timeout': settings.get("llm_connect_timeout", 5),
+            'read_timeout': settings.get("llm_read_timeout", 60),
+            'max_retries': settings.get("llm_max_retries", 3)
+        })
+        transports = dict(_transports)
+    for provider, transport in transports.items():
+        transport.configure(max_concurrency=_provider_limits.get(provider, _provider_limits.get('default')),
+                            **_defaults)
+
+
+def close_transports():
+    with _registry_lock:
+        transports = list(_transports.values())
+    for transport in transports:
+        transport.close()
+
+
+def transport_stats() -> Dict[str, Any]:
+    with _registry_lock:
+        return {provider: transport.stats() for provider, transport in _transports.items()}
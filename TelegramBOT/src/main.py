@@ -9,12 +9,31 @@ import json
 import telebot
 from dotenv import load_dotenv
 import time
+import atexit
+import secrets
 import threading
 import logging
 
 # Import local modules
 from .yt_dlp_wrapper import downloader
-from . import handlers
+from .job_queue import DownloadJobQueue
+from .file_id_cache import TelegramFileIdCache
+from .media_store import media_store
+from .ffmpeg_pool import ffmpeg_pool
+from .converter import converter
+from .media_editor import media_editor
+from .oversize import STRATEGIES as OVERSIZE_STRATEGIES, oversize_handler
+from .image_processor import image_processor
+from .zip_builder import zip_builder
+from .llm_transport import configure_transports, close_transports
+from .ai_agent import smart_agent
+from .intent_router import intent_router
+from .response_cache import response_cache
+from .config_manager import config_manager
+from .progress import ThrottledMessageEditor, format_progress
+from .webhook_server import WebhookServer
+from .state_store import StateNamespace, create_state_backend
+from .bulk_downloader import BulkDownloadEngine
 
 # --- Setup ---
 # Ensure log directory exists before configuring logging
@@ -42,28 +61,100 @@ except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError) as e:
     exit(1)
 
 bot = telebot.TeleBot(TELEGRAM_TOKEN)
+system_settings = config.get("SYSTEM_SETTINGS", {})
+
+# الملفات المحملة تبقى في مخزن الوسائط ويتم طردها حسب الحصة والعمر
+media_store.configure(
+    root="media/downloads",
+    max_bytes=int(system_settings.get("media_cache_max_gb", 5) * 1024 ** 3),
+    max_age=config.get("AUTO_CLEANUP_HOURS", 24) * 3600
+)
+
+# حد الرفع: 50MB لواجهة Bot API العامة، ويمكن رفعه إلى 2000MB عند استخدام خادم Bot API محلي
+downloader.max_upload_bytes = int(system_settings.get("upload_limit_mb", 50) * 1024 * 1024)
+
+# الصوت يُرسل بمساره الأصلي دون إعادة ترميز، والتحويل يتم فقط عند الطلب في مجمع FFmpeg محدود
+downloader.audio_codec = system_settings.get("audio_output_codec", "native")
+ffmpeg_pool.configure(max_workers=system_settings.get("ffmpeg_workers") or None,
+                      max_pending=system_settings.get("ffmpeg_max_pending", 100),
+                      threads_per_job=system_settings.get("ffmpeg_threads_per_job") or None)
+converter.default_timeout = system_settings.get("conversion_timeout_seconds", 600)
+media_editor.default_timeout = system_settings.get("conversion_timeout_seconds", 600)
+
+image_processor.configure(max_workers=system_settings.get("image_workers") or None,
+                          max_pixels=int(system_settings.get("image_max_megapixels", 40) * 1_000_000))
+
+# الملفات الأكبر من حد الرفع تُقسم أو تُضغط بدلاً من رفضها؛ source_limit سقف مطلق لما يُحمّل لهذا الغرض
+# (التحميل نفسه يقتصر على ضعف حد الرفع أو أصغر صيغة متاحة، انظر downloader.oversize_budget)
+oversize_source_bytes = int(system_settings.get("oversize_source_limit_mb", 1024) * 1024 * 1024)
+
+# اتصالات موفري الذكاء الاصطناعي: جلسات دائمة ومهل وحد تزامن لكل موفر
+configure_transports(system_settings)
+atexit.register(close_transports)
+# الوكيل يُنشأ عند الاستيراد بإعدادات النقل الافتراضية: إعادة بناء عميله ليأخذ المهل والحدود المضبوطة
+smart_agent.rebuild_llm()
+
+# الرسائل القصيرة الواضحة (تحية، مساعدة، طلب تحميل...) تُجاب محلياً والغامضة فقط تذهب للنموذج
+intent_router.configure(enabled=system_settings.get("intent_router_enabled", True),
+                        max_words=system_settings.get("intent_max_words", 8),
+                        classifier_threshold=system_settings.get("intent_classifier_threshold", 0.85),
+                        use_classifier=system_settings.get("intent_classifier_enabled", True))
+
+# الأسئلة المتكررة (مطابقة أو مشابهة) تُجاب من ذاكرة الردود لكل نموذج دون رحلة كاملة للوكيل
+response_cache.configure(enabled=system_settings.get("response_cache_enabled", True),
+                         max_entries=system_settings.get("response_cache_max_entries", 2000),
+                         ttl=system_settings.get("response_cache_ttl_hours", 24) * 3600,
+                         similarity_threshold=system_settings.get("response_cache_similarity", 0.88))
+
+# حدود التزامن لكل منصة: تعثر منصة (تقييد 429 مثلاً) لا يستهلك كل العمال
+downloader.configure_platforms(
+    system_settings.get("platform_concurrency", {}),
+    failure_threshold=system_settings.get("circuit_breaker_failures", 5),
+    reset_timeout=system_settings.get("circuit_breaker_reset_seconds", 60),
+    max_attempts=system_settings.get("download_retry_attempts", 3)
+)
 
 # --- State and Statistics Management ---
 start_time = time.time()
 completed_operations = 0
 error_count = 0
-user_states = {}
-user_preferences = {}
-user_statistics = {}
+
+# حالة المستخدمين في مخزن محدود (ذاكرة أو SQLite) بدلاً من قواميس تنمو بلا حد
+state_backend = create_state_backend(system_settings)
+atexit.register(state_backend.close)
+user_states = StateNamespace(state_backend, "pending", ttl=system_settings.get("pending_state_ttl_minutes", 30) * 60)
+user_preferences = StateNamespace(state_backend, "preferences")
+user_statistics = StateNamespace(state_backend, "statistics")
+
+# سجلات المحادثة الخاملة تُطرد من الذاكرة وتُستعاد من المخزن عند عودة المستخدم
+if smart_agent.memory and config_manager.get_ai_config().memory_persist:
+    smart_agent.memory.attach_store(StateNamespace(state_backend, "conversations", ttl=7 * 24 * 3600))
+
+# معرفات ملفات تيليجرام المرفوعة سابقاً لإعادة إرسالها دون تحميل أو رفع جديد
+file_id_cache = TelegramFileIdCache(
+    "data/file_id_cache.json",
+    max_entries=system_settings.get("file_id_cache_max_entries", 5000),
+    max_age=system_settings.get("file_id_cache_max_age_days", 30) * 24 * 3600
+)
 
 def get_completed_operations():
     return completed_operations
 
 def count_downloaded_files():
-    downloads_dir = "media/downloads"
-    if os.path.exists(downloads_dir):
-        return len([f for f in os.listdir(downloads_dir) if os.path.isfile(os.path.join(downloads_dir, f))])
-    return 0
+    return media_store.stats()['files']
 
 def increment_operation():
     global completed_operations
     completed_operations += 1
 
+def record_user_download(user_id, filesize_mb=0):
+    """تحديث إحصائيات المستخدم بعد تحميل ناجح"""
+    stats = user_statistics.get(user_id) or {'downloads': 0, 'total_size': 0, 'last_download': None, 'favorite_quality': 'best'}
+    stats['downloads'] += 1
+    stats['last_download'] = time.time()
+    stats['total_size'] += filesize_mb or 0
+    user_statistics[user_id] = stats
+
 def log_error(error_msg):
     global error_count
     error_count += 1
@@ -73,67 +164,144 @@ def log_error(error_msg):
 
 # --- Core Bot Logic ---
 
+def get_file_cache_key(url, download_type):
+    """مفتاح ذاكرة معرفات الملفات: (الرابط الموحد، الصيغة المطلوبة، نوع الوسائط)"""
+    format_spec = "download_best" if download_type == "smart_download" else download_type
+    media_kind = "audio" if download_type.startswith("download_audio") else "video"
+    return downloader.canonical_url(url), format_spec, media_kind
+
+def send_cached_file(chat_id, entry):
+    """إرسال ملف سبق رفعه باستخدام معرفه في تيليجرام"""
+    caption = f"**{entry.get('title') or 'file'}**\n⚡ من الذاكرة"
+    send_as = entry.get('send_as')
+    if send_as == 'audio':
+        bot.send_audio(chat_id, entry['file_id'], caption=f"🎵 {caption}", parse_mode='Markdown')
+    elif send_as == 'video':
+        bot.send_video(chat_id, entry['file_id'], caption=f"🎬 {caption}", parse_mode='Markdown')
+    elif send_as == 'photo':
+        bot.send_photo(chat_id, entry['file_id'], caption=f"🖼️ {caption}", parse_mode='Markdown')
+    else:
+        bot.send_document(chat_id, entry['file_id'], caption=f"📁 {caption}", parse_mode='Markdown')
+
+def perform_download(url, download_type, announce=None, progress_callback=None):
+    """تنفيذ التحميل المطلوب حسب نوع الزر، مع إعادة التحميل دون حد الإرسال إذا لم تتوفر صيغة ضمنه"""
+    announce = announce or (lambda text: None)
+    result = _perform_download(url, download_type, announce, progress_callback)
+    if result and result.get('too_large') and oversize_source_bytes:
+        # الملف سيُقسم أو يُضغط عند الإرسال بدلاً من رفض الطلب
+        announce("📦 لا توجد صيغة ضمن حد الإرسال، سيتم تحميل الملف ثم تجهيزه للإرسال...")
+        result = _perform_download(url, download_type, announce, progress_callback,
+                                   max_bytes=downloader.oversize_budget(result, oversize_source_bytes))
+    return result
+
+def _perform_download(url, download_type, announce, progress_callback=None, max_bytes=None):
+    """تنفيذ التحميل المطلوب حسب نوع الزر وإرجاع نتيجة المنزل"""
+    download_path = "media/downloads"
+
+    if download_type.startswith("download_format_"):
+        format_id = download_type.replace("download_format_", "")
+        announce(f"📥 جاري تحميل الفيديو بالصيغة {format_id}...")
+        return downloader.download_with_format_id(url, format_id, download_path, max_bytes,
+                                                   progress_callback=progress_callback)
+    elif download_type.startswith("download_audio_format_"):
+        format_id = download_type.replace("download_audio_format_", "")
+        announce(f"🎵 جاري تحميل الصوت بالصيغة {format_id}...")
+        return downloader.download_with_format_id(url, format_id, download_path, max_bytes,
+                                                   progress_callback=progress_callback)
+    elif download_type == "download_best" or download_type == "smart_download":
+        announce("🧠 جاري التحميل الذكي بأفضل جودة...")
+        return downloader.download_video(url, download_path, "best", max_bytes, progress_callback=progress_callback)
+    elif download_type == "download_audio_mp3":
+        announce("🎵 جاري تحميل الصوت وتحويله إلى MP3...")
+        return downloader.download_audio(url, download_path, "best", progress_callback=progress_callback, codec="mp3")
+    elif download_type.startswith("download_audio"):
+        announce("🎵 جاري تحميل الصوت...")
+        return downloader.download_audio(url, download_path, progress_callback=progress_callback)
+    else:
+        quality_map = {
+            "download_4k": "4k", "quality_4k": "4k", "quality_8k": "8k",
+            "download_1440p": "1440", "quality_2k": "1440",
+            "download_1080p": "1080", "quality_1080p": "1080",
+            "download_720p": "720", "quality_720p": "720",
+            "download_480p": "480", "quality_480p": "480", 
+            "download_360p": "360", "quality_360p": "360"
+        }
+        quality = quality_map.get(download_type, "best")
+        announce(f"📥 جاري تحميل الفيديو بجودة {quality}...")
+        return downloader.download_video(url, download_path, quality, max_bytes, progress_callback=progress_callback)
+
 def handle_download_request(chat_id, user_id, url, download_type):
     """معالجة طلبات التحميل المحسنة مع إحصائيات"""
     try:
         start_time_op = time.time()
         progress_msg = bot.send_message(chat_id, "⚡ جاري التحميل...")
 
-        if user_id not in user_statistics:
-            user_statistics[user_id] = {'downloads': 0, 'total_size': 0, 'last_download': None, 'favorite_quality': 'best'}
-
-        download_path = "media/downloads"
-        result = None
-
-        if download_type.startswith("download_format_"):
-            format_id = download_type.replace("download_format_", "")
-            bot.edit_message_text(f"📥 جاري تحميل الفيديو بالصيغة {format_id}...", chat_id, progress_msg.message_id)
-            result = downloader.download_with_format_id(url, format_id, download_path)
-        elif download_type.startswith("download_audio_format_"):
-            format_id = download_type.replace("download_audio_format_", "")
-            bot.edit_message_text(f"🎵 جاري تحميل الصوت بالصيغة {format_id}...", chat_id, progress_msg.message_id)
-            result = downloader.download_with_format_id(url, format_id, download_path)
-        elif download_type == "download_best" or download_type == "smart_download":
-            bot.edit_message_text("🧠 جاري التحميل الذكي بأفضل جودة...", chat_id, progress_msg.message_id)
-            result = downloader.download_video(url, download_path, "best")
-        elif download_type.startswith("download_audio"):
-            bot.edit_message_text("🎵 جاري تحميل الصوت...", chat_id, progress_msg.message_id)
-            result = downloader.download_audio(url, download_path)
-        else:
-            quality_map = {
-                "download_4k": "4k", "quality_4k": "4k", "quality_8k": "8k",
-                "download_1440p": "1440", "quality_2k": "1440",
-                "download_1080p": "1080", "quality_1080p": "1080",
-                "download_720p": "720", "quality_720p": "720",
-                "download_480p": "480", "quality_480p": "480", 
-                "download_360p": "360", "quality_360p": "360"
-            }
-            quality = quality_map.get(download_type, "best")
-            bot.edit_message_text(f"📥 جاري تحميل الفيديو بجودة {quality}...", chat_id, progress_msg.message_id)
-            result = downloader.download_video(url, download_path, quality)
+        cache_key = get_file_cache_key(url, download_type)
+        cached_entry = file_id_cache.get(*cache_key)
+        if cached_entry:
+            try:
+                send_cached_file(chat_id, cached_entry)
+                increment_operation()
+                record_user_download(user_id)
+                bot.edit_message_text(f"✅ تم الإرسال فوراً! ⏱️ {time.time() - start_time_op:.1f}ث", chat_id, progress_msg.message_id)
+                return True
+            except telebot.apihelper.ApiTelegramException as e:
+                # المعرف لم يعد صالحاً: نحذفه ونكمل بتحميل جديد
+                logger.warning(f"⚠️ معرف ملف غير صالح، سيتم التحميل من جديد: {e}")
+                file_id_cache.invalidate(*cache_key)
+
+        # تحديثات التقدم تُدمج في تعديل واحد كل بضع ثوانٍ لتجنب حدود الإغراق
+        progress_editor = ThrottledMessageEditor(bot, chat_id, progress_msg.message_id,
+                                                 min_interval=system_settings.get("progress_update_interval", 3))
+        on_progress = lambda event: progress_editor.update(format_progress(event))
+        try:
+            # رسائل المراحل تمر بالمحرر نفسه فتخضع لحد التعديل ولا تتسابق مع تحديثات التقدم المؤجلة
+            result = perform_download(url, download_type, progress_editor.update, on_progress)
+        finally:
+            progress_editor.close()
 
         if result and result.get('success'):
             operation_time = time.time() - start_time_op
             increment_operation()
-            user_statistics[user_id]['downloads'] += 1
-            user_statistics[user_id]['last_download'] = time.time()
-            if result.get('filesize_mb'):
-                user_statistics[user_id]['total_size'] += result['filesize_mb']
+            record_user_download(user_id, result.get('filesize_mb'))
             
             success_msg = f"✅ تم التحميل بنجاح! ⏱️ {operation_time:.1f}ث"
             bot.edit_message_text(success_msg, chat_id, progress_msg.message_id)
-            send_downloaded_file(chat_id, result)
+            send_downloaded_file(chat_id, result, cache_key, user_id)
+            return True
         else:
             error_msg = result.get('error', 'خطأ غير معروف') if result else 'فشل التحميل'
             log_error(f"فشل تحميل للمستخدم {user_id}: {error_msg}")
             bot.edit_message_text(f"❌ فشل التحميل: {error_msg}", chat_id, progress_msg.message_id)
+            return False
 
     except Exception as e:
         log_error(f"خطأ في التحميل: {str(e)}")
         bot.send_message(chat_id, f"❌ خطأ في التحميل: {str(e)}")
+        return False
 
-def send_downloaded_file(chat_id, result):
-    """إرسال الملف المحمل مع تحسينات"""
+# طابور التحميل: الأزرار تضيف المهام فقط والعمال ينفذون handle_download_request
+download_queue = DownloadJobQueue(
+    handle_download_request,
+    max_workers=system_settings.get("max_concurrent_downloads", 3),
+    max_queue_size=system_settings.get("max_queued_downloads", 100),
+    max_jobs_per_user=system_settings.get("max_downloads_per_user", 2)
+)
+
+def upload_file(chat_id, filepath, caption):
+    """رفع ملف بالنوع المناسب لامتداده وإرجاع (الرسالة المرسلة، نوع الإرسال)"""
+    with open(filepath, 'rb') as file:
+        if filepath.endswith(('.mp3', '.m4a', '.wav', '.aac')):
+            return bot.send_audio(chat_id, file, caption=f"🎵 {caption}", parse_mode='Markdown'), 'audio'
+        elif filepath.endswith(('.mp4', '.avi', '.mkv', '.webm', '.mov')):
+            return bot.send_video(chat_id, file, caption=f"🎬 {caption}", parse_mode='Markdown'), 'video'
+        elif filepath.endswith(('.jpg', '.jpeg', '.png', '.gif')):
+            return bot.send_photo(chat_id, file, caption=f"🖼️ {caption}"), 'photo'
+        else:
+            return bot.send_document(chat_id, file, caption=f"📁 {caption}", parse_mode='Markdown'), 'document'
+
+def send_downloaded_file(chat_id, result, cache_key=None, user_id=None):
+    """إرسال الملف المحمل مع تحسينات وحفظ معرفه لإعادة الإرسال لاحقاً"""
     try:
         filepath = result.get('filepath')
         filename = result.get('filename', 'file')
@@ -144,45 +312,385 @@ def send_downloaded_file(chat_id, result):
 
         file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
 
-        if file_size_mb > 50:
-            bot.send_message(chat_id, f"❌ **الملف كبير جداً للإرسال!**\n📊 **حجم الملف:** {file_size_mb:.1f} MB")
+        if os.path.getsize(filepath) > downloader.max_upload_bytes:
+            send_oversized_file(chat_id, result, user_id)
             return
 
-        with open(filepath, 'rb') as file:
-            caption = f"**{result.get('title', filename)}**\n📊 {file_size_mb:.1f} MB"
-            if filepath.endswith(('.mp3', '.m4a', '.wav', '.aac')):
-                bot.send_audio(chat_id, file, caption=f"🎵 {caption}", parse_mode='Markdown')
-            elif filepath.endswith(('.mp4', '.avi', '.mkv', '.webm', '.mov')):
-                bot.send_video(chat_id, file, caption=f"🎬 {caption}", parse_mode='Markdown')
-            elif filepath.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                bot.send_photo(chat_id, file, caption=f"🖼️ {caption}")
-            else:
-                bot.send_document(chat_id, file, caption=f"📁 {caption}", parse_mode='Markdown')
-        
-        try:
-            os.remove(filepath)
-        except Exception as e:
-            logger.error(f"Could not remove file {filepath}: {e}")
+        sent, send_as = upload_file(chat_id, filepath, f"**{result.get('title', filename)}**\n📊 {file_size_mb:.1f} MB")
+
+        if cache_key:
+            file_id = get_sent_file_id(sent)
+            if file_id:
+                file_id_cache.put(*cache_key, file_id=file_id, send_as=send_as,
+                                  title=result.get('title', filename), file_size=os.path.getsize(filepath))
 
     except Exception as e:
         log_error(f"خطأ في إرسال الملف: {str(e)}")
         bot.send_message(chat_id, f"❌ خطأ في إرسال الملف: {str(e)}")
+    finally:
+        # الملف يبقى في مخزن الوسائط لإعادة استخدامه ويصبح قابلاً للطرد بعد الإرسال
+        downloader.release_download(result)
+
+def get_oversize_strategy(user_id):
+    """استراتيجية الملفات الكبيرة المفضلة للمستخدم (تقسيم أو ضغط)"""
+    preferences = (user_preferences.get(user_id) or {}) if user_id is not None else {}
+    strategy = preferences.get('oversize_strategy') or system_settings.get("oversize_strategy", "split")
+    return strategy if strategy in OVERSIZE_STRATEGIES else "split"
+
+def set_oversize_strategy(user_id, strategy):
+    """حفظ استراتيجية الملفات الكبيرة في تفضيلات المستخدم"""
+    preferences = user_preferences.get(user_id) or {}
+    preferences['oversize_strategy'] = strategy
+    user_preferences[user_id] = preferences
+
+def send_oversized_file(chat_id, result, user_id=None):
+    """تقسيم الملف الكبير أو ضغطه ثم إرساله بدلاً من رفضه"""
+    filepath = result['filepath']
+    title = result.get('title', result.get('filename', 'file'))
+    strategy = get_oversize_strategy(user_id)
+    file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+    action = "ضغطه" if strategy == 'compress' else "تقسيمه"
+    status_msg = bot.send_message(chat_id, f"📦 حجم الملف {file_size_mb:.1f} MB يتجاوز حد الإرسال، جاري {action}...")
+
+    fitted = oversize_handler.fit(filepath, downloader.max_upload_bytes, strategy)
+    if not fitted['success']:
+        log_error(f"فشل تجهيز ملف كبير: {fitted['error']}")
+        bot.edit_message_text(f"❌ تعذر تجهيز الملف للإرسال: {fitted['error']}", chat_id, status_msg.message_id)
+        return
+
+    parts = fitted['parts']
+    if fitted['method'] == 'compress':
+        bot.edit_message_text("🗜️ تم ضغط الملف ليناسب حد الإرسال", chat_id, status_msg.message_id)
+    else:
+        bot.edit_message_text(f"✂️ تم تقسيم الملف إلى {len(parts)} أجزاء", chat_id, status_msg.message_id)
+
+    for part in parts:
+        media_store.pin(part)
+    try:
+        for index, part in enumerate(parts, 1):
+            part_mb = os.path.getsize(part) / (1024 * 1024)
+            label = f" ({index}/{len(parts)})" if len(parts) > 1 else ""
+            upload_file(chat_id, part, f"**{title}**{label}\n📊 {part_mb:.1f} MB")
+    finally:
+        for part in parts:
+            media_store.unpin(part)
+
+def get_sent_file_id(message):
+    """استخراج معرف الملف من رسالة تيليجرام المرسلة"""
+    if message is None:
+        return None
+    if message.photo:
+        return message.photo[-1].file_id
+    for attr in ('video', 'audio', 'document'):
+        media = getattr(message, attr, None)
+        if media:
+            return media.file_id
+    return None
+
+# --- Bulk and Playlist Downloads ---
+
+def download_bulk_item(url, download_type):
+    """تحميل عنصر من مهمة مجمعة، أو استخدام معرفه المرفوع سابقاً"""
+    cache_key = get_file_cache_key(url, download_type)
+    cached_entry = file_id_cache.get(*cache_key)
+    if cached_entry:
+        return {'success': True, 'cached_entry': cached_entry, 'cache_key': cache_key}
+    result = perform_download(url, download_type) or {'success': False, 'error': 'فشل التحميل'}
+    return dict(result, cache_key=cache_key)
+
+def redownload_bulk_item(url, download_type):
+    """إعادة تحميل عنصر أثناء التسليم ضمن خانات التحميل المشتركة نفسها"""
+    with download_queue.slots:
+        return perform_download(url, download_type) or {'success': False, 'error': 'فشل التحميل'}
+
+def deliver_bulk_item(job, index, result):
+    """إرسال عنصر مكتمل من مهمة مجمعة بترتيبه الأصلي، أو إضافته إلى أرشيف المهمة"""
+    chat_id = job['chat_id']
+    url = job['urls'][index]
+    if job.get('deliver_as') == 'zip':
+        if result.get('cached_entry'):
+            # الأرشيف يحتاج الملف نفسه وليس معرفه في تيليجرام
+            result.update(redownload_bulk_item(url, job['download_type']), cached_entry=None)
+        if result.get('success'):
+            job.setdefault('archive_files', []).append(result['filepath'])
+    elif result.get('cached_entry'):
+        try:
+            send_cached_file(chat_id, result['cached_entry'])
+        except telebot.apihelper.ApiTelegramException as e:
+            logger.warning(f"⚠️ معرف ملف غير صالح، سيتم التحميل من جديد: {e}")
+            file_id_cache.invalidate(*result['cache_key'])
+            result.update(redownload_bulk_item(url, job['download_type']), cached_entry=None)
+            if result.get('success'):
+                send_downloaded_file(chat_id, result, result['cache_key'], job['user_id'])
+    elif result.get('success'):
+        send_downloaded_file(chat_id, result, result['cache_key'], job['user_id'])
+
+    if result.get('success'):
+        increment_operation()
+        record_user_download(job['user_id'], result.get('filesize_mb'))
+    else:
+        error_msg = result.get('error', 'خطأ غير معروف')
+        log_error(f"فشل تحميل عنصر مجمع للمستخدم {job['user_id']}: {error_msg}")
+        bot.send_message(chat_id, f"❌ [{index + 1}/{len(job['urls'])}] فشل التحميل: {error_msg}\n{url}")
+
+def finish_bulk_job(job):
+    """إرسال أرشيف المهمة المجمعة بعد اكتمال تحميل كل عناصرها"""
+    files = job.get('archive_files')
+    if job.get('deliver_as') != 'zip' or not files:
+        return
+    send_archive(job['chat_id'], files, job.get('title') or f"bulk_{job['job_id']}")
+
+def abort_bulk_job(job, undelivered):
+    """تحرير ملفات مهمة مجمعة توقفت قبل اكتمالها: ملفات الأرشيف والتحميلات التي لم تُسلم"""
+    for path in job.get('archive_files') or []:
+        media_store.unpin(path)
+    for result in undelivered:
+        downloader.release_download(result)
+    bot.send_message(job['chat_id'], f"⚠️ توقفت المهمة المجمعة بعد {job['delivered']}/{len(job['urls'])} عنصر")
+
+def send_archive(chat_id, files, name):
+    """ضغط الملفات في أرشيف (أو أجزاء تحت حد الإرسال) وإرسالها"""
+    archive = {}
+    try:
+        status_msg = bot.send_message(chat_id, f"🗜️ جاري إنشاء الأرشيف ({len(files)} ملف)...")
+        entries = [(path, media_store.original_name(path)) for path in files]
+        archive = zip_builder.build(entries, secrets.token_hex(3) + "_" + name.replace(os.sep, "_")[:60],
+                                    max_part_bytes=downloader.max_upload_bytes)
+        if not archive['success']:
+            bot.edit_message_text(f"❌ {archive['error']}", chat_id, status_msg.message_id)
+            return archive
+
+        bot.edit_message_text(f"🗜️ الأرشيف جاهز: {archive['files']} ملف في {len(archive['parts'])} جزء",
+                              chat_id, status_msg.message_id)
+        for index, part in enumerate(archive['parts'], 1):
+            label = f" ({index}/{len(archive['parts'])})" if len(archive['parts']) > 1 else ""
+            with open(part, 'rb') as file:
+                bot.send_document(chat_id, file, caption=f"🗜️ {name}{label}")
+        if archive['split_files']:
+            bot.send_message(chat_id, "ℹ️ بعض الملفات الكبيرة مقسمة إلى قطع (.001، .002...) يمكن جمعها بالترتيب بعد فك الضغط")
+        return archive
+    finally:
+        for part in archive.get('parts', []):
+            if os.path.exists(part):
+                os.remove(part)
+        for path in files:
+            media_store.unpin(path)
+
+bulk_progress_editors = {}
+
+def report_bulk_progress(job):
+    """تحديث رسالة التقدم الإجمالي للمهمة المجمعة"""
+    message_id = job.get('status_message_id')
+    if not message_id:
+        return
+
+    title = job.get('title') or "تحميل مجمع"
+    text = (f"📦 {title}\n"
+            f"📊 {job['delivered']}/{len(job['urls'])} | ✅ {job['succeeded']} | ❌ {job['failed']}")
+    if job.get('finished'):
+        editor = bulk_progress_editors.pop(job['job_id'], None)
+        if editor:
+            editor.close()
+        bot.edit_message_text(f"{text}\n🎉 اكتملت المهمة", job['chat_id'], message_id)
+        return
+
+    editor = bulk_progress_editors.get(job['job_id'])
+    if editor is None:
+        editor = bulk_progress_editors[job['job_id']] = ThrottledMessageEditor(
+            bot, job['chat_id'], message_id, min_interval=system_settings.get("progress_update_interval", 3))
+    editor.update(text)
+
+bulk_engine = BulkDownloadEngine(
+    download_bulk_item,
+    deliver_bulk_item,
+    StateNamespace(state_backend, "bulk", ttl=7 * 24 * 3600),
+    on_progress=report_bulk_progress,
+    max_parallel=system_settings.get("bulk_max_parallel", 3),
+    max_items=system_settings.get("bulk_max_items", 50),
+    on_complete=finish_bulk_job,
+    on_abort=abort_bulk_job,
+    # تحميلات المهام المجمعة تشغل نفس خانات طابور التحميل فلا يتجاوز مجموعهما الحد العام
+    slots=download_queue.slots,
+    max_jobs_per_user=system_settings.get("bulk_max_jobs_per_user", 1)
+)
+
+def start_bulk_download(chat_id, user_id, urls, download_type="download_best", title=None, deliver_as="files"):
+    """بدء تحميل مجمع لعدة روابط؛ deliver_as="zip" يرسل النتائج في أرشيف واحد"""
+    status_msg = bot.send_message(chat_id, f"📦 تم استلام {len(urls)} رابط، جاري التحميل...")
+    submission = bulk_engine.start(chat_id, user_id, urls, download_type, title,
+                                   status_message_id=status_msg.message_id, deliver_as=deliver_as)
+    if not submission['success']:
+        bot.edit_message_text(f"❌ {submission['error']}", chat_id, status_msg.message_id)
+    elif submission['job']['truncated']:
+        bot.send_message(chat_id, f"⚠️ سيتم تحميل أول {bulk_engine.max_items} رابط فقط")
+    return submission
+
+def start_playlist_download(chat_id, user_id, url, download_type="download_best"):
+    """توسيع قائمة التشغيل ثم تحميل عناصرها كمهمة مجمعة"""
+    info_msg = bot.send_message(chat_id, "📋 جاري قراءة قائمة التشغيل...")
+    playlist = downloader.extract_playlist(url, bulk_engine.max_items)
+    if not playlist['success']:
+        bot.edit_message_text(f"❌ {playlist['error']}", chat_id, info_msg.message_id)
+        return playlist
+
+    bot.edit_message_text(f"📋 **{playlist['title']}**\n🎬 {len(playlist['entries'])} من {playlist['total']} عنصر",
+                          chat_id, info_msg.message_id, parse_mode='Markdown')
+    return start_bulk_download(chat_id, user_id, [entry['url'] for entry in playlist['entries']],
+                               download_type, playlist['title'])
+
+# --- Video Editing ---
+
+def handle_edit_request(chat_id, user_id, urls, operation, start=None, end=None):
+    """تحميل الروابط ثم قصها أو دمجها بنسخ المسارات متى أمكن"""
+    status_msg = bot.send_message(chat_id, "📥 جاري تحميل الملفات...")
+    downloads = []
+    try:
+        for url in urls:
+            result = perform_download(url, "download_best")
+            if not result or not result.get('success'):
+                error_msg = result.get('error', 'خطأ غير معروف') if result else 'فشل التحميل'
+                bot.edit_message_text(f"❌ فشل التحميل: {error_msg}\n{url}", chat_id, status_msg.message_id)
+                return False
+            downloads.append(result)
+
+        bot.edit_message_text("✂️ جاري المعالجة..." if operation == 'trim' else "🔗 جاري الدمج...",
+                              chat_id, status_msg.message_id)
+        if operation == 'trim':
+            edited = media_editor.trim(downloads[0]['filepath'], start, end)
+        else:
+            edited = media_editor.concat([d['filepath'] for d in downloads])
+
+        if not edited['success']:
+            log_error(f"فشل تحرير الفيديو للمستخدم {user_id}: {edited['error']}")
+            bot.edit_message_text(f"❌ فشلت المعالجة: {edited['error']}", chat_id, status_msg.message_id)
+            return False
+
+        method_labels = {'stream_copy': "نسخ مباشر", 'smart_cut': "قص ذكي عند الإطارات المفتاحية",
+                         'partial_reencode': "توحيد جزئي", 'reencode': "إعادة ترميز"}
+        bot.edit_message_text(f"✅ تمت المعالجة ({method_labels.get(edited['method'], edited['method'])})",
+                              chat_id, status_msg.message_id)
+        increment_operation()
+        send_downloaded_file(chat_id, dict(edited, title=downloads[0].get('title', 'video')), user_id=user_id)
+        return True
+    except Exception as e:
+        log_error(f"خطأ في تحرير الفيديو: {str(e)}")
+        bot.send_message(chat_id, f"❌ خطأ في المعالجة: {str(e)}")
+        return False
+    finally:
+        for result in downloads:
+            downloader.release_download(result)
+
+# --- Image Processing ---
+
+def save_uploaded_file(file_id, filename):
+    """تنزيل ملف أرسله المستخدم إلى مجلد الرفع المحلي"""
+    file_info = bot.get_file(file_id)
+    os.makedirs("media/uploads", exist_ok=True)
+    extension = os.path.splitext(file_info.file_path or "")[1]
+    path = os.path.join("media/uploads", f"{os.path.splitext(filename)[0]}_{secrets.token_hex(3)}{extension}")
+    with open(path, 'wb') as f:
+        f.write(bot.download_file(file_info.file_path))
+    return path
+
+def handle_image_request(chat_id, user_id, paths, operation, **options):
+    """معالجة صورة أو دفعة صور وإرسال كل نتيجة فور اكتمالها"""
+    status_msg = bot.send_message(chat_id, f"🖼️ جاري معالجة {len(paths)} صورة...")
+    editor = ThrottledMessageEditor(bot, chat_id, status_msg.message_id,
+                                    min_interval=system_settings.get("progress_update_interval", 3))
+    succeeded = 0
+    try:
+        for done, (index, result) in enumerate(image_processor.process_batch(paths, operation, **options), 1):
+            if result['success']:
+                succeeded += 1
+                width, height = result['size']
+                with open(result['filepath'], 'rb') as file:
+                    bot.send_document(chat_id, file, caption=f"🖼️ [{index + 1}/{len(paths)}] {width}×{height}")
+                os.remove(result['filepath'])
+            else:
+                bot.send_message(chat_id, f"❌ [{index + 1}/{len(paths)}] {result['error']}")
+            editor.update(f"🖼️ تمت معالجة {done}/{len(paths)} صورة")
+        editor.close()
+        bot.edit_message_text(f"✅ اكتملت معالجة {succeeded}/{len(paths)} صورة", chat_id, status_msg.message_id)
+        increment_operation()
+        return succeeded > 0
+    except Exception as e:
+        log_error(f"خطأ في معالجة الصور: {str(e)}")
+        bot.send_message(chat_id, f"❌ خطأ في معالجة الصور: {str(e)}")
+        return False
+    finally:
+        editor.close()
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
 
 # --- System Maintenance ---
 
+cleanup_stop_event = threading.Event()
+
 def cleanup_old_files():
     """تنظيف الملفات القديمة تلقائياً"""
-    # Implementation for cleaning up old files
-    pass
+    try:
+        return media_store.evict()
+    except Exception as e:
+        log_error(f"خطأ في تنظيف الملفات: {str(e)}")
+        return {'removed': 0, 'freed_bytes': 0}
 
 def start_cleanup_scheduler():
     """بدء جدولة التنظيف التلقائي"""
-    # Implementation for cleanup scheduler
-    pass
+    interval = system_settings.get("cleanup_interval_hours", 1) * 3600
+
+    def cleanup_loop():
+        while not cleanup_stop_event.wait(interval):
+            cleanup_old_files()
+
+    cleanup_old_files()
+    threading.Thread(target=cleanup_loop, name="media-cleanup", daemon=True).start()
+    logger.info("🧹 تم تشغيل جدولة تنظيف الملفات")
+
+# --- Update Ingestion ---
+
+def run_webhook(webhook_config):
+    """استقبال التحديثات عبر Webhook، ويرجع False إذا تعذر التفعيل"""
+    secret_token = webhook_config.get("secret_token") or secrets.token_urlsafe(32)
+    path = webhook_config.get("path", "/webhook")
+    try:
+        bot.remove_webhook()
+        bot.set_webhook(
+            url=webhook_config["url"].rstrip("/") + path,
+            secret_token=secret_token,
+            max_connections=webhook_config.get("max_connections", 40)
+        )
+    except Exception as e:
+        log_error(f"تعذر تفعيل Webhook، سيتم استخدام الاستطلاع: {str(e)}")
+        return False
+
+    server = WebhookServer(
+        bot,
+        listen=webhook_config.get("listen", "0.0.0.0"),
+        port=webhook_config.get("port", 8443),
+        path=path,
+        secret_token=secret_token,
+        workers=webhook_config.get("workers", 4),
+        max_queue_size=webhook_config.get("max_queue_size", 1000)
+    )
+    logger.info("🌐 وضع Webhook نشط")
+    server.serve_forever()
+    return True
+
+def run_polling():
+    """استقبال التحديثات عبر الاستطلاع (الوضع الاحتياطي)"""
+    bot.remove_webhook()
+    bot.infinity_polling(none_stop=True, interval=1, timeout=60)
 
 # --- Main Execution ---
 
-if __name__ == "__main__":
+def run():
+    """تشغيل البوت؛ نقطة الدخول python -m src تستورد هذه الوحدة مرة واحدة باسم src.main
+
+    المعالجات تستورد src.main، فتشغيل هذا الملف مباشرة (python -m src.main) كان ينشئ نسخة ثانية منه
+    بمخزن حالة وطوابير ومحرك تحميل مجمع منفصلة.
+    """
+    from . import handlers
     try:
         logger.info("🚀 بدء تشغيل Smart Media AI Assistant...")
         os.makedirs("media/downloads", exist_ok=True)
@@ -191,16 +699,33 @@ if __name__ == "__main__":
         os.makedirs("logs", exist_ok=True)
         logger.info("📁 تم إنشاء المجلدات الضرورية")
 
-        handlers.register_handlers()
         start_cleanup_scheduler()
-        
-        logger.info("🎉 تم تشغيل البوت بنجاح! جاهز لاستقبال الطلبات...")
-        bot.infinity_polling(none_stop=True, interval=1, timeout=60)
+        resumed = bulk_engine.resume_all()
+        if resumed:
+            logger.info(f"🔁 تم استئناف {resumed} مهمة تحميل مجمع")
+
+        # مجموعة معالجات واحدة للوضعين؛ وضع asyncio يعالج الروابط والمحادثة بشكل غير متزامن ويمرر الباقي إليها
+        handlers.register_handlers()
+        if config.get("EXECUTION_MODE", "threaded") == "async":
+            import asyncio
+            from .async_bot import run_async
+            logger.info("🎉 تم تشغيل البوت بنجاح! جاهز لاستقبال الطلبات...")
+            asyncio.run(run_async(TELEGRAM_TOKEN))
+        else:
+            logger.info("🎉 تم تشغيل البوت بنجاح! جاهز لاستقبال الطلبات...")
+            webhook_config = config.get("WEBHOOK", {})
+            if not (webhook_config.get("enabled") and webhook_config.get("url") and run_webhook(webhook_config)):
+                run_polling()
 
     except KeyboardInterrupt:
         logger.info("⏹️ تم إيقاف البوت بواسطة المستخدم")
     except Exception as e:
         logger.error(f"❌ خطأ مميت في تشغيل البوت: {e}")
     finally:
+        cleanup_stop_event.set()
         cleanup_old_files()
-        logger.info("🛑 إغلاق Smart Media AI Assistant")
\ No newline at end of file
+        logger.info("🛑 إغلاق Smart Media AI Assistant")
+
+if __name__ == "__main__":
+    logger.error("❌ شغّل البوت عبر: python -m src (أو run.py)")
+    exit(1)
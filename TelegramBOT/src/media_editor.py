@@ -0,0 +1,267 @@
+"""
+media_editor.py - قص ودمج الفيديو بنسخ المسارات مع مراعاة الإطارات المفتاحية
+"""
+
+import os
+import json
+import uuid
+import logging
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+from .ffmpeg_pool import ffmpeg_pool
+from .media_store import media_store
+
+logger = logging.getLogger(__name__)
+
+# المسافة المقبولة بين نقطة القص وأقرب إطار مفتاحي لاعتبارها محاذية
+KEYFRAME_TOLERANCE = 0.05
+
+# مرمزات تنتج مسارات متوافقة مع النسخ المباشر عند الدمج مع الأجزاء المنسوخة
+VIDEO_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265', 'vp9': 'libvpx-vp9', 'vp8': 'libvpx', 'mpeg4': 'mpeg4'}
+AUDIO_ENCODERS = {'aac': 'aac', 'opus': 'libopus', 'vorbis': 'libvorbis', 'mp3': 'libmp3lame'}
+
+
+def parse_timestamp(value: Any) -> float:
+    """تحويل وقت مثل 90 أو 1:30 أو 00:01:30.5 إلى ثوانٍ"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class MediaEditor:
+    """عمليات القص والدمج: نسخ مباشر عند المحاذاة مع الإطارات المفتاحية وإعادة ترميز الحدود فقط"""
+
+    def __init__(self, pool=None, store=None, output_dir: str = "media/processed",
+                 ffprobe_path: str = "ffprobe", default_timeout: float = 600):
+        self.pool = pool or ffmpeg_pool
+        self.store = store or media_store
+        self.output_dir = output_dir
+        self.ffprobe_path = ffprobe_path
+        self.default_timeout = default_timeout
+
+    # --- Probing ---
+
+    def _ffprobe(self, args: List[str]) -> bytes:
+        completed = subprocess.run([self.ffprobe_path, '-v', 'error', *args], capture_output=True, timeout=60)
+        if completed.returncode != 0:
+            raise ValueError(completed.stderr.decode('utf-8', 'replace').strip() or "ffprobe failed")
+        return completed.stdout
+
+    def keyframes(self, path: str) -> List[float]:
+        """أوقات الإطارات المفتاحية لمسار الفيديو الأول (دون فك ترميز الإطارات الأخرى)"""
+        output = self._ffprobe(['-select_streams', 'v:0', '-skip_frame', 'nokey',
+                                '-show_entries', 'frame=pts_time,best_effort_timestamp_time', '-of', 'json', path])
+        times = []
+        for frame in json.loads(output or b'{}').get('frames', []):
+            value = frame.get('pts_time') or frame.get('best_effort_timestamp_time')
+            if value not in (None, 'N/A'):
+                times.append(float(value))
+        return sorted(times)
+
+    def stream_signature(self, path: str) -> Dict[str, Any]:
+        """خصائص المسارات التي يجب أن تتطابق لدمج الملفات بالنسخ المباشر"""
+        output = self._ffprobe(['-show_entries',
+                                'stream=codec_type,codec_name,width,height,pix_fmt,sample_rate,channels:format=duration',
+                                '-of', 'json', path])
+        data = json.loads(output or b'{}')
+        signature: Dict[str, Any] = {'duration': float(data.get('format', {}).get('duration') or 0)}
+        for stream in data.get('streams', []):
+            kind = stream.get('codec_type')
+            if kind == 'video' and 'video' not in signature:
+                signature['video'] = (stream.get('codec_name'), stream.get('width'), stream.get('height'), stream.get('pix_fmt'))
+            elif kind == 'audio' and 'audio' not in signature:
+                signature['audio'] = (stream.get('codec_name'), stream.get('sample_rate'), stream.get('channels'))
+        return signature
+
+    # --- Operations ---
+
+    def trim(self, path: str, start: Any, end: Any, job_id: Optional[str] = None) -> Dict[str, Any]:
+        """قص مقطع [start, end]: نسخ مباشر إن بدأ عند إطار مفتاحي، وإلا إعادة ترميز أول GOP فقط"""
+        try:
+            start, end = parse_timestamp(start), parse_timestamp(end)
+        except ValueError:
+            return {'success': False, 'error': "صيغة الوقت غير صحيحة (مثال: 1:30)"}
+        if start < 0 or end <= start:
+            return {'success': False, 'error': "يجب أن يكون وقت النهاية بعد وقت البداية"}
+        if not os.path.exists(path):
+            return {'success': False, 'error': f"الملف غير موجود: {path}"}
+
+        source_key = f"trim|{self.store.hash_file(path)}|{start:.3f}|{end:.3f}"
+        cached = self._cached(source_key)
+        if cached:
+            return cached
+
+        try:
+            signature = self.stream_signature(path)
+            keyframes = self.keyframes(path) if 'video' in signature else []
+        except (ValueError, OSError, subprocess.TimeoutExpired) as e:
+            return {'success': False, 'error': f"تعذر قراءة الملف: {e}"}
+
+        end = min(end, signature['duration']) if signature['duration'] else end
+        output = self._output_path(path)
+        with tempfile.TemporaryDirectory(dir=self._work_dir()) as work_dir:
+            if 'video' not in signature or self._is_keyframe(start, keyframes):
+                method = 'stream_copy'
+                result = self._copy_segment(path, start, end, output, job_id)
+            else:
+                next_keyframe = next((k for k in keyframes if k > start + KEYFRAME_TOLERANCE), None)
+                encoders = self._encoders_for(signature)
+                if encoders is None or next_keyframe is None or next_keyframe >= end:
+                    # المقطع أقصر من GOP واحد (أو الترميز غير مدعوم): إعادة ترميز المقطع كاملاً
+                    method = 'reencode'
+                    result = self._encode_segment(path, start, end, output, encoders, job_id)
+                else:
+                    method = 'smart_cut'
+                    result = self._smart_cut(path, start, next_keyframe, end, output, encoders, work_dir, job_id)
+
+        return self._finish(result, output, source_key, method)
+
+    def concat(self, paths: List[str], job_id: Optional[str] = None) -> Dict[str, Any]:
+        """دمج ملفات: نسخ مباشر عبر concat demuxer إن تطابقت الترميزات، وإلا توحيد المختلف منها فقط"""
+        if len(paths) < 2:
+            return {'success': False, 'error': "يلزم ملفان على الأقل للدمج"}
+        missing = [p for p in paths if not os.path.exists(p)]
+        if missing:
+            return {'success': False, 'error': f"الملف غير موجود: {missing[0]}"}
+
+        source_key = "concat|" + ",".join(self.store.hash_file(p) for p in paths)
+        cached = self._cached(source_key)
+        if cached:
+            return cached
+
+        try:
+            signatures = [self.stream_signature(p) for p in paths]
+        except (ValueError, OSError, subprocess.TimeoutExpired) as e:
+            return {'success': False, 'error': f"تعذر قراءة الملف: {e}"}
+
+        reference = signatures[0]
+        encoders = self._encoders_for(reference)
+        output = self._output_path(paths[0], ext=None if encoders else 'mp4')
+        with tempfile.TemporaryDirectory(dir=self._work_dir()) as work_dir:
+            parts = []
+            normalized = 0
+            for index, (path, signature) in enumerate(zip(paths, signatures)):
+                same = encoders and all(signature.get(k) == reference.get(k) for k in ('video', 'audio'))
+                if same:
+                    parts.append(path)
+                    continue
+                # توحيد الملف المختلف فقط مع أبعاد وعينات الملف الأول، بترميزه أو بـ H.264/AAC إن لم يكن مدعوماً
+                part = os.path.join(work_dir, f"part{index}{os.path.splitext(output)[1]}")
+                result = self._encode_segment(path, 0, signature['duration'] or None, part,
+                                              encoders, job_id, reference)
+                if not result['success']:
+                    return result
+                parts.append(part)
+                normalized += 1
+
+            result = self._concat_copy(parts, output, work_dir, job_id)
+
+        method = 'stream_copy' if normalized == 0 else 'partial_reencode'
+        return self._finish(result, output, source_key, method, normalized=normalized)
+
+    # --- Helpers ---
+
+    def _is_keyframe(self, time_point: float, keyframes: List[float]) -> bool:
+        if time_point <= KEYFRAME_TOLERANCE:
+            return True
+        return any(abs(k - time_point) <= KEYFRAME_TOLERANCE for k in keyframes)
+
+    def _encoders_for(self, signature: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """المرمزات المطابقة لترميز الملف الأصلي، أو None إن لم يكن مدعوماً"""
+        video_codec = signature.get('video', (None,))[0]
+        audio_codec = signature.get('audio', (None,))[0]
+        if video_codec and video_codec not in VIDEO_ENCODERS:
+            return None
+        if audio_codec and audio_codec not in AUDIO_ENCODERS:
+            return None
+        return {'video': VIDEO_ENCODERS.get(video_codec), 'audio': AUDIO_ENCODERS.get(audio_codec)}
+
+    def _copy_segment(self, path: str, start: float, end: Optional[float], output: str,
+                      job_id: Optional[str]) -> Dict[str, Any]:
+        args = ['-ss', f"{start:.3f}", '-i', path]
+        if end:
+            args += ['-t', f"{end - start:.3f}"]
+        args += ['-map', '0:v:0?', '-map', '0:a:0?', '-c', 'copy', '-avoid_negative_ts', 'make_zero', output]
+        return self.pool.run(args, self.default_timeout, job_id)
+
+    def _encode_segment(self, path: str, start: float, end: Optional[float], output: str,
+                        encoders: Optional[Dict[str, str]], job_id: Optional[str],
+                        reference: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """إعادة ترميز مقطع بنفس ترميز الملف (أو H.264/AAC) وبخصائص ملف مرجعي إن وُجد"""
+        encoders = encoders or {'video': 'libx264', 'audio': 'aac'}
+        args = ['-ss', f"{start:.3f}", '-i', path]
+        if end:
+            args += ['-t', f"{end - start:.3f}"]
+        args += ['-map', '0:v:0?', '-map', '0:a:0?']
+        if encoders.get('video'):
+            args += ['-c:v', encoders['video']]
+            if encoders['video'] in ('libx264', 'libx265'):
+                args += ['-preset', 'veryfast', '-crf', '18']
+            if reference and reference.get('video'):
+                _, width, height, pix_fmt = reference['video']
+                args += ['-vf', f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2", '-pix_fmt', pix_fmt]
+        if encoders.get('audio'):
+            args += ['-c:a', encoders['audio']]
+            if reference and reference.get('audio'):
+                _, sample_rate, channels = reference['audio']
+                args += ['-ar', str(sample_rate), '-ac', str(channels)]
+        args.append(output)
+        return self.pool.run(args, self.default_timeout, job_id)
+
+    def _smart_cut(self, path: str, start: float, keyframe: float, end: float, output: str,
+                   encoders: Dict[str, str], work_dir: str, job_id: Optional[str]) -> Dict[str, Any]:
+        """إعادة ترميز الجزء حتى أول إطار مفتاحي ثم نسخ الباقي ودمج الجزأين"""
+        ext = os.path.splitext(output)[1]
+        head = os.path.join(work_dir, f"head{ext}")
+        tail = os.path.join(work_dir, f"tail{ext}")
+
+        result = self._encode_segment(path, start, keyframe, head, encoders, job_id)
+        if not result['success']:
+            return result
+        result = self._copy_segment(path, keyframe, end, tail, job_id)
+        if not result['success']:
+            return result
+        return self._concat_copy([head, tail], output, work_dir, job_id)
+
+    def _concat_copy(self, parts: List[str], output: str, work_dir: str, job_id: Optional[str]) -> Dict[str, Any]:
+        list_path = os.path.join(work_dir, "concat.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for part in parts:
+                escaped = os.path.abspath(part).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        return self.pool.run(['-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', output],
+                             self.default_timeout, job_id)
+
+    def _work_dir(self) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        return self.output_dir
+
+    def _output_path(self, path: str, ext: Optional[str] = None) -> str:
+        base, source_ext = os.path.splitext(os.path.basename(path))
+        return os.path.join(self._work_dir(), f"{base}_{uuid.uuid4().hex[:6]}.{ext or source_ext.lstrip('.') or 'mp4'}")
+
+    def _cached(self, source_key: str) -> Optional[Dict[str, Any]]:
+        entry = self.store.lookup(source_key)
+        if not entry:
+            return None
+        return {'success': True, 'filepath': entry['path'], 'from_cache': True,
+                'method': entry['metadata'].get('method')}
+
+    def _finish(self, result: Dict[str, Any], output: str, source_key: str, method: str, **extra) -> Dict[str, Any]:
+        if not result['success']:
+            if os.path.exists(output):
+                os.remove(output)
+            return result
+        stored = self.store.put(output, source_key, {'method': method})
+        logger.info(f"✂️ تمت العملية بطريقة {method}: {os.path.basename(stored)}")
+        return dict({'success': True, 'filepath': stored, 'from_cache': False, 'method': method}, **extra)
+
+
+# إنشاء مثيل وحيد
+media_editor = MediaEditor()
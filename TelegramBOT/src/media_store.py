@@ -0,0 +1,242 @@
+"""
+media_store.py - مخزن وسائط معنون بالمحتوى مع حصة مساحة وطرد الأقدم استخداماً
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = ".media_index.json"
+
+
+class MediaStore:
+    """تخزين الملفات المحملة بمفتاح تجزئة المحتوى مع فهرس للحجم وآخر استخدام"""
+
+    def __init__(self, root: str = "media/downloads", max_bytes: int = 5 * 1024 ** 3,
+                 max_age: float = 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._sources: Dict[str, str] = {}
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def configure(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                  max_age: Optional[float] = None):
+        """تحديث إعدادات المخزن"""
+        with self._lock:
+            if root and root != self.root:
+                self.root = root
+                self._loaded = False
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_age is not None:
+                self.max_age = max_age
+
+    @staticmethod
+    def hash_file(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+        """حساب تجزئة SHA-256 للملف على دفعات"""
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def original_name(filepath: str) -> str:
+        """اسم الملف دون بادئة التجزئة التي يضيفها المخزن"""
+        return re.sub(r'^[0-9a-f]{16}_', '', os.path.basename(filepath))
+
+    def put(self, filepath: str, source_key: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """نقل ملف إلى المخزن وإرجاع مساره الجديد (الملفات المتطابقة تُخزن مرة واحدة)"""
+        digest = self.hash_file(filepath)
+        now = time.time()
+
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._objects.get(digest)
+            if entry and os.path.exists(entry['path']):
+                if os.path.abspath(entry['path']) != os.path.abspath(filepath):
+                    os.remove(filepath)
+            else:
+                os.makedirs(self.root, exist_ok=True)
+                stored_path = os.path.join(self.root, f"{digest[:16]}_{os.path.basename(filepath)}")
+                if os.path.abspath(stored_path) != os.path.abspath(filepath):
+                    shutil.move(filepath, stored_path)
+                entry = {
+                    'path': stored_path,
+                    'size': os.path.getsize(stored_path),
+                    'created_at': now,
+                    'metadata': {}
+                }
+                self._objects[digest] = entry
+
+            entry['last_access'] = now
+            entry['metadata'].update(metadata or {})
+            self._sources[source_key] = digest
+            self._save()
+            return entry['path']
+
+    def lookup(self, source_key: str) -> Optional[Dict[str, Any]]:
+        """البحث عن ملف مخزن لمفتاح مصدر وتحديث وقت استخدامه"""
+        with self._lock:
+            self._ensure_loaded()
+            digest = self._sources.get(source_key)
+            entry = self._objects.get(digest) if digest else None
+            if not entry:
+                return None
+            if not os.path.exists(entry['path']):
+                self._forget(digest)
+                self._save()
+                return None
+
+            entry['last_access'] = time.time()
+            return dict(entry, digest=digest)
+
+    def contains(self, filepath: str) -> bool:
+        """هل المسار ملف مخزن في المخزن (وليس أي ملف آخر على الخادم)"""
+        path = os.path.realpath(filepath)
+        with self._lock:
+            self._ensure_loaded()
+            return any(os.path.realpath(entry['path']) == path and os.path.exists(path)
+                       for entry in self._objects.values())
+
+    def pin(self, filepath: str, count: int = 1):
+        """منع طرد ملف أثناء استخدامه (مثلاً أثناء الإرسال)"""
+        with self._lock:
+            self._pins[filepath] = self._pins.get(filepath, 0) + count
+
+    def unpin(self, filepath: str):
+        """إلغاء تثبيت ملف بعد انتهاء استخدامه"""
+        with self._lock:
+            refs = self._pins.get(filepath, 0) - 1
+            if refs > 0:
+                self._pins[filepath] = refs
+            else:
+                self._pins.pop(filepath, None)
+
+    def evict(self) -> Dict[str, Any]:
+        """حذف الملفات القديمة ثم الأقل استخداماً حتى النزول تحت الحصة"""
+        removed = 0
+        freed = 0
+        now = time.time()
+
+        with self._lock:
+            self._ensure_loaded()
+            pinned = set(self._pins)
+
+            # الملفات المفقودة من القرص
+            for digest in [d for d, e in self._objects.items() if not os.path.exists(e['path'])]:
+                self._forget(digest)
+
+            candidates = sorted(
+                (e['last_access'], d) for d, e in self._objects.items() if e['path'] not in pinned
+            )
+            total = sum(e['size'] for e in self._objects.values())
+
+            for last_access, digest in candidates:
+                if now - last_access <= self.max_age and total <= self.max_bytes:
+                    break
+                entry = self._objects[digest]
+                try:
+                    os.remove(entry['path'])
+                except OSError as e:
+                    logger.error(f"Could not remove file {entry['path']}: {e}")
+                    continue
+                total -= entry['size']
+                freed += entry['size']
+                removed += 1
+                self._forget(digest)
+
+            removed_orphans, freed_orphans = self._remove_orphans(now, pinned)
+            self._save()
+
+        removed += removed_orphans
+        freed += freed_orphans
+        if removed:
+            logger.info(f"🧹 تم حذف {removed} ملف ({freed / (1024 * 1024):.1f} MB) من مخزن الوسائط")
+        return {'removed': removed, 'freed_bytes': freed}
+
+    def stats(self) -> Dict[str, Any]:
+        """إحصائيات المخزن"""
+        with self._lock:
+            self._ensure_loaded()
+            total = sum(e['size'] for e in self._objects.values())
+            return {
+                'files': len(self._objects),
+                'sources': len(self._sources),
+                'total_bytes': total,
+                'max_bytes': self.max_bytes,
+                'pinned': len(self._pins)
+            }
+
+    def _remove_orphans(self, now: float, pinned: set):
+        """حذف الملفات غير المفهرسة القديمة (بقايا تحميلات فاشلة أو مؤقتة)"""
+        removed = 0
+        freed = 0
+        if not os.path.isdir(self.root):
+            return removed, freed
+
+        known = {os.path.abspath(e['path']) for e in self._objects.values()}
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name == INDEX_FILENAME or not os.path.isfile(path):
+                continue
+            if os.path.abspath(path) in known or path in pinned:
+                continue
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+                    freed += size
+            except OSError as e:
+                logger.error(f"Could not remove file {path}: {e}")
+        return removed, freed
+
+    def _forget(self, digest: str):
+        self._objects.pop(digest, None)
+        for key in [k for k, d in self._sources.items() if d == digest]:
+            del self._sources[key]
+
+    def _index_path(self) -> str:
+        return os.path.join(self.root, INDEX_FILENAME)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            if os.path.exists(self._index_path()):
+                with open(self._index_path(), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._objects = data.get('objects', {})
+                self._sources = data.get('sources', {})
+        except Exception as e:
+            logger.error(f"❌ خطأ في تحميل فهرس مخزن الوسائط: {e}")
+            self._objects, self._sources = {}, {}
+
+    def _save(self):
+        """حفظ ذري للفهرس"""
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{self._index_path()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'objects': self._objects, 'sources': self._sources}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._index_path())
+        except Exception as e:
+            logger.error(f"❌ خطأ في حفظ فهرس مخزن الوسائط: {e}")
+
+
+# إنشاء مثيل وحيد
+media_store = MediaStore()
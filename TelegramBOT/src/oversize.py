@@ -0,0 +1,173 @@
+"""
+oversize.py - تجهيز الملفات الأكبر من حد الإرسال: تقسيم عند الإطارات المفتاحية أو ضغط بمرورين
+"""
+
+import os
+import glob
+import logging
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+from .ffmpeg_pool import ffmpeg_pool
+from .media_store import media_store
+from .media_editor import media_editor
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('split', 'compress')
+
+# أقل معدل بت مقبول للفيديو قبل اللجوء إلى التقسيم بدلاً من الضغط
+MIN_VIDEO_KBPS = 150
+# خفض الدقة عندما لا يكفي معدل البت للدقة الأصلية
+SCALE_STEPS = ((500, 480), (1000, 720))
+
+
+class OversizeHandler:
+    """تحويل ملف كبير إلى أجزاء أو ملف واحد ضمن حد الإرسال دون إعادة التحميل"""
+
+    def __init__(self, pool=None, store=None, editor=None, output_dir: str = "media/processed",
+                 safety_ratio: float = 0.95, audio_kbps: int = 128, default_timeout: float = 1800):
+        self.pool = pool or ffmpeg_pool
+        self.store = store or media_store
+        self.editor = editor or media_editor
+        self.output_dir = output_dir
+        self.safety_ratio = safety_ratio
+        self.audio_kbps = audio_kbps
+        self.default_timeout = default_timeout
+
+    def fit(self, path: str, max_bytes: int, strategy: str = 'split', job_id: Optional[str] = None) -> Dict[str, Any]:
+        """تطبيق الاستراتيجية المطلوبة، مع الرجوع إلى التقسيم إذا تعذر الضغط ضمن الحد"""
+        if not os.path.exists(path):
+            return {'success': False, 'error': f"الملف غير موجود: {path}"}
+        if os.path.getsize(path) <= max_bytes:
+            return {'success': True, 'parts': [path], 'method': 'none'}
+
+        try:
+            signature = self.editor.stream_signature(path)
+        except (ValueError, OSError, subprocess.TimeoutExpired) as e:
+            return {'success': False, 'error': f"تعذر قراءة الملف: {e}"}
+        if not signature.get('duration'):
+            return {'success': False, 'error': "مدة الملف غير معروفة"}
+
+        digest = self.store.hash_file(path)
+        if strategy == 'compress':
+            result = self.compress(path, max_bytes, signature, digest, job_id)
+            if result['success'] or result.get('cancelled'):
+                return result
+            logger.info(f"🗜️ تعذر الضغط ضمن الحد ({result['error']})، سيتم التقسيم بدلاً من ذلك")
+        return self.split(path, max_bytes, signature, digest, job_id)
+
+    def split(self, path: str, max_bytes: int, signature: Dict[str, Any], digest: str,
+              job_id: Optional[str] = None) -> Dict[str, Any]:
+        """تقسيم بنسخ المسارات عبر segment muxer؛ القطع يقع دائماً عند إطار مفتاحي"""
+        cached = self._cached_parts(digest, max_bytes)
+        if cached:
+            return {'success': True, 'parts': cached, 'method': 'split', 'from_cache': True}
+
+        ext = os.path.splitext(path)[1] or '.mp4'
+        size = os.path.getsize(path)
+        ratio = self.safety_ratio
+        os.makedirs(self.output_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as work_dir:
+            # طول الجزء يُقدّر من متوسط معدل البت، ويُصغّر إذا طالت مجموعة إطارات وتجاوز جزء الحد
+            for _ in range(4):
+                for leftover in glob.glob(os.path.join(work_dir, '*')):
+                    os.remove(leftover)
+                segment_time = signature['duration'] * max_bytes * ratio / size
+                pattern = os.path.join(work_dir, f"part%03d{ext}")
+                result = self.pool.run(['-i', path, '-map', '0:v:0?', '-map', '0:a:0?', '-c', 'copy',
+                                        '-f', 'segment', '-segment_time', f"{segment_time:.3f}",
+                                        '-reset_timestamps', '1', pattern], self.default_timeout, job_id)
+                if not result['success']:
+                    return result
+
+                parts = sorted(glob.glob(os.path.join(work_dir, f"part*{ext}")))
+                if parts and all(os.path.getsize(p) <= max_bytes for p in parts):
+                    break
+                ratio *= 0.75
+            else:
+                return {'success': False, 'error': "تعذر تقسيم الملف إلى أجزاء ضمن حد الإرسال"}
+
+            base = os.path.splitext(os.path.basename(path))[0]
+            stored = []
+            for index, part in enumerate(parts):
+                named = os.path.join(work_dir, f"{base}_part{index + 1}of{len(parts)}{ext}")
+                os.rename(part, named)
+                stored.append(self.store.put(named, self._part_key(digest, max_bytes, index),
+                                             {'parts': len(parts), 'index': index}))
+
+        logger.info(f"✂️ تم تقسيم {os.path.basename(path)} إلى {len(stored)} أجزاء")
+        return {'success': True, 'parts': stored, 'method': 'split', 'from_cache': False}
+
+    def compress(self, path: str, max_bytes: int, signature: Dict[str, Any], digest: str,
+                 job_id: Optional[str] = None) -> Dict[str, Any]:
+        """ضغط بمرورين بمعدل بت محسوب من الحجم المستهدف والمدة"""
+        source_key = f"compress|{digest}|{max_bytes}"
+        cached = self.store.lookup(source_key)
+        if cached:
+            return {'success': True, 'parts': [cached['path']], 'method': 'compress', 'from_cache': True}
+
+        total_kbps = max_bytes * 8 * self.safety_ratio / signature['duration'] / 1000
+        audio_kbps = min(self.audio_kbps, int(total_kbps / 4)) if 'audio' in signature else 0
+        video_kbps = int(total_kbps - audio_kbps)
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.splitext(os.path.basename(path))[0]
+
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as work_dir:
+            if 'video' not in signature:
+                output = os.path.join(work_dir, f"{base}_compressed.m4a")
+                result = self.pool.run(['-i', path, '-vn', '-c:a', 'aac', '-b:a', f"{max(int(total_kbps), 32)}k", output],
+                                       self.default_timeout, job_id)
+            elif video_kbps < MIN_VIDEO_KBPS:
+                return {'success': False, 'error': f"معدل البت المتاح ({video_kbps}kbps) منخفض جداً لهذه المدة"}
+            else:
+                output = os.path.join(work_dir, f"{base}_compressed.mp4")
+                result = self._two_pass(path, output, video_kbps, audio_kbps, signature, work_dir, job_id)
+
+            if not result['success']:
+                return result
+            if os.path.getsize(output) > max_bytes:
+                return {'success': False, 'error': "حجم الملف المضغوط ما زال يتجاوز الحد"}
+            stored = self.store.put(output, source_key, {'video_kbps': video_kbps})
+
+        logger.info(f"🗜️ تم ضغط {os.path.basename(path)} بمعدل {video_kbps}kbps")
+        return {'success': True, 'parts': [stored], 'method': 'compress', 'from_cache': False}
+
+    def _two_pass(self, path: str, output: str, video_kbps: int, audio_kbps: int, signature: Dict[str, Any],
+                  work_dir: str, job_id: Optional[str]) -> Dict[str, Any]:
+        passlog = os.path.join(work_dir, "passlog")
+        video_args = ['-c:v', 'libx264', '-preset', 'medium', '-b:v', f"{video_kbps}k", '-passlogfile', passlog]
+        height = signature['video'][2] or 0
+        for threshold, target_height in SCALE_STEPS:
+            if video_kbps < threshold and height > target_height:
+                video_args += ['-vf', f"scale=-2:{target_height}"]
+                break
+
+        first = self.pool.run(['-i', path, '-map', '0:v:0', *video_args, '-pass', '1', '-an', '-f', 'null', os.devnull],
+                              self.default_timeout, job_id)
+        if not first['success']:
+            return first
+        audio_args = ['-map', '0:a:0', '-c:a', 'aac', '-b:a', f"{audio_kbps}k"] if audio_kbps else ['-an']
+        return self.pool.run(['-i', path, '-map', '0:v:0', *video_args, '-pass', '2', *audio_args,
+                              '-movflags', '+faststart', output], self.default_timeout, job_id)
+
+    @staticmethod
+    def _part_key(digest: str, max_bytes: int, index: int) -> str:
+        return f"split|{digest}|{max_bytes}|{index}"
+
+    def _cached_parts(self, digest: str, max_bytes: int) -> Optional[List[str]]:
+        first = self.store.lookup(self._part_key(digest, max_bytes, 0))
+        if not first:
+            return None
+        parts = [first['path']]
+        for index in range(1, first['metadata'].get('parts', 1)):
+            entry = self.store.lookup(self._part_key(digest, max_bytes, index))
+            if not entry:
+                return None
+            parts.append(entry['path'])
+        return parts
+
+
+# إنشاء مثيل وحيد
+oversize_handler = OversizeHandler()
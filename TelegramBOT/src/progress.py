@@ -0,0 +1,299 @@
+"""
+progress.py - تقارير تقدم حية مع تحديث محدود المعدل لرسائل تيليجرام
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# حد طول الرسالة في تيليجرام
+MESSAGE_LIMIT = 4096
+STREAM_CURSOR = " ▌"
+
+
+def _format_bytes(num: Optional[float]) -> str:
+    if not num:
+        return "?"
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+def normalize_progress(data: Dict[str, Any]) -> Dict[str, Any]:
+    """تحويل قاموس تقدم yt-dlp إلى صيغة موحدة"""
+    downloaded = data.get('downloaded_bytes') or 0
+    total = data.get('total_bytes') or data.get('total_bytes_estimate')
+    percent = downloaded * 100 / total if total else None
+    return {
+        'stage': 'download',
+        'status': data.get('status'),
+        'percent': percent,
+        'downloaded': downloaded,
+        'total': total,
+        'speed': data.get('speed'),
+        'eta': data.get('eta')
+    }
+
+
+def normalize_postprocessor(data: Dict[str, Any]) -> Dict[str, Any]:
+    """تحويل قاموس المعالج اللاحق في yt-dlp إلى صيغة موحدة"""
+    return {
+        'stage': 'postprocess',
+        'status': data.get('status'),
+        'postprocessor': data.get('postprocessor')
+    }
+
+
+def format_progress(event: Dict[str, Any]) -> str:
+    """نص رسالة التقدم: النسبة والسرعة والوقت المتبقي"""
+    if event.get('stage') == 'postprocess':
+        return f"🔧 جاري المعالجة ({event.get('postprocessor') or 'FFmpeg'})..."
+
+    if event.get('status') == 'finished':
+        return "📦 اكتمل التحميل، جاري التجهيز..."
+
+    percent = event.get('percent')
+    if percent is None:
+        bar = "░" * 10
+        percent_text = "?"
+    else:
+        filled = int(percent // 10)
+        bar = "█" * filled + "░" * (10 - filled)
+        percent_text = f"{percent:.1f}%"
+
+    speed = f"{_format_bytes(event.get('speed'))}/s" if event.get('speed') else "?"
+    eta = event.get('eta')
+    eta_text = f"{int(eta) // 60:02d}:{int(eta) % 60:02d}" if eta is not None else "?"
+
+    return (
+        f"📥 جاري التحميل...\n"
+        f"{bar} {percent_text}\n"
+        f"📊 {_format_bytes(event.get('downloaded'))} / {_format_bytes(event.get('total'))}\n"
+        f"⚡ {speed} | ⏱️ {eta_text}"
+    )
+
+
+def markdown_safe(text: str) -> str:
+    """إغلاق وسوم Markdown المفتوحة في نص جزئي حتى لا يرفض تيليجرام التعديل
+
+    صيغة Markdown القديمة في تيليجرام لا تسمح بتداخل الوسوم، فيكفي تتبع وسم مفتوح واحد.
+    الرابط غير المكتمل "[نص](..." يُحذف من النص الجزئي حتى يكتمل.
+    """
+    open_tag: Optional[str] = None
+    link_start: Optional[int] = None
+    i = 0
+    while i < len(text):
+        if text.startswith('```', i) and open_tag in (None, '```'):
+            open_tag = None if open_tag == '```' else '```'
+            i += 3
+            continue
+        char = text[i]
+        if open_tag in ('```', '`'):
+            if char == '`' and open_tag == '`':
+                open_tag = None
+        elif char == '\\':
+            i += 1
+        elif char in '*_`':
+            if open_tag is None:
+                open_tag = char
+            elif open_tag == char:
+                open_tag = None
+        elif char == '[' and link_start is None:
+            link_start = i
+        elif char == ']' and link_start is not None and not text.startswith('(', i + 1) and i + 1 < len(text):
+            # أقواس عادية وليست رابطاً
+            link_start = None
+        elif char == ')' and link_start is not None and '](' in text[link_start:i]:
+            link_start = None
+        i += 1
+
+    if link_start is not None:
+        return markdown_safe(text[:link_start])
+    if open_tag == '```':
+        return text + "\n```"
+    return text + open_tag if open_tag else text
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """تقسيم نص طويل إلى رسائل ضمن الحد، عند فواصل الأسطر قدر الإمكان"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    return chunks + [text] if text or not chunks else chunks
+
+
+def render_partial(text: str) -> str:
+    """نص جزئي أثناء التوليد: ضمن حد الرسالة وبوسوم مغلقة ومؤشر كتابة"""
+    return markdown_safe(text[:MESSAGE_LIMIT - 64]) + STREAM_CURSOR
+
+
+class ThrottledMessageEditor:
+    """محرر رسائل يدمج التحديثات: تعديل واحد على الأكثر لكل محادثة كل N ثانية"""
+
+    # آخر تعديل لكل محادثة مشترك بين جميع المحررات لتجنب حدود الإغراق في تيليجرام
+    _last_edit_by_chat: Dict[int, float] = {}
+    _chat_lock = threading.Lock()
+
+    def __init__(self, bot, chat_id: int, message_id: int, min_interval: float = 3.0,
+                 parse_mode: Optional[str] = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+        self.parse_mode = parse_mode
+        self._pending: Optional[str] = None
+        self._last_text: Optional[str] = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        # يحافظ على ترتيب التعديلات دون حجز قفل الحالة أثناء الطلب الشبكي
+        self._send_lock = threading.Lock()
+        self._closed = False
+
+    def update(self, text: str):
+        """طلب تحديث النص؛ يُرسل فوراً أو يؤجل حتى انتهاء فترة التهدئة"""
+        with self._lock:
+            if self._closed or text == self._last_text:
+                return
+            self._pending = text
+            wait = self._time_until_allowed()
+            if wait > 0:
+                if self._timer is None:
+                    self._schedule(wait)
+                return
+        self._flush()
+
+    def close(self):
+        """إيقاف التحديثات المؤجلة (قبل كتابة الرسالة النهائية)"""
+        with self._lock:
+            self._closed = True
+            self._pending = None
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        # انتظار أي تعديل جارٍ حتى لا يصل بعد الرسالة النهائية
+        with self._send_lock:
+            pass
+
+    def _schedule(self, wait: float):
+        self._timer = threading.Timer(wait, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _time_until_allowed(self) -> float:
+        with self._chat_lock:
+            last = self._last_edit_by_chat.get(self.chat_id, 0)
+        return last + self.min_interval - time.monotonic()
+
+    def _record_edit(self, at: float):
+        """تسجيل وقت تعديل المحادثة مع حذف المحادثات التي انتهت فترة تهدئتها"""
+        now = time.monotonic()
+        with self._chat_lock:
+            expired = [chat_id for chat_id, last in self._last_edit_by_chat.items()
+                       if last + self.min_interval <= now]
+            for chat_id in expired:
+                del self._last_edit_by_chat[chat_id]
+            self._last_edit_by_chat[self.chat_id] = at
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._closed or self._pending is None:
+                return
+            wait = self._time_until_allowed()
+            if wait > 0:
+                self._schedule(wait)
+                return
+        self._flush()
+
+    def _flush(self):
+        """إرسال النص المعلق: الحالة تُسحب تحت القفل والطلب الشبكي يتم بعد تحريره"""
+        with self._send_lock:
+            with self._lock:
+                text, self._pending = self._pending, None
+                if self._closed or text is None or text == self._last_text:
+                    return
+                self._record_edit(time.monotonic())
+
+            try:
+                self.bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode=self.parse_mode)
+                self._last_text = text
+            except Exception as e:
+                retry_after = self._retry_after(e)
+                if retry_after:
+                    # تيليجرام طلب التمهل: نؤجل كل تعديلات المحادثة حتى انتهاء المهلة
+                    self._record_edit(time.monotonic() + retry_after)
+                    with self._lock:
+                        if self._closed:
+                            return
+                        if self._pending is None:
+                            self._pending = text
+                        if self._timer is None:
+                            self._schedule(retry_after + self.min_interval)
+                elif 'message is not modified' not in str(e):
+                    logger.warning(f"⚠️ تعذر تحديث رسالة التقدم: {e}")
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """استخراج مهلة الانتظار من خطأ 429"""
+        if getattr(error, 'error_code', None) != 429:
+            return None
+        result = getattr(error, 'result_json', None) or {}
+        return float(result.get('parameters', {}).get('retry_after', 5))
+
+
+class StreamingMessageEditor(ThrottledMessageEditor):
+    """عرض رد النموذج تدريجياً في رسالة واحدة أثناء توليده
+
+    التحديثات الجزئية تمر عبر حد معدل التعديل نفسه، والرد النهائي يُكتب دون انتظار
+    ويُقسم على عدة رسائل إن تجاوز حد تيليجرام.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, min_interval: float = 1.0,
+                 parse_mode: Optional[str] = 'Markdown'):
+        super().__init__(bot, chat_id, message_id, min_interval=min_interval, parse_mode=parse_mode)
+
+    def feed(self, text: str):
+        """النص المتولد حتى الآن"""
+        if text.strip():
+            self.update(render_partial(text))
+
+    def finish(self, text: str, reply_markup=None):
+        """كتابة الرد الكامل وإيقاف التحديثات الجزئية"""
+        self.close()
+        chunks = split_message(text or "…")
+        for index, chunk in enumerate(chunks):
+            markup = reply_markup if index == len(chunks) - 1 else None
+            if index == 0:
+                self._send_final(self.bot.edit_message_text, chunk, self.chat_id, self.message_id, reply_markup=markup)
+            else:
+                self._send_final(self.bot.send_message, self.chat_id, chunk, reply_markup=markup)
+
+    def _send_final(self, method, *args, **kwargs):
+        try:
+            return self._call_with_retry(method, *args, parse_mode=self.parse_mode, **kwargs)
+        except Exception as e:
+            if 'message is not modified' in str(e):
+                return None
+            if self.parse_mode and "can't parse" in str(e).lower():
+                # النموذج أنتج Markdown غير صالح: نرسل النص كما هو
+                return self._call_with_retry(method, *args, **kwargs)
+            raise
+
+    def _call_with_retry(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            retry_after = self._retry_after(e)
+            if not retry_after:
+                raise
+            time.sleep(retry_after)
+            return method(*args, **kwargs)
@@ -0,0 +1,183 @@
+"""
+resilience.py - حدود تزامن لكل منصة وقواطع دائرة وإعادة محاولة بتأخير أسي عشوائي
+"""
+
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_THROTTLE_MARKERS = ('429', 'too many requests', 'rate limit', 'rate-limit', 'ratelimit')
+_TRANSIENT_MARKERS = (
+    'timed out', 'timeout', 'connection reset', 'connection aborted', 'connection refused',
+    'temporary failure', 'remote end closed', 'incomplete read', 'http error 500', 'http error 502',
+    'http error 503', 'http error 504', 'unable to download webpage'
+)
+
+
+def classify_error(error: Any) -> str:
+    """تصنيف الخطأ: throttled أو transient أو permanent"""
+    text = str(error).lower()
+    if any(marker in text for marker in _THROTTLE_MARKERS):
+        return 'throttled'
+    if any(marker in text for marker in _TRANSIENT_MARKERS):
+        return 'transient'
+    return 'permanent'
+
+
+class CircuitOpenError(Exception):
+    """المنصة معطلة مؤقتاً بعد أخطاء متتالية"""
+
+    def __init__(self, platform: str, retry_in: float):
+        self.platform = platform
+        self.retry_in = retry_in
+        super().__init__(f"المنصة {platform} متوقفة مؤقتاً بسبب أخطاء متكررة، حاول بعد {retry_in:.0f} ثانية")
+
+
+class CircuitBreaker:
+    """قاطع دائرة: يفتح بعد أخطاء متتالية أو تقييد 429 ثم يسمح بمحاولة اختبار بعد المهلة"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60, max_reset_timeout: float = 900):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._current_timeout = reset_timeout
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """هل يُسمح بطلب جديد؟ (في الحالة نصف المفتوحة يُسمح بطلب اختبار واحد)"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self._current_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return max(0.0, self.opened_at + self._current_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+            self._current_timeout = self.reset_timeout
+
+    def record_failure(self, throttled: bool = False):
+        """تسجيل فشل؛ التقييد (429) يفتح القاطع فوراً"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                # فشل طلب الاختبار: مضاعفة مهلة الفتح
+                self._current_timeout = min(self._current_timeout * 2, self.max_reset_timeout)
+                self._open()
+            elif throttled or self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {'state': self.state, 'failures': self.failures, 'retry_in': round(self.retry_in(), 1)}
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float:
+    """تأخير أسي مع عشوائية كاملة (full jitter)"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class PlatformGuard:
+    """حد تزامن وقاطع دائرة مستقل لكل منصة حتى لا تعطل منصة متعثرة بقية المنصات"""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, default_limit: int = 2,
+                 failure_threshold: int = 5, reset_timeout: float = 60,
+                 max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.limits = dict(limits or {})
+        self.default_limit = self.limits.pop('default', default_limit)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, platform: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(platform)
+            if breaker is None:
+                breaker = self._breakers[platform] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def _semaphore(self, platform: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(platform)
+            if semaphore is None:
+                limit = self.limits.get(platform, self.default_limit)
+                semaphore = self._semaphores[platform] = threading.BoundedSemaphore(limit)
+            return semaphore
+
+    @contextmanager
+    def slot(self, platform: str):
+        """حجز مكان في حد تزامن المنصة"""
+        semaphore = self._semaphore(platform)
+        with semaphore:
+            yield
+
+    def call(self, platform: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """تنفيذ دالة شبكية للمنصة مع القاطع وحد التزامن وإعادة المحاولة للأخطاء العابرة
+
+        الوسائط نفسها تُمرر في كل محاولة؛ الدوال التي تعدل وسائطها يجب أن تُمرر ملفوفة تنشئ نسخة جديدة.
+        """
+        breaker = self.breaker(platform)
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            if not breaker.allow():
+                # إذا فُتح القاطع أثناء إعادة المحاولة فالخطأ الفعلي أوضح من "المنصة متوقفة"
+                if last_error is not None:
+                    raise last_error
+                raise CircuitOpenError(platform, breaker.retry_in())
+
+            try:
+                with self.slot(platform):
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                last_error = e
+                kind = classify_error(e)
+                if kind == 'permanent':
+                    # المنصة استجابت والخطأ خاص بالطلب نفسه (رابط خاص أو محذوف...)
+                    breaker.record_success()
+                    raise
+                breaker.record_failure(throttled=kind == 'throttled')
+                if kind == 'throttled' or attempt == self.max_attempts - 1:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning(f"⚠️ خطأ عابر من {platform}، إعادة المحاولة بعد {delay:.1f}ث: {e}")
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {platform: breaker.stats() for platform, breaker in self._breakers.items()}
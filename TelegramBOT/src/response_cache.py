@@ -0,0 +1,207 @@
+"""
+response_cache.py - ذاكرة ردود النموذج للأسئلة المتكررة: مطابقة تامة بعد التطبيع ومطابقة تقريبية بمقاطع الأحرف
+"""
+
+import re
+import math
+import hashlib
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+from .cache_utils import TTLCache
+from .intent_router import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# الكلمات القصيرة (حروف جر وأدوات) لا تمنع المطابقة التقريبية إذا اختلفت بين السؤالين، عدا أدوات النفي
+_MINOR_WORD_LENGTH = 3
+_NEGATIONS = {'لا', 'لم', 'لن', 'ليس', 'مو', 'مش', 'غير', 'بدون', 'not', 'no', 'don', 'doesn', 'isn', 'can', 't'}
+
+
+def canonical_text(text: str) -> str:
+    """صيغة موحدة للسؤال: تطبيع الأحرف وحذف علامات الترقيم والمسافات الزائدة"""
+    return ' '.join(_TOKEN.findall(normalize_text(text)))
+
+
+def trigrams(text: str) -> Counter:
+    return Counter(f" {word} "[i:i + 3] for word in text.split() for i in range(len(word)))
+
+
+class ResponseCache:
+    """ردود مخزنة لكل نموذج مع طرد LRU وانتهاء صلاحية
+
+    البحث التام عبر بصمة النص الموحد، والتقريبي عبر تشابه جيب التمام لمقاطع الأحرف الثلاثية
+    مع فهرس معكوس يحصر المرشحين. المطابقة التقريبية ترفض الأسئلة التي تختلف في كلمة مهمة
+    ("التحميل من تيك توك" و"التحميل من يوتيوب") حتى لو تشابهت أغلب الأحرف.
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: Optional[float] = 24 * 3600,
+                 similarity_threshold: float = 0.88, min_words: int = 3, max_question_chars: int = 300):
+        self.enabled = True
+        self.similarity_threshold = similarity_threshold
+        self.min_words = min_words
+        self.max_question_chars = max_question_chars
+        self._entries = TTLCache(max_size=max_entries, ttl=ttl)
+        self._lock = threading.RLock()
+        # لكل نموذج: بصمة السؤال -> (مقاطع الأحرف، طول المتجه، الكلمات)
+        self._vectors: Dict[str, Dict[str, Tuple[Counter, float, Set[str]]]] = defaultdict(dict)
+        self._postings: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def configure(self, enabled: Optional[bool] = None, max_entries: Optional[int] = None,
+                  ttl: Optional[float] = None, similarity_threshold: Optional[float] = None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if max_entries:
+                self._entries.max_size = max_entries
+            if ttl:
+                self._entries.ttl = ttl
+            if similarity_threshold:
+                self.similarity_threshold = similarity_threshold
+
+    def cacheable(self, question: str, history: Optional[Sequence] = None) -> bool:
+        """الأسئلة القصيرة جداً غالباً تعتمد على سياق المحادثة ("وماذا عن انستا؟")
+
+        وأي سؤال داخل محادثة لها سجل لا يُخزن ولا يُجاب من الذاكرة: الرد قد يتشكل من سياق
+        المستخدم (اسمه، ملفاته، أسئلته السابقة) فلا يصح إعادته لمستخدم آخر.
+        """
+        if history:
+            return False
+        text = canonical_text(question)
+        return self.enabled and len(text) <= self.max_question_chars and len(text.split()) >= self.min_words
+
+    def get(self, partition: str, question: str, history: Optional[Sequence] = None) -> Optional[str]:
+        """الرد المخزن لسؤال مطابق أو مشابه ضمن نموذج واحد"""
+        if not self.cacheable(question, history):
+            return None
+        text = canonical_text(question)
+        digest = self._digest(text)
+        with self._lock:
+            response = self._entries.get((partition, digest))
+            if response is not None:
+                self.exact_hits += 1
+                return response
+
+            match = self._nearest(partition, text)
+            response = self._entries.get((partition, match)) if match else None
+            if response is not None:
+                self.similar_hits += 1
+                return response
+            self.misses += 1
+            return None
+
+    def set(self, partition: str, question: str, response: str, history: Optional[Sequence] = None):
+        if not response or not self.cacheable(question, history):
+            return
+        text = canonical_text(question)
+        digest = self._digest(text)
+        vector = trigrams(text)
+        with self._lock:
+            self._entries.set((partition, digest), response)
+            if digest not in self._vectors[partition]:
+                self._vectors[partition][digest] = (vector, self._norm(vector), set(text.split()))
+                for gram in vector:
+                    self._postings[partition][gram].add(digest)
+            self.stores += 1
+            if sum(len(index) for index in self._vectors.values()) > self._entries.max_size * 2:
+                self._prune()
+
+    def clear(self, partition: Optional[str] = None):
+        with self._lock:
+            partitions = [partition] if partition else list(self._vectors)
+            for name in partitions:
+                for digest in self._vectors.pop(name, {}):
+                    self._entries.pop((name, digest))
+                self._postings.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self._entries.max_size,
+                'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self._entries.evictions,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'partitions': {name: len(index) for name, index in self._vectors.items()}
+            }
+
+    # --- Similarity ---
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _norm(vector: Counter) -> float:
+        return math.sqrt(sum(count * count for count in vector.values()))
+
+    def _nearest(self, partition: str, text: str) -> Optional[str]:
+        vectors = self._vectors.get(partition)
+        if not vectors:
+            return None
+        query = trigrams(text)
+        query_norm = self._norm(query)
+        postings = self._postings[partition]
+
+        # حاصل الضرب النقطي للمرشحين الذين يشاركون السؤال مقطعاً واحداً على الأقل
+        dots: Counter = Counter()
+        for gram, count in query.items():
+            for digest in postings.get(gram, ()):
+                dots[digest] += count * vectors[digest][0][gram]
+
+        words = set(text.split())
+        scored = sorted(((dot / (query_norm * vectors[digest][1]), digest) for digest, dot in dots.items()), reverse=True)
+        for score, digest in scored:
+            if score < self.similarity_threshold:
+                break
+            if (partition, digest) not in self._entries:
+                self._forget(partition, digest)
+            elif self._words_align(words, vectors[digest][2]):
+                return digest
+        return None
+
+    @staticmethod
+    def _words_align(first: Set[str], second: Set[str]) -> bool:
+        """كل كلمة مهمة في أحد السؤالين لها نظير قريب في الآخر (يسمح بالأخطاء الإملائية لا باستبدال الكلمة)"""
+        for words, others in ((first - second, second), (second - first, first)):
+            for word in words:
+                if word in _NEGATIONS:
+                    return False
+                if len(word) <= _MINOR_WORD_LENGTH:
+                    continue
+                grams = set(trigrams(word))
+                if not any(len(grams & set(trigrams(other))) / len(grams | set(trigrams(other))) >= 0.5
+                           for other in others):
+                    return False
+        return True
+
+    def _forget(self, partition: str, digest: str):
+        vector, _, _ = self._vectors[partition].pop(digest)
+        postings = self._postings[partition]
+        for gram in vector:
+            postings[gram].discard(digest)
+            if not postings[gram]:
+                del postings[gram]
+
+    def _prune(self):
+        """حذف الأسئلة المطرودة من ذاكرة الردود من فهرس التشابه"""
+        for partition, index in list(self._vectors.items()):
+            for digest in [d for d in index if (partition, d) not in self._entries]:
+                self._forget(partition, digest)
+
+
+# إنشاء مثيل وحيد
+response_cache = ResponseCache()
@@ -0,0 +1,67 @@
+"""
+stages.py - منفذات مراحل محدودة لتشغيل العمل الحاجب من حلقة asyncio
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StageBusyError(Exception):
+    """المرحلة مشغولة وتجاوزت حد الانتظار"""
+
+
+class StageExecutor:
+    """تنفيذ العمل الحاجب في خيوط منفصلة مع حد للتزامن والانتظار لكل مرحلة"""
+
+    def __init__(self, name: str, max_concurrency: int, max_pending: int):
+        self.name = name
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"{name}-stage")
+        self._pending = 0
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """تشغيل دالة حاجبة، أو رفض الطلب إذا امتلأ طابور الانتظار (الضغط العكسي)"""
+        if self._pending >= self.max_pending:
+            raise StageBusyError(self.name)
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def guard(self, coro) -> Any:
+        """تقييد عدد الـ coroutines المتزامنة لعمل غير حاجب (مثل طلبات LLM غير المتزامنة)"""
+        if self._pending >= self.max_pending:
+            coro.close()
+            raise StageBusyError(self.name)
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                return await coro
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': self._pending, 'max_pending': self.max_pending}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def create_stages(settings: Dict[str, Any]) -> Dict[str, StageExecutor]:
+    """إنشاء مراحل التنفيذ حسب الإعدادات"""
+    return {
+        'extract': StageExecutor('extract', settings.get("async_extract_concurrency", 8),
+                                 settings.get("async_extract_pending", 200)),
+        'llm': StageExecutor('llm', settings.get("async_llm_concurrency", 16),
+                             settings.get("async_llm_pending", 500)),
+    }
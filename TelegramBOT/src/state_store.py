@@ -0,0 +1,255 @@
+"""
+state_store.py - مخزن حالة المستخدمين: ذاكرة محدودة (LRU + TTL) أو SQLite دائم مع كتابة مؤجلة
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class MemoryStateBackend:
+    """تخزين الحالة في الذاكرة: ذاكرة TTLCache مستقلة لكل نطاق"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._namespaces: Dict[str, TTLCache] = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, namespace: str) -> TTLCache:
+        with self._lock:
+            cache = self._namespaces.get(namespace)
+            if cache is None:
+                cache = self._namespaces[namespace] = TTLCache(max_size=self.max_entries, ttl=None)
+            return cache
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        return self._cache(namespace).get(key, default)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        self._cache(namespace).set(key, value, ttl)
+
+    def delete(self, namespace: str, key: str):
+        self._cache(namespace).pop(key)
+
+    def count(self, namespace: str) -> int:
+        cache = self._cache(namespace)
+        cache.purge_expired()
+        return len(cache)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'namespaces': {name: cache.stats() for name, cache in self._namespaces.items()}
+        }
+
+
+class SQLiteStateBackend:
+    """تخزين الحالة في SQLite (وضع WAL) مع كتابة مؤجلة على دفعات
+
+    الكتابات تُجمع في الذاكرة وتُكتب في معاملة واحدة كل flush_interval ثانية
+    أو عند بلوغ batch_size، فتبقى الحالة بعد إعادة التشغيل ويمكن مشاركتها بين العمليات.
+    """
+
+    def __init__(self, path: str = "data/state.db", max_entries: int = 10000,
+                 flush_interval: float = 2.0, batch_size: int = 200):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # (النطاق، المفتاح) -> (القيمة، وقت الانتهاء) أو None للحذف
+        self._dirty: Dict[Tuple[str, str], Optional[Tuple[Any, Optional[float]]]] = {}
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self.writes = 0
+        self.flushes = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_state_updated ON state (namespace, updated_at)")
+        self._conn.commit()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="state-flush", daemon=True)
+        self._flusher.start()
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            if (namespace, key) in self._dirty:
+                pending = self._dirty[(namespace, key)]
+                if pending is None or (pending[1] is not None and pending[1] <= now):
+                    return default
+                return pending[0]
+
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+
+        if row is None or (row[1] is not None and row[1] <= now):
+            return default
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._dirty[(namespace, key)] = (value, expires_at)
+            self.writes += 1
+            if len(self._dirty) >= self.batch_size:
+                self.flush()
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._dirty[(namespace, key)] = None
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            self.flush()
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time())
+            ).fetchone()
+        return row[0]
+
+    def flush(self):
+        """كتابة التغييرات المعلقة في معاملة واحدة ثم حذف المنتهية وتقليم الزائد"""
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            now = time.time()
+            upserts = [
+                (ns, key, json.dumps(item[0], ensure_ascii=False), item[1], now)
+                for (ns, key), item in dirty.items() if item is not None
+            ]
+            deletes = [(ns, key) for (ns, key), item in dirty.items() if item is None]
+
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO state (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, "
+                        "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+                        upserts
+                    )
+                    self._conn.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+                    self._conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                    for ns in {ns for ns, _ in dirty}:
+                        self._conn.execute(
+                            "DELETE FROM state WHERE namespace = ? AND key NOT IN ("
+                            "SELECT key FROM state WHERE namespace = ? ORDER BY updated_at DESC LIMIT ?)",
+                            (ns, ns, self.max_entries)
+                        )
+                self.flushes += 1
+            except sqlite3.Error as e:
+                logger.error(f"❌ خطأ في حفظ حالة المستخدمين: {e}")
+                # إعادة التغييرات التي لم تُكتب دون الكتابة فوق الأحدث منها
+                for item_key, item in dirty.items():
+                    self._dirty.setdefault(item_key, item)
+
+    def close(self):
+        """إيقاف الكتابة المؤجلة وحفظ ما تبقى"""
+        self._stop_event.set()
+        self._flusher.join(self.flush_interval + 1)
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'path': self.path,
+                'pending_writes': len(self._dirty),
+                'writes': self.writes,
+                'flushes': self.flushes
+            }
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ خطأ في الكتابة المؤجلة للحالة: {e}")
+
+
+class StateNamespace:
+    """واجهة تشبه القاموس لنطاق واحد داخل مخزن الحالة
+
+    القيم تُعاد كنسخ عند استخدام SQLite، لذا يجب إعادة تخزين القيمة بعد تعديلها.
+    """
+
+    def __init__(self, backend, namespace: str, ttl: Optional[float] = None):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self.backend.get(self.namespace, str(key), default)
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None):
+        self.backend.set(self.namespace, str(key), value, self.ttl if ttl is None else ttl)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.backend.delete(self.namespace, str(key))
+        return value
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: Any):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return self.backend.count(self.namespace)
+
+
+def create_state_backend(settings: Dict[str, Any]):
+    """إنشاء مخزن الحالة حسب الإعدادات (memory أو sqlite)"""
+    max_entries = settings.get("state_max_entries", 10000)
+    if settings.get("state_backend", "memory") == "sqlite":
+        try:
+            return SQLiteStateBackend(
+                settings.get("state_db_path", "data/state.db"),
+                max_entries=max_entries,
+                flush_interval=settings.get("state_flush_interval", 2.0)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"❌ تعذر فتح قاعدة الحالة، سيتم استخدام الذاكرة: {e}")
+    return MemoryStateBackend(max_entries)
@@ -9,12 +9,13 @@ from typing import Type
 from pydantic import BaseModel, Field
 import os
 import logging
-import zipfile
-import shutil
-from datetime import datetime
 
 # Import local modules
 from .yt_dlp_wrapper import downloader
+from .converter import converter
+from .media_editor import media_editor
+from .zip_builder import zip_builder
+from .media_store import media_store
 
 # إعداد التسجيل
 logging.basicConfig(level=logging.INFO)
@@ -34,6 +35,16 @@ class FileConverterSchema(BaseModel):
     input_file: str = Field(description="مسار الملف المدخل للتحويل")
     output_format: str = Field(description="الصيغة الجديدة المطلوبة (e.g., 'mp3', 'mp4')")
 
+class VideoEditorSchema(BaseModel):
+    input_files: str = Field(description="مسار الملف للقص، أو عدة مسارات مفصولة بفواصل للدمج")
+    start: str = Field(default="", description="وقت بداية القص (e.g., '1:30')")
+    end: str = Field(default="", description="وقت نهاية القص (e.g., '2:45')")
+
+class ZipManagerSchema(BaseModel):
+    files: str = Field(description="مسارات ملفات محملة سابقاً (من مخزن الوسائط) مفصولة بفواصل")
+    archive_name: str = Field(default="archive", description="اسم الأرشيف دون امتداد")
+    max_part_mb: float = Field(default=0, description="أقصى حجم لكل جزء بالميجابايت (0 = جزء واحد)")
+
 # --- LangChain Tools (Class-based) ---
 
 class AdvancedVideoDownloaderTool(BaseTool):
@@ -81,31 +92,91 @@ class AdvancedVideoInfoTool(BaseTool):
 class FileConverterTool(BaseTool):
     """أداة تحويل الملفات"""
     name: str = "file_converter"
-    description: str = "تحويل الملفات بين صيغ مختلفة (محاكاة)"
+    description: str = "تحويل ملفات الصوت والفيديو بين الصيغ (mp4, mkv, webm, mov, avi, gif, mp3, m4a, opus, ogg, flac, wav) باستخدام FFmpeg"
     args_schema: Type[BaseModel] = FileConverterSchema
 
     def _run(self, input_file: str, output_format: str) -> str:
         try:
-            if not os.path.exists(input_file):
-                return f"❌ الملف غير موجود: {input_file}"
-            
-            output_dir = "media/processed"
-            os.makedirs(output_dir, exist_ok=True)
-            base_name = os.path.splitext(os.path.basename(input_file))[0]
-            output_file = os.path.join(output_dir, f"{base_name}.{output_format}")
-            
-            # This is a simulation. Real conversion requires a library like FFmpeg.
-            shutil.copy2(input_file, output_file)
+            # الأداة تحول فقط الملفات المحملة للمستخدمين، لا أي مسار على الخادم
+            if not media_store.contains(input_file):
+                return f"❌ الملف خارج مخزن الوسائط ولا يمكن تحويله: {os.path.basename(input_file)}"
+            result = converter.convert(input_file, output_format)
+            if not result['success']:
+                return f"❌ فشل التحويل: {result['error']}"
             
-            return f"✅ تم التحويل بنجاح! الملف الجديد: {output_file}"
+            if result.get('from_cache'):
+                method = "من الذاكرة (تم التحويل سابقاً)"
+            elif not result['transcoded']:
+                method = "نسخ مباشر دون إعادة ترميز"
+            else:
+                method = "إعادة ترميز " + " و".join({'video': 'الفيديو', 'audio': 'الصوت'}[k] for k in result['transcoded'])
+            return f"✅ تم التحويل بنجاح! ({method})\nالملف الجديد: {result['filepath']}"
         except Exception as e:
             logger.error(f"خطأ في التحويل: {e}")
             return f"❌ خطأ في تحويل الملف: {str(e)}"
 
+class VideoEditorTool(BaseTool):
+    """أداة قص ودمج الفيديو"""
+    name: str = "video_editor"
+    description: str = "قص مقطع من فيديو بين وقتين أو دمج عدة فيديوهات في ملف واحد، بنسخ مباشر دون إعادة ترميز متى أمكن"
+    args_schema: Type[BaseModel] = VideoEditorSchema
+
+    def _run(self, input_files: str, start: str = "", end: str = "") -> str:
+        try:
+            paths = [p.strip() for p in input_files.split(',') if p.strip()]
+            rejected = [p for p in paths if not media_store.contains(p)]
+            if not paths or rejected:
+                return f"❌ ملفات خارج مخزن الوسائط لا يمكن تحريرها: {', '.join(os.path.basename(p) for p in rejected)}"
+            if len(paths) > 1:
+                result = media_editor.concat(paths)
+            elif start and end:
+                result = media_editor.trim(paths[0], start, end)
+            else:
+                return "❌ حدد وقتي البداية والنهاية للقص أو أكثر من ملف للدمج"
+
+            if not result['success']:
+                return f"❌ فشلت العملية: {result['error']}"
+            methods = {'stream_copy': "نسخ مباشر دون إعادة ترميز",
+                       'smart_cut': "إعادة ترميز بداية المقطع فقط حتى أول إطار مفتاحي",
+                       'partial_reencode': "توحيد الملفات المختلفة فقط ثم نسخ مباشر",
+                       'reencode': "إعادة ترميز المقطع"}
+            return f"✅ تمت العملية بنجاح! ({methods.get(result['method'], result['method'])})\nالملف الجديد: {result['filepath']}"
+        except Exception as e:
+            logger.error(f"خطأ في تحرير الفيديو: {e}")
+            return f"❌ خطأ في تحرير الفيديو: {str(e)}"
+
+class ZipManagerTool(BaseTool):
+    """أداة إنشاء الأرشيفات"""
+    name: str = "zip_manager"
+    description: str = "ضغط عدة ملفات في أرشيف ZIP (الوسائط تُخزن دون إعادة ضغط) مع تقسيمه إلى أجزاء عند تحديد حد للحجم"
+    args_schema: Type[BaseModel] = ZipManagerSchema
+
+    def _run(self, files: str, archive_name: str = "archive", max_part_mb: float = 0) -> str:
+        try:
+            paths = [p.strip() for p in files.split(',') if p.strip()]
+            # الأداة تضغط فقط الملفات المحملة للمستخدمين، لا أي مسار على الخادم
+            rejected = [p for p in paths if not media_store.contains(p)]
+            if rejected:
+                return f"❌ ملفات خارج مخزن الوسائط لا يمكن ضغطها: {', '.join(os.path.basename(p) for p in rejected)}"
+            name = os.path.basename(archive_name).replace('..', '_') or "archive"
+            entries = [(path, media_store.original_name(path)) for path in paths]
+            result = zip_builder.build(entries, name, int(max_part_mb * 1024 * 1024) or None)
+            if not result['success']:
+                return f"❌ فشل إنشاء الأرشيف: {result['error']}"
+            # الأجزاء تُسجل في المخزن فتخضع لحصة المساحة والطرد كباقي الملفات
+            parts = [media_store.put(part, f"archive|{name}|{index}") for index, part in enumerate(result['parts'])]
+            return (f"✅ تم إنشاء الأرشيف ({result['files']} ملف، {result['size'] / (1024 * 1024):.1f} MB)\n"
+                    + "\n".join(f"📦 {part}" for part in parts))
+        except Exception as e:
+            logger.error(f"خطأ في إنشاء الأرشيف: {e}")
+            return f"❌ خطأ في إنشاء الأرشيف: {str(e)}"
+
 
 # قائمة جميع الأدوات
 ALL_TOOLS = [
     AdvancedVideoDownloaderTool(),
     AdvancedVideoInfoTool(),
     FileConverterTool(),
+    VideoEditorTool(),
+    ZipManagerTool(),
 ]
@@ -20,31 +20,47 @@ def extract_url(text):
             return urls[0]
     return None
 
+def extract_urls(text):
+    """استخراج جميع الروابط من النص بترتيب ظهورها ودون تكرار"""
+    urls = []
+    for url in re.findall(r'https?://[^\s]+', text or ""):
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+def extract_time_range(text):
+    """استخراج وقتي البداية والنهاية (مثل 1:30 2:45) من نص بعد حذف الروابط"""
+    times = re.findall(r'(?<![\w.:])\d+(?::\d{1,2}){0,2}(?:\.\d+)?(?![\w:])', re.sub(r'https?://[^\s]+', ' ', text or ""))
+    if len(times) < 2:
+        return None
+    return times[0], times[1]
+
 # وظائف مساعدة لمعالجة الأدوات
 def handle_bulk_action(action):
-    return f"📦 **التحميل المجمع:** أرسل قائمة بالروابط مفصولة بأسطر للبدء"
+    return f"📦 **التحميل المجمع:** أرسل قائمة بالروابط مفصولة بأسطر للبدء\nسيتم تحميلها بالتوازي وإرسالها بالترتيب"
 
 def handle_playlist_action(action):
     return f"📋 **قائمة التشغيل:** أرسل رابط قائمة التشغيل للبدء"
 
 def handle_convert_action(action):
-    format_name = action.replace('convert_', '').upper()
-    return f"🔄 **تحويل إلى {format_name}:** ارفع الملف المراد تحويله"
+    format_name = action.replace('convert_', '')
+    target = "صوت فقط" if format_name == 'audio' else f"تحويل إلى {format_name.upper()}"
+    return f"🔄 **{target}:** أرسل رابط المقطع وسيصلك بالصيغة المطلوبة"
 
 def handle_trim_action(action):
-    return f"✂️ **قص الفيديو:** ارفع الفيديو وحدد نقطة البداية والنهاية"
+    return f"✂️ **قص الفيديو:** أرسل الرابط ثم وقت البداية والنهاية\nمثال: `https://youtu.be/xyz 1:30 2:45`"
 
 def handle_merge_action(action):
-    return f"🔗 **دمج الملفات:** ارفع الملفات المراد دمجها"
+    return f"🔗 **دمج الملفات:** أرسل روابط الفيديوهات بالترتيب المطلوب، كل رابط في سطر"
 
 def handle_compress_action(action):
-    return f"🗜️ **ضغط الملفات:** ارفع الملف المراد ضغطه"
+    return f"🗜️ **ضغط الملفات:** أرسل الروابط (كل رابط في سطر) وسيتم تحميلها وإرسالها في أرشيف ZIP واحد\nالأرشيف يُقسم تلقائياً إلى أجزاء تحت حد الإرسال"
 
 def handle_watermark_action(action):
     return f"🏷️ **العلامة المائية:** ارفع الفيديو وحدد نوع العلامة"
 
 def handle_image_action(action):
-    return f"🖼️ **معالجة الصور:** ارفع الصورة للبدء"
+    return f"🖼️ **معالجة الصور:** أرسل صورة أو عدة صور (كملف للحفاظ على الجودة) ثم اختر العملية"
 
 def handle_thumbnail_action(action):
     return f"🎨 **الصور المصغرة:** ارفع الفيديو أو الصورة للبدء"
@@ -0,0 +1,173 @@
+"""
+webhook_server.py - خادم Webhook خفيف لاستقبال تحديثات تيليجرام بدلاً من الاستطلاع
+"""
+
+import hmac
+import json
+import queue
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class WebhookDispatcher:
+    """التحقق من التحديثات الواردة وتمريرها إلى طابور المعالجة"""
+
+    def __init__(self, bot, secret_token: Optional[str] = None, workers: int = 4, max_queue_size: int = 1000):
+        self.bot = bot
+        self.secret_token = secret_token
+        self.workers = workers
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._threads: List[threading.Thread] = []
+        self.received = 0
+        self.rejected = 0
+
+    def start(self):
+        """تشغيل عمال المعالجة"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"webhook-dispatch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """إيقاف العمال بعد إنهاء التحديثات المعلقة"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(5)
+        self._threads = []
+
+    def handle(self, body: bytes, secret: Optional[str]) -> Tuple[int, str]:
+        """معالجة جسم الطلب وإرجاع (رمز الحالة، الرسالة)"""
+        if self.secret_token and not hmac.compare_digest(secret or "", self.secret_token):
+            self.rejected += 1
+            return 403, "forbidden"
+
+        try:
+            update = types.Update.de_json(json.loads(body.decode('utf-8')))
+        except (ValueError, KeyError, UnicodeDecodeError) as e:
+            self.rejected += 1
+            return 400, f"invalid update: {e}"
+
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            # رمز 503 يجعل تيليجرام يعيد إرسال التحديث لاحقاً
+            return 503, "busy"
+
+        self.received += 1
+        return 200, "ok"
+
+    def stats(self) -> Dict[str, Any]:
+        """إحصائيات الاستقبال"""
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'queued': self._queue.qsize(),
+            'workers': len(self._threads)
+        }
+
+    def _worker_loop(self):
+        while True:
+            update = self._queue.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logger.error(f"❌ خطأ في معالجة تحديث Webhook: {e}")
+
+
+def _make_handler(dispatcher: WebhookDispatcher, path: str):
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path:
+                return self._reply(404, "not found")
+
+            length = int(self.headers.get('Content-Length') or 0)
+            if length <= 0 or length > MAX_BODY_BYTES:
+                return self._reply(413 if length else 400, "bad length")
+
+            status, message = dispatcher.handle(self.rfile.read(length), self.headers.get(SECRET_HEADER))
+            self._reply(status, message)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                return self._reply(200, json.dumps(dispatcher.stats()), "application/json")
+            self._reply(404, "not found")
+
+        def _reply(self, status: int, message: str, content_type: str = "text/plain"):
+            body = message.encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("webhook: " + format % args)
+
+    return WebhookRequestHandler
+
+
+class WebhookServer:
+    """خادم HTTP يستقبل التحديثات على مسار محدد"""
+
+    def __init__(self, bot, listen: str = "0.0.0.0", port: int = 8443, path: str = "/webhook",
+                 secret_token: Optional[str] = None, workers: int = 4, max_queue_size: int = 1000):
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.dispatcher = WebhookDispatcher(bot, secret_token, workers, max_queue_size)
+        self._httpd: Optional[ThreadingHTTPServer] = None
+
+    def serve_forever(self):
+        """بدء الاستقبال (يحجب حتى الإيقاف)"""
+        self.dispatcher.start()
+        self._httpd = ThreadingHTTPServer((self.listen, self.port), _make_handler(self.dispatcher, self.path))
+        logger.info(f"🌐 خادم Webhook يستمع على {self.listen}:{self.port}{self.path}")
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+            self.dispatcher.stop()
+
+    def shutdown(self):
+        """إيقاف الخادم"""
+        if self._httpd:
+            self._httpd.shutdown()
+
+
+def post_update(url: str, update_file: str, secret_token: Optional[str] = None) -> int:
+    """إرسال تحديث مسجل (JSON) إلى خادم Webhook محلي للاختبار"""
+    with open(update_file, 'rb') as f:
+        body = f.read()
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+    if secret_token:
+        request.add_header(SECRET_HEADER, secret_token)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="إرسال تحديث مسجل إلى خادم Webhook محلي")
+    parser.add_argument("update_file", help="ملف JSON يحتوي على تحديث تيليجرام")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/webhook")
+    parser.add_argument("--secret", default=None)
+    args = parser.parse_args()
+    print(post_update(args.url, args.update_file, args.secret))
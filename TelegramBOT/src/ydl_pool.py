@@ -0,0 +1,135 @@
+"""
+ydl_pool.py - مجمع نسخ YoutubeDL قابلة لإعادة الاستخدام حسب ملف الإعدادات
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# إعدادات قابلة للتغيير لكل استدعاء دون إعادة بناء النسخة
+PER_CALL_PARAMS = ('outtmpl', 'format', 'max_filesize', 'merge_output_format')
+
+
+class _PooledInstance:
+    """نسخة YoutubeDL مع خطافات التقدم الخاصة بالاستدعاء الحالي"""
+
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.progress_hooks: List[Callable] = []
+        self.postprocessor_hooks: List[Callable] = []
+        # خطاف ثابت واحد يوزع الأحداث على خطافات الاستدعاء الحالي
+        ydl.add_progress_hook(lambda d: [hook(d) for hook in list(self.progress_hooks)])
+        ydl.add_postprocessor_hook(lambda d: [hook(d) for hook in list(self.postprocessor_hooks)])
+
+
+class YoutubeDLPool:
+    """إعارة نسخ YoutubeDL لكل ملف إعدادات (info / video / audio) وإعادتها بعد الاستخدام
+
+    إعادة الاستخدام تحفظ المستخرجات المهيأة وملف الكوكيز واتصالات HTTP المفتوحة.
+    """
+
+    def __init__(self, factory: Callable[[Dict[str, Any]], Any], max_idle_per_profile: int = 4):
+        self.factory = factory
+        self.max_idle_per_profile = max_idle_per_profile
+        self._idle: Dict[str, List[_PooledInstance]] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def checkout(self, profile: str, base_params: Dict[str, Any],
+                 progress_hooks: Optional[Dict[str, Any]] = None, **overrides):
+        """استعارة نسخة لملف الإعدادات مع تطبيق إعدادات الاستدعاء (outtmpl, format, ...)"""
+        pooled = self._acquire(profile, base_params)
+        saved = self._apply(pooled, progress_hooks or {}, overrides)
+        try:
+            yield pooled.ydl
+        finally:
+            self._restore(pooled, saved)
+            self._release(profile, pooled)
+
+    def _acquire(self, profile: str, base_params: Dict[str, Any]) -> _PooledInstance:
+        with self._lock:
+            idle = self._idle.get(profile)
+            if idle:
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+            self.created += 1
+        return _PooledInstance(self.factory(dict(base_params)))
+
+    def _release(self, profile: str, pooled: _PooledInstance):
+        with self._lock:
+            idle = self._idle.setdefault(profile, [])
+            if len(idle) < self.max_idle_per_profile:
+                idle.append(pooled)
+                return
+        self._close(pooled)
+
+    def _apply(self, pooled: _PooledInstance, hooks: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+        """تطبيق إعدادات الاستدعاء وإرجاع القيم الأصلية لاستعادتها لاحقاً"""
+        ydl = pooled.ydl
+        pooled.progress_hooks = list(hooks.get('progress_hooks', []))
+        pooled.postprocessor_hooks = list(hooks.get('postprocessor_hooks', []))
+
+        saved = {}
+        for name, value in overrides.items():
+            if name not in PER_CALL_PARAMS:
+                raise ValueError(f"unsupported per-call option: {name}")
+            saved[name] = ydl.params.get(name)
+            self._set_param(ydl, name, value)
+        return saved
+
+    def _restore(self, pooled: _PooledInstance, saved: Dict[str, Any]):
+        pooled.progress_hooks = []
+        pooled.postprocessor_hooks = []
+        for name, value in saved.items():
+            self._set_param(pooled.ydl, name, value)
+
+    @staticmethod
+    def _set_param(ydl, name: str, value: Any):
+        if name == 'outtmpl':
+            # yt-dlp يحول outtmpl إلى قاموس عند الإنشاء
+            outtmpl = ydl.params.get('outtmpl')
+            if isinstance(outtmpl, dict) and not isinstance(value, dict):
+                ydl.params['outtmpl'] = dict(outtmpl, default=value)
+                return
+        elif name == 'format':
+            # محدد الصيغة يُبنى مرة واحدة عند الإنشاء، لذا نعيد بناءه للصيغة الجديدة
+            ydl.format_selector = ydl.build_format_selector(value) if value else None
+
+        if value is None:
+            ydl.params.pop(name, None)
+        else:
+            ydl.params[name] = value
+
+    @staticmethod
+    def _close(pooled: _PooledInstance):
+        try:
+            pooled.ydl.close()
+        except Exception as e:
+            logger.debug(f"تعذر إغلاق نسخة YoutubeDL: {e}")
+
+    def clear(self):
+        """إغلاق جميع النسخ الخاملة"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for instances in idle.values():
+            for pooled in instances:
+                self._close(pooled)
+
+    def stats(self) -> Dict[str, Any]:
+        """إحصائيات المجمع"""
+        total = self.hits + self.misses
+        with self._lock:
+            return {
+                'created': self.created,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'idle': {profile: len(instances) for profile, instances in self._idle.items()}
+            }
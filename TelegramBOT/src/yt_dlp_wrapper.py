@@ -1,10 +1,20 @@
 
 # yt_dlp_wrapper.py - مغلف متطور ومحسن لـ yt-dlp
 import os
+import copy
 import json
 from typing import Dict, List, Any, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import re
 import logging
+import threading
+
+from .cache_utils import TTLCache
+from .media_store import media_store
+from .progress import normalize_progress, normalize_postprocessor
+from .ydl_pool import YoutubeDLPool
+from .resilience import PlatformGuard
+from .ffmpeg_pool import ffmpeg_pool
 
 try:
     import yt_dlp
@@ -13,6 +23,18 @@ except ImportError:
     YT_DLP_AVAILABLE = False
     print("⚠️ yt-dlp غير متاح. سيتم العمل في الوضع المحاكي.")
 
+# أخطاء تعني أن روابط البث في معلومات الاستخراج المخزنة انتهت صلاحيتها
+_STALE_INFO_MARKERS = ('http error 403', 'http error 410', '403: forbidden', '410: gone')
+
+class _InflightDownload:
+    """تحميل جارٍ يشترك فيه عدة طالبين لنفس المفتاح"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.waiters = 0
+        self.progress_callbacks: List = []
+
 class AdvancedMediaDownloader:
     def __init__(self):
         """تهيئة منزل الوسائط المتطور"""
@@ -22,63 +44,221 @@ class AdvancedMediaDownloader:
             'linkedin', 'pinterest', 'snapchat', 'whatsapp', 'telegram'
         ]
         
+        # ذاكرة مؤقتة لنتائج الاستخراج: استخراج واحد لكل رابط يغذي الصيغ والمعلومات والتحميل
+        self._info_cache = TTLCache(max_size=256, ttl=600)
+        
+        # دمج الطلبات المتطابقة الجارية: تحميل واحد يوزع نتيجته على كل المنتظرين
+        self._inflight: Dict[tuple, _InflightDownload] = {}
+        self._inflight_lock = threading.Lock()
+        
+        # نسخ YoutubeDL معاد استخدامها لكل ملف إعدادات بدلاً من إنشاء نسخة لكل طلب
+        self._ydl_pool = YoutubeDLPool(lambda params: yt_dlp.YoutubeDL(params))
+        
+        # حد تزامن وقاطع دائرة لكل منصة مع إعادة محاولة للأخطاء العابرة
+        self.platform_guard = PlatformGuard()
+        
+        # ترميز الصوت الافتراضي: native ينسخ المسار الأصلي دون إعادة ترميز
+        self.audio_codec = 'native'
+        
+        # حد حجم الرفع: 50MB لواجهة البوت العامة أو 2000MB لخادم Bot API محلي
+        self.max_upload_bytes = 50 * 1024 * 1024
+        
         # إعداد التسجيل
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
     
+    def canonical_url(self, url: str) -> str:
+        """توحيد شكل الرابط ليصلح كمفتاح للذاكرة المؤقتة"""
+        url = url.strip()
+        parts = urlsplit(url)
+        netloc = parts.netloc.lower()
+        if netloc.startswith('www.') or netloc.startswith('m.'):
+            netloc = netloc.split('.', 1)[1]
+        
+        # إزالة معاملات التتبع التي لا تغير المحتوى
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                 if not k.startswith('utm_') and k not in ('si', 'feature', 'igshid', 'fbclid', 'ref')]
+        path = parts.path.rstrip('/') or '/'
+        
+        # توحيد روابط يوتيوب المختصرة
+        if netloc == 'youtu.be' and path != '/':
+            netloc, query = 'youtube.com', [('v', path.lstrip('/'))] + [q for q in query if q[0] != 'v']
+            path = '/watch'
+        elif netloc == 'youtube.com' and path.startswith('/shorts/'):
+            query = [('v', path.split('/')[2])] + [q for q in query if q[0] != 'v']
+            path = '/watch'
+        
+        return urlunsplit(('https', netloc, path, urlencode(sorted(query)), ''))
+    
+    def _extract_info(self, url: str) -> Dict[str, Any]:
+        """استخراج معلومات الرابط مرة واحدة مع التخزين المؤقت"""
+        key = self.canonical_url(url)
+        info = self._info_cache.get(key)
+        if info is not None:
+            return info
+        
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'noplaylist': True,
+        }
+        
+        with self._ydl_pool.checkout('info', ydl_opts) as ydl:
+            info = self.platform_guard.call(self._platform_key(url), ydl.extract_info, url, download=False)
+        
+        self._info_cache.set(key, info)
+        return info
+    
+    def configure_platforms(self, limits: Optional[Dict[str, int]] = None, failure_threshold: int = 5,
+                            reset_timeout: float = 60, max_attempts: int = 3):
+        """ضبط حدود التزامن وقواطع الدائرة لكل منصة"""
+        self.platform_guard = PlatformGuard(limits, failure_threshold=failure_threshold,
+                                            reset_timeout=reset_timeout, max_attempts=max_attempts)
+    
+    def platform_stats(self) -> Dict[str, Any]:
+        """حالة قواطع الدائرة لكل منصة"""
+        return self.platform_guard.stats()
+    
+    def _platform_key(self, url: str, info: Optional[Dict[str, Any]] = None) -> str:
+        """مفتاح المنصة: من الرابط، أو من مفتاح المستخرج للمواقع غير المعروفة"""
+        platform = self._detect_platform(url)
+        if platform == 'منصة أخرى' and info and info.get('extractor_key'):
+            return info['extractor_key']
+        return platform
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """إحصائيات إعادة استخدام نسخ YoutubeDL"""
+        return self._ydl_pool.stats()
+    
+    def invalidate_info(self, url: str):
+        """حذف معلومات رابط من الذاكرة المؤقتة (مثلاً بعد انتهاء صلاحية روابط البث)"""
+        self._info_cache.pop(self.canonical_url(url))
+    
+    def _is_stale_info_error(self, error: Exception) -> bool:
+        """هل فشل التحميل بسبب معلومات استخراج قديمة (روابط منتهية أو خطأ من المستخرج)؟"""
+        original = (getattr(error, 'exc_info', None) or (None, None))[1] or error
+        if YT_DLP_AVAILABLE and isinstance(original, yt_dlp.utils.ExtractorError):
+            return True
+        text = str(error).lower()
+        return any(marker in text for marker in _STALE_INFO_MARKERS)
+    
+    def _process_info(self, ydl, url: str) -> Dict[str, Any]:
+        """التحميل من معلومات الاستخراج المخزنة، مع استخراج جديد مرة واحدة إذا انتهت صلاحيتها"""
+        for attempt in range(2):
+            cached_info = self._extract_info(url)
+            try:
+                # نسخة جديدة لكل محاولة لأن yt-dlp يعدل القاموس أثناء المعالجة، حتى في المحاولة الفاشلة
+                return self.platform_guard.call(
+                    self._platform_key(url, cached_info),
+                    lambda: ydl.process_ie_result(copy.deepcopy(cached_info), download=True))
+            except Exception as e:
+                if attempt or not self._is_stale_info_error(e):
+                    raise
+                self.logger.warning(f"⚠️ معلومات الاستخراج المخزنة لم تعد صالحة، إعادة الاستخراج: {e}")
+                self.invalidate_info(url)
+    
+    def _estimate_filesize(self, fmt: Dict[str, Any], duration: Optional[float]) -> Optional[int]:
+        """تقدير حجم الصيغة بالبايت: الحجم الفعلي أو التقريبي أو معدل البت × المدة"""
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if size:
+            return int(size)
+        
+        bitrate = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+        if bitrate and duration:
+            return int(bitrate * 1000 / 8 * duration)
+        return None
+    
+    def _organize_formats(self, info: Dict[str, Any]) -> Dict[str, List]:
+        """تنظيم الصيغ المستخرجة حسب النوع"""
+        video_formats = []
+        audio_formats = []
+        combined_formats = []
+        duration = info.get('duration')
+        
+        for f in info.get('formats') or []:
+            estimated_size = self._estimate_filesize(f, duration)
+            format_info = {
+                'format_id': f.get('format_id'),
+                'quality': f.get('format_note', 'غير معروف'),
+                'resolution': f.get('resolution', 'غير معروف'),
+                'fps': f.get('fps'),
+                'filesize': f.get('filesize'),
+                'filesize_mb': round(f.get('filesize', 0) / (1024*1024), 1) if f.get('filesize') else None,
+                'filesize_approx': f.get('filesize_approx'),
+                'estimated_size': estimated_size,
+                'estimated_mb': round(estimated_size / (1024*1024), 1) if estimated_size else None,
+                'tbr': f.get('tbr'),
+                'ext': f.get('ext'),
+                'vcodec': f.get('vcodec'),
+                'acodec': f.get('acodec'),
+                'abr': f.get('abr'),
+                'vbr': f.get('vbr'),
+                'protocol': f.get('protocol')
+            }
+            
+            if f.get('vcodec') != 'none' and f.get('acodec') != 'none':
+                combined_formats.append(format_info)
+            elif f.get('vcodec') != 'none':
+                video_formats.append(format_info)
+            elif f.get('acodec') != 'none':
+                audio_formats.append(format_info)
+        
+        organized = {
+            'video_only': sorted(video_formats, key=lambda x: self._quality_score(x.get('quality', '')), reverse=True),
+            'audio_only': sorted(audio_formats, key=lambda x: x.get('abr') or 0, reverse=True),
+            'combined': sorted(combined_formats, key=lambda x: self._quality_score(x.get('quality', '')), reverse=True)
+        }
+        # مواصفات دمج جاهزة لكل صيغة فيديو فقط مع أفضل صوت متوافق
+        organized['merged'] = [f for f in self._video_candidates(organized) if '+' in f['format_id']]
+        return organized
+    
     def get_available_formats(self, url: str) -> Dict[str, Any]:
         """الحصول على جميع الصيغ المتاحة للفيديو"""
         try:
             if not YT_DLP_AVAILABLE:
                 return self._mock_formats()
             
+            return self._organize_formats(self._extract_info(url))
+                
+        except Exception as e:
+            self.logger.error(f"خطأ في الحصول على الصيغ: {e}")
+            return {'error': str(e)}
+    
+    def extract_playlist(self, url: str, max_items: int = 50) -> Dict[str, Any]:
+        """استخراج عناصر قائمة تشغيل استخراجاً سطحياً (الروابط والعناوين فقط) دون صيغ كل فيديو"""
+        if not YT_DLP_AVAILABLE:
+            return {'success': False, 'error': "yt-dlp غير متاح"}
+        
+        try:
             ydl_opts = {
                 'quiet': True,
                 'no_warnings': True,
-                'listformats': True,
+                'extract_flat': 'in_playlist',
+                'playlistend': max_items,
+            }
+            
+            with self._ydl_pool.checkout(f'playlist:{max_items}', ydl_opts) as ydl:
+                info = self.platform_guard.call(self._platform_key(url), ydl.extract_info, url, download=False)
+            
+            entries = []
+            for entry in info.get('entries') or []:
+                entry_url = (entry or {}).get('url') or (entry or {}).get('webpage_url')
+                if entry_url and entry_url.startswith('http'):
+                    entries.append({'url': entry_url, 'title': entry.get('title')})
+            
+            if not entries:
+                return {'success': False, 'error': "لم يتم العثور على عناصر في قائمة التشغيل"}
+            
+            return {
+                'success': True,
+                'title': info.get('title', 'قائمة تشغيل'),
+                'entries': entries[:max_items],
+                'total': info.get('playlist_count') or len(entries)
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                formats = info.get('formats', [])
-                
-                # تنظيم الصيغ
-                video_formats = []
-                audio_formats = []
-                combined_formats = []
-                
-                for f in formats:
-                    format_info = {
-                        'format_id': f.get('format_id'),
-                        'quality': f.get('format_note', 'غير معروف'),
-                        'resolution': f.get('resolution', 'غير معروف'),
-                        'fps': f.get('fps'),
-                        'filesize': f.get('filesize'),
-                        'filesize_mb': round(f.get('filesize', 0) / (1024*1024), 1) if f.get('filesize') else None,
-                        'ext': f.get('ext'),
-                        'vcodec': f.get('vcodec'),
-                        'acodec': f.get('acodec'),
-                        'abr': f.get('abr'),
-                        'vbr': f.get('vbr'),
-                        'protocol': f.get('protocol')
-                    }
-                    
-                    if f.get('vcodec') != 'none' and f.get('acodec') != 'none':
-                        combined_formats.append(format_info)
-                    elif f.get('vcodec') != 'none':
-                        video_formats.append(format_info)
-                    elif f.get('acodec') != 'none':
-                        audio_formats.append(format_info)
-                
-                return {
-                    'video_only': sorted(video_formats, key=lambda x: self._quality_score(x.get('quality', '')), reverse=True),
-                    'audio_only': sorted(audio_formats, key=lambda x: x.get('abr', 0), reverse=True),
-                    'combined': sorted(combined_formats, key=lambda x: self._quality_score(x.get('quality', '')), reverse=True)
-                }
-                
         except Exception as e:
-            self.logger.error(f"خطأ في الحصول على الصيغ: {e}")
-            return {'error': str(e)}
+            self.logger.error(f"خطأ في استخراج قائمة التشغيل: {e}")
+            return {'success': False, 'error': f"خطأ في استخراج قائمة التشغيل: {str(e)}"}
     
     def get_video_info(self, url: str) -> Dict[str, Any]:
         """استخراج معلومات تفصيلية عن الفيديو مع الصيغ المتاحة"""
@@ -86,43 +266,183 @@ class AdvancedMediaDownloader:
             if not YT_DLP_AVAILABLE:
                 return self._mock_video_info(url)
             
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extractflat': False,
+            info = self._extract_info(url)
+            available_formats = self._organize_formats(info)
+            
+            # تنظيم المعلومات
+            processed_info = {
+                'title': info.get('title', 'غير متاح'),
+                'uploader': info.get('uploader', 'غير متاح'),
+                'duration': info.get('duration', 0),
+                'view_count': info.get('view_count', 0),
+                'upload_date': info.get('upload_date', 'غير متاح'),
+                'description': info.get('description', '')[:200] + '...' if info.get('description') else 'غير متاح',
+                'thumbnail': info.get('thumbnail'),
+                'webpage_url': info.get('webpage_url'),
+                'extractor': info.get('extractor'),
+                'platform': self._detect_platform(url),
+                'available_formats': available_formats,
+                'best_video_format': self._get_best_format(available_formats.get('combined', []), 'video'),
+                'best_audio_format': self._get_best_format(available_formats.get('audio_only', []), 'audio')
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                # الحصول على الصيغ المتاحة
-                available_formats = self.get_available_formats(url)
-                
-                # تنظيم المعلومات
-                processed_info = {
-                    'title': info.get('title', 'غير متاح'),
-                    'uploader': info.get('uploader', 'غير متاح'),
-                    'duration': info.get('duration', 0),
-                    'view_count': info.get('view_count', 0),
-                    'upload_date': info.get('upload_date', 'غير متاح'),
-                    'description': info.get('description', '')[:200] + '...' if info.get('description') else 'غير متاح',
-                    'thumbnail': info.get('thumbnail'),
-                    'webpage_url': info.get('webpage_url'),
-                    'extractor': info.get('extractor'),
-                    'platform': self._detect_platform(url),
-                    'available_formats': available_formats,
-                    'best_video_format': self._get_best_format(available_formats.get('combined', []), 'video'),
-                    'best_audio_format': self._get_best_format(available_formats.get('audio_only', []), 'audio')
-                }
-                
-                return processed_info
+            return processed_info
                 
         except Exception as e:
             self.logger.error(f"خطأ في استخراج المعلومات: {e}")
             return {'error': f"خطأ في استخراج المعلومات: {str(e)}"}
     
-    def download_with_format_id(self, url: str, format_id: str, output_dir: str = "downloads") -> Dict[str, Any]:
-        """تحميل باستخدام معرف صيغة محدد"""
+    def _coalesce(self, key: tuple, download_func, progress_callback=None) -> Dict[str, Any]:
+        """تنفيذ تحميل واحد لكل مفتاح ومشاركة النتيجة (والتقدم) مع الطلبات المتزامنة"""
+        source_key = "|".join(key)
+        
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InflightDownload()
+                self._inflight[key] = call
+            else:
+                call.waiters += 1
+            if progress_callback:
+                call.progress_callbacks.append(progress_callback)
+        
+        if not is_leader:
+            self.logger.info(f"🔗 الانضمام إلى تحميل جارٍ: {key}")
+            call.done.wait()
+            return dict(call.result, shared=True)
+        
+        try:
+            result = self._load_from_store(source_key)
+            if result is None:
+                result = download_func(progress_hooks=self._make_progress_hooks(call))
+                if result.get('success') and result.get('filepath') and os.path.exists(result['filepath']):
+                    result['filepath'] = media_store.put(result['filepath'], source_key, {'title': result.get('title')})
+        except Exception as e:
+            result = {'success': False, 'error': f"خطأ في التحميل: {str(e)}"}
+        
+        with self._inflight_lock:
+            call.result = result
+            # كل طالب يثبت الملف في المخزن حتى ينتهي من إرساله
+            if result.get('success') and result.get('filepath'):
+                media_store.pin(result['filepath'], 1 + call.waiters)
+            del self._inflight[key]
+        call.done.set()
+        return dict(result, shared=False)
+    
+    def _make_progress_hooks(self, call: _InflightDownload) -> Dict[str, Any]:
+        """ربط خطافات yt-dlp بكل من ينتظر هذا التحميل"""
+        def notify(event):
+            for callback in list(call.progress_callbacks):
+                try:
+                    callback(event)
+                except Exception as e:
+                    self.logger.warning(f"⚠️ خطأ في دالة التقدم: {e}")
+        
+        return {
+            'progress_hooks': [lambda d: notify(normalize_progress(d))],
+            'postprocessor_hooks': [lambda d: notify(normalize_postprocessor(d))]
+        }
+    
+    def _load_from_store(self, source_key: str) -> Optional[Dict[str, Any]]:
+        """إرجاع نتيجة تحميل سابق محفوظ في مخزن الوسائط"""
+        entry = media_store.lookup(source_key)
+        if not entry:
+            return None
+        
+        self.logger.info(f"💾 استخدام ملف مخزن مسبقاً: {source_key}")
+        return {
+            'success': True,
+            'filename': os.path.basename(entry['path']),
+            'filepath': entry['path'],
+            'title': entry['metadata'].get('title', 'غير متاح'),
+            'filesize_mb': round(entry['size'] / (1024*1024), 1),
+            'from_cache': True
+        }
+    
+    def release_download(self, result: Dict[str, Any]):
+        """تحرير الملف بعد إرساله ليصبح قابلاً للطرد من المخزن"""
+        if result.get('filepath'):
+            media_store.unpin(result['filepath'])
+    
+    def _budget(self, max_bytes: Optional[int]) -> Optional[int]:
+        """حد الحجم الفعلي: None يعني حد الرفع الافتراضي و0 يعني بلا حد"""
+        if max_bytes is None:
+            return self.max_upload_bytes
+        return max_bytes or None
+    
+    def oversize_budget(self, result: Dict[str, Any], source_limit: int) -> int:
+        """حد التحميل البديل عند تجاوز حد الإرسال: أفضل صيغة دون ضعف الحد، أو أصغر صيغة إن تجاوزته
+
+        الملف الناتج سيُقسم أو يُضغط، فالصيغة الأقرب للحد أرخص تحميلاً ومعالجة من الأفضل جودة.
+        """
+        budget = max(2 * self.max_upload_bytes, result.get('smallest_bytes') or 0)
+        return min(budget, source_limit)
+    
+    def _merge_container_for(self, url: str, format_id: str) -> Optional[str]:
+        """تحديد حاوية الدمج لمواصفة video+audio من المعلومات المخزنة"""
+        try:
+            formats = {f.get('format_id'): f for f in self._extract_info(url).get('formats') or []}
+        except Exception:
+            return None
+        video_id, _, audio_id = format_id.partition('+')
+        if video_id not in formats or audio_id not in formats:
+            return None
+        return self._merge_container(formats[video_id], formats[audio_id])
+    
+    def estimate_format_size(self, url: str, format_id: str) -> Optional[int]:
+        """تقدير حجم صيغة (أو دمج صيغ video+audio) من المعلومات المخزنة"""
+        info = self._extract_info(url)
+        formats = {f.get('format_id'): f for f in info.get('formats') or []}
+        total = 0
+        for part in format_id.split('+'):
+            if part not in formats:
+                return None
+            size = self._estimate_filesize(formats[part], info.get('duration'))
+            if size is None:
+                return None
+            total += size
+        return total
+    
+    def download_with_format_id(self, url: str, format_id: str, output_dir: str = "downloads",
+                                max_bytes: Optional[int] = None, progress_callback=None,
+                                merge_output_format: Optional[str] = None) -> Dict[str, Any]:
+        """تحميل باستخدام معرف صيغة محدد (أو دمج video+audio) مع تقارير تقدم اختيارية"""
+        if not YT_DLP_AVAILABLE:
+            return self._mock_download_result("video")
+        
+        if '+' in format_id and not merge_output_format:
+            merge_output_format = self._merge_container_for(url, format_id)
+        
+        # رفض الصيغ التي تتجاوز الحد قبل تحميلها بدلاً من اكتشاف ذلك بعد التحميل
+        budget = self._budget(max_bytes)
+        if budget:
+            try:
+                estimated = self.estimate_format_size(url, format_id)
+            except Exception as e:
+                return {'success': False, 'error': f"خطأ في استخراج المعلومات: {str(e)}"}
+            if estimated and estimated > budget:
+                return {
+                    'success': False,
+                    'too_large': True,
+                    'smallest_bytes': estimated,
+                    'error': f"حجم الصيغة {format_id} (~{estimated / (1024*1024):.1f} MB) يتجاوز حد الإرسال ({budget / (1024*1024):.0f} MB)"
+                }
+        
+        # حد الحجم جزء من المفتاح: طلب بحد أصغر لا يشارك تحميلاً (أو ملفاً مخزناً) قد يتجاوزه
+        key = (self.canonical_url(url), 'format', format_id, str(budget or 0))
+        return self._coalesce(
+            key,
+            lambda progress_hooks: self._download_with_format_id(url, format_id, output_dir, budget, progress_hooks=progress_hooks,
+                                                                 merge_output_format=merge_output_format),
+            progress_callback
+        )
+    
+    def _download_with_format_id(self, url: str, format_id: str, output_dir: str,
+                                 max_bytes: Optional[int] = None,
+                                 progress_hooks: Optional[Dict[str, Any]] = None,
+                                 merge_output_format: Optional[str] = None) -> Dict[str, Any]:
+        """تنفيذ التحميل الفعلي بمعرف الصيغة؛ مواصفات الدمج تُجمع بنسخ المسارات دون إعادة ترميز"""
         try:
             if not YT_DLP_AVAILABLE:
                 return self._mock_download_result("video")
@@ -130,15 +450,26 @@ class AdvancedMediaDownloader:
             os.makedirs(output_dir, exist_ok=True)
             
             ydl_opts = {
-                'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-                'format': format_id,
                 'writeinfojson': False,
                 'writesubtitles': False,
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+            # max_filesize حماية إضافية عندما يكون الحجم غير معروف مسبقاً
+            with self._ydl_pool.checkout('video', ydl_opts, progress_hooks,
+                                         outtmpl=os.path.join(output_dir, '%(title)s.%(ext)s'),
+                                         format=format_id,
+                                         max_filesize=max_bytes or None,
+                                         merge_output_format=merge_output_format) as ydl:
+                # إعادة استخدام نتيجة الاستخراج المخزنة بدلاً من استخراج جديد
+                info = self._process_info(ydl, url)
+                filename = self._resolve_filepath(ydl, info)
+                
+                if not os.path.exists(filename):
+                    return {
+                        'success': False,
+                        'too_large': bool(max_bytes),
+                        'error': "تم إيقاف التحميل لأن الملف يتجاوز حد الإرسال" if max_bytes else "لم يتم العثور على الملف المحمل"
+                    }
                 
                 return {
                     'success': True,
@@ -156,8 +487,9 @@ class AdvancedMediaDownloader:
                 'error': f"خطأ في تحميل الفيديو: {str(e)}"
             }
     
-    def download_video(self, url: str, output_dir: str = "downloads", quality: str = "best") -> Dict[str, Any]:
-        """تحميل فيديو بجودة محددة مع معالجة أخطاء محسنة"""
+    def download_video(self, url: str, output_dir: str = "downloads", quality: str = "best",
+                       max_bytes: Optional[int] = None, progress_callback=None) -> Dict[str, Any]:
+        """تحميل فيديو بجودة محددة ضمن حد الحجم مع معالجة أخطاء محسنة"""
         try:
             if not YT_DLP_AVAILABLE:
                 return self._mock_download_result("video")
@@ -169,16 +501,27 @@ class AdvancedMediaDownloader:
             if 'error' in formats_info:
                 return {'success': False, 'error': formats_info['error']}
             
-            # اختيار أفضل صيغة متاحة
-            best_format = self._select_best_available_format(formats_info, quality)
+            # اختيار أفضل صيغة متاحة ضمن حد الحجم
+            budget = self._budget(max_bytes)
+            best_format = self._select_best_available_format(formats_info, quality, budget)
             
             if not best_format:
+                if budget and self._select_best_available_format(formats_info, quality):
+                    smallest = self._smallest_estimate(formats_info)
+                    return {
+                        'success': False,
+                        'too_large': True,
+                        'smallest_bytes': smallest,
+                        'error': f"لا توجد صيغة ضمن حد الإرسال ({budget / (1024*1024):.0f} MB)"
+                                 + (f"، أصغر صيغة ~{smallest / (1024*1024):.1f} MB" if smallest else "")
+                    }
                 return {
                     'success': False,
                     'error': f"لا توجد صيغة متاحة للجودة المطلوبة: {quality}"
                 }
             
-            return self.download_with_format_id(url, best_format['format_id'], output_dir)
+            return self.download_with_format_id(url, best_format['format_id'], output_dir, budget or 0, progress_callback,
+                                                merge_output_format=best_format.get('merge_output_format'))
                 
         except Exception as e:
             self.logger.error(f"خطأ في التحميل: {e}")
@@ -187,48 +530,65 @@ class AdvancedMediaDownloader:
                 'error': f"خطأ في تحميل الفيديو: {str(e)}"
             }
     
-    def download_audio(self, url: str, output_dir: str = "downloads", quality: str = "best") -> Dict[str, Any]:
-        """تحميل الصوت فقط مع معالجة أخطاء محسنة"""
+    def download_audio(self, url: str, output_dir: str = "downloads", quality: str = "best",
+                       progress_callback=None, codec: Optional[str] = None) -> Dict[str, Any]:
+        """تحميل الصوت فقط: المسار الصوتي الأصلي بنسخ مباشر، أو تحويل صريح إلى ترميز محدد (codec)"""
+        if not YT_DLP_AVAILABLE:
+            return self._mock_download_result("audio")
+        
+        codec = codec or self.audio_codec
+        if codec == 'native':
+            key = (self.canonical_url(url), 'audio', 'native')
+            download_func = lambda progress_hooks: self._download_audio(url, output_dir, progress_hooks=progress_hooks)
+        else:
+            key = (self.canonical_url(url), 'audio', codec, quality)
+            download_func = lambda progress_hooks: self._transcode_audio(url, output_dir, quality, codec, progress_hooks=progress_hooks)
+        return self._coalesce(key, download_func, progress_callback)
+    
+    def _download_audio(self, url: str, output_dir: str,
+                        progress_hooks: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """تحميل المسار الصوتي الأصلي (m4a/opus/ogg) وإعادة تغليفه دون إعادة ترميز"""
         try:
             if not YT_DLP_AVAILABLE:
                 return self._mock_download_result("audio")
             
             os.makedirs(output_dir, exist_ok=True)
             
-            # تحديد جودة الصوت
-            audio_quality = {
-                'best': '0',
-                'high': '192',
-                'medium': '128',
-                'low': '96'
-            }.get(quality, '192')
+            # تفضيل m4a (يعمل في مشغل تيليجرام) ثم أي صوت ضمن حد الإرسال إن كان حجمه معروفاً
+            limit = self.max_upload_bytes
+            if limit:
+                audio_format = (f'bestaudio[ext=m4a][filesize<{limit}]/bestaudio[ext=m4a][filesize_approx<{limit}]/'
+                                f'bestaudio[filesize<{limit}]/bestaudio[filesize_approx<{limit}]/bestaudio/best')
+            else:
+                audio_format = 'bestaudio[ext=m4a]/bestaudio/best'
             
+            # preferredcodec=best ينسخ المسار الصوتي كما هو إلى حاويته المناسبة (-acodec copy)
             ydl_opts = {
-                'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-                'format': 'bestaudio/best',
                 'postprocessors': [{
                     'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': audio_quality,
+                    'preferredcodec': 'best',
                 }],
                 'noplaylist': True,
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                
-                # البحث عن الملف المحول
-                base_filename = ydl.prepare_filename(info)
-                audio_filename = os.path.splitext(base_filename)[0] + '.mp3'
-                
-                return {
-                    'success': True,
-                    'filename': os.path.basename(audio_filename),
-                    'filepath': audio_filename,
-                    'title': info.get('title', 'غير متاح'),
-                    'filesize_mb': round(os.path.getsize(audio_filename) / (1024*1024), 1) if os.path.exists(audio_filename) else None,
-                    'quality': f'{audio_quality}kbps'
-                }
+            with self._ydl_pool.checkout('audio:native', ydl_opts, progress_hooks,
+                                         outtmpl=os.path.join(output_dir, '%(title)s.%(ext)s'),
+                                         format=audio_format) as ydl:
+                info = self._process_info(ydl, url)
+                audio_filename = self._resolve_filepath(ydl, info)
+            
+            if not os.path.exists(audio_filename):
+                return {'success': False, 'error': "لم يتم العثور على الملف الصوتي المحمل"}
+            
+            return {
+                'success': True,
+                'filename': os.path.basename(audio_filename),
+                'filepath': audio_filename,
+                'title': info.get('title', 'غير متاح'),
+                'filesize_mb': round(os.path.getsize(audio_filename) / (1024*1024), 1),
+                'quality': f"{info.get('abr') or '?'}kbps",
+                'codec': info.get('acodec')
+            }
                 
         except Exception as e:
             self.logger.error(f"خطأ في استخراج الصوت: {e}")
@@ -237,13 +597,102 @@ class AdvancedMediaDownloader:
                 'error': f"خطأ في استخراج الصوت: {str(e)}"
             }
     
-    def _select_best_available_format(self, formats_info: Dict, quality: str) -> Optional[Dict]:
-        """اختيار أفضل صيغة متاحة حسب الجودة المطلوبة"""
-        combined = formats_info.get('combined', [])
-        video_only = formats_info.get('video_only', [])
+    def _transcode_audio(self, url: str, output_dir: str, quality: str, codec: str,
+                         progress_hooks: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """تحويل صريح: تحميل المسار الأصلي (أو استخدامه من المخزن) ثم ترميزه في مجمع FFmpeg"""
+        native_key = (self.canonical_url(url), 'audio', 'native')
+        native = self._coalesce(native_key, lambda _: self._download_audio(url, output_dir, progress_hooks=progress_hooks))
+        if not native.get('success'):
+            return native
         
-        # أولوية للصيغ المدمجة
-        all_formats = combined + video_only
+        try:
+            bitrate = {
+                'best': '0',
+                'high': '192',
+                'medium': '128',
+                'low': '96'
+            }.get(quality, '192')
+            
+            for hook in (progress_hooks or {}).get('postprocessor_hooks', []):
+                hook({'status': 'started', 'postprocessor': f'FFmpeg → {codec}'})
+            
+            native_name = media_store.original_name(native['filepath'])
+            output_base = os.path.join(output_dir, os.path.splitext(native_name)[0])
+            result = ffmpeg_pool.transcode_audio(native['filepath'], output_base, codec, bitrate)
+            if not result['success']:
+                return {'success': False, 'error': f"خطأ في تحويل الصوت: {result['error']}"}
+            
+            return {
+                'success': True,
+                'filename': os.path.basename(result['output']),
+                'filepath': result['output'],
+                'title': native.get('title', 'غير متاح'),
+                'filesize_mb': round(os.path.getsize(result['output']) / (1024*1024), 1),
+                'quality': 'VBR' if bitrate == '0' else f'{bitrate}kbps',
+                'codec': codec
+            }
+        finally:
+            self.release_download(native)
+    
+    def _resolve_filepath(self, ydl, info: Dict[str, Any]) -> str:
+        """تحديد مسار الملف النهائي بعد التحميل والمعالجة"""
+        downloads = info.get('requested_downloads') or []
+        if downloads and downloads[-1].get('filepath'):
+            return downloads[-1]['filepath']
+        return ydl.prepare_filename(info)
+    
+    def _merge_container(self, video: Dict[str, Any], audio: Dict[str, Any]) -> str:
+        """حاوية الدمج التي تقبل المسارين بنسخ مباشر دون إعادة ترميز"""
+        if video.get('ext') == 'mp4' and audio.get('ext') in ('m4a', 'mp4'):
+            return 'mp4'
+        if video.get('ext') == 'webm' and audio.get('ext') == 'webm':
+            return 'webm'
+        return 'mkv'
+    
+    def _pick_audio_for(self, video: Dict[str, Any], audio_only: List[Dict],
+                        max_bytes: Optional[int] = None) -> Optional[Dict]:
+        """أفضل صوت متوافق مع حاوية الفيديو ضمن ما تبقى من حد الحجم"""
+        remaining = max_bytes - video['estimated_size'] if max_bytes and video.get('estimated_size') else None
+        candidates = [a for a in audio_only
+                      if not remaining or not a.get('estimated_size') or a['estimated_size'] <= remaining]
+        if not candidates:
+            return None
+        # تفضيل الصوت الذي يسمح بحاوية mp4/webm ثم الأعلى معدلاً
+        return max(candidates, key=lambda a: (self._merge_container(video, a) != 'mkv', a.get('abr') or 0))
+    
+    def _video_candidates(self, formats_info: Dict, max_bytes: Optional[int] = None) -> List[Dict]:
+        """الصيغ المدمجة أولاً ثم مواصفات دمج فيديو+صوت (video_id+audio_id) بدلاً من الفيديو الصامت"""
+        candidates = list(formats_info.get('combined', []))
+        audio_only = formats_info.get('audio_only', [])
+        
+        if audio_only:
+            for video in formats_info.get('video_only', []):
+                audio = self._pick_audio_for(video, audio_only, max_bytes)
+                if not audio:
+                    continue
+                sizes = (video.get('estimated_size'), audio.get('estimated_size'))
+                estimated = sum(sizes) if all(sizes) else None
+                candidates.append(dict(
+                    video,
+                    format_id=f"{video['format_id']}+{audio['format_id']}",
+                    audio_format_id=audio['format_id'],
+                    merge_output_format=self._merge_container(video, audio),
+                    filesize=None,
+                    filesize_mb=None,
+                    estimated_size=estimated,
+                    estimated_mb=round(estimated / (1024*1024), 1) if estimated else None
+                ))
+        
+        # استبعاد الصيغ التي يتجاوز حجمها المقدر الحد (الصيغ مجهولة الحجم تبقى مرشحة)
+        if max_bytes:
+            candidates = [f for f in candidates if not f.get('estimated_size') or f['estimated_size'] <= max_bytes]
+        return candidates
+    
+    def _select_best_available_format(self, formats_info: Dict, quality: str,
+                                      max_bytes: Optional[int] = None) -> Optional[Dict]:
+        """اختيار أفضل صيغة متاحة حسب الجودة المطلوبة ضمن حد الحجم"""
+        # أولوية للصيغ المدمجة عند تساوي الجودة لأنها لا تحتاج إلى دمج
+        all_formats = self._video_candidates(formats_info, max_bytes)
         
         if not all_formats:
             return None
@@ -277,6 +726,11 @@ class AdvancedMediaDownloader:
         
         return best_match
     
+    def _smallest_estimate(self, formats_info: Dict) -> Optional[int]:
+        """أصغر حجم مقدر بين صيغ الفيديو (بما فيها الصوت المدمج)"""
+        sizes = [f['estimated_size'] for f in self._video_candidates(formats_info) if f.get('estimated_size')]
+        return min(sizes) if sizes else None
+    
     def _detect_platform(self, url: str) -> str:
         """اكتشاف المنصة من الرابط"""
         if 'youtube.com' in url or 'youtu.be' in url:
@@ -0,0 +1,194 @@
+"""
+zip_builder.py - بناء أرشيفات ZIP بالتدفق من الملفات مباشرة مع تقسيمها تحت حد الإرسال
+"""
+
+import os
+import logging
+import zipfile
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# صيغ مضغوطة أصلاً: ضغطها مجدداً يستهلك المعالج دون توفير يذكر
+STORED_EXTENSIONS = {
+    '.mp4', '.mkv', '.webm', '.mov', '.avi', '.m4v', '.3gp', '.flv',
+    '.mp3', '.m4a', '.aac', '.opus', '.ogg', '.oga', '.flac', '.wma',
+    '.jpg', '.jpeg', '.png', '.webp', '.gif', '.heic', '.avif',
+    '.zip', '.rar', '.7z', '.gz', '.bz2', '.xz', '.zst', '.pdf', '.docx', '.xlsx', '.pptx', '.epub'
+}
+
+# هامش للأجزاء الثابتة من الرأس المحلي والمركزي وواصف البيانات وامتدادات ZIP64 لكل عنصر (دون الاسم)
+_ENTRY_OVERHEAD = 200
+_END_OVERHEAD = 100
+
+FileSpec = Union[str, Tuple[str, str]]
+
+
+class ZipArchiveBuilder:
+    """كتابة الملفات إلى أرشيف (أو عدة أرشيفات مستقلة) على دفعات دون نسخ مؤقتة
+
+    كل جزء أرشيف ZIP صالح بذاته، والملف الأكبر من الجزء يُقسم إلى قطع file.001 و file.002...
+    """
+
+    def __init__(self, output_dir: str = "media/archives", chunk_size: int = 1024 * 1024):
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def compression_for(path: str) -> int:
+        """ZIP_STORED للوسائط والملفات المضغوطة و ZIP_DEFLATED لغيرها"""
+        if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def build(self, files: Sequence[FileSpec], name: str = "archive",
+              max_part_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """إنشاء الأرشيف وإرجاع مسارات أجزائه"""
+        entries = self._normalize(files)
+        if not entries:
+            return {'success': False, 'error': "لا توجد ملفات لإضافتها إلى الأرشيف"}
+        if max_part_bytes is not None and max_part_bytes <= _ENTRY_OVERHEAD + _END_OVERHEAD + 1024:
+            return {'success': False, 'error': "حد حجم الجزء صغير جداً"}
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        writer = _PartWriter(self, name, max_part_bytes)
+        try:
+            for path, arcname in entries:
+                writer.add(path, arcname)
+        except OSError as e:
+            writer.abort()
+            logger.error(f"خطأ في إنشاء الأرشيف: {e}")
+            return {'success': False, 'error': f"تعذر إنشاء الأرشيف: {e}"}
+        parts = writer.finish()
+
+        logger.info(f"🗜️ أرشيف {name}: {len(entries)} ملف في {len(parts)} جزء")
+        return {
+            'success': True,
+            'parts': parts,
+            'files': len(entries),
+            'stored': writer.stored,
+            'deflated': writer.deflated,
+            'split_files': writer.split_files,
+            'size': sum(os.path.getsize(p) for p in parts)
+        }
+
+    @staticmethod
+    def _normalize(files: Sequence[FileSpec]) -> List[Tuple[str, str]]:
+        """تحويل المدخلات إلى (مسار، اسم داخل الأرشيف) مع تجاهل المفقود وتفادي تكرار الأسماء"""
+        entries, used = [], set()
+        for spec in files:
+            path, arcname = (spec, None) if isinstance(spec, str) else spec
+            if not os.path.isfile(path):
+                logger.warning(f"⚠️ ملف غير موجود، لن يُضاف إلى الأرشيف: {path}")
+                continue
+            arcname = arcname or os.path.basename(path)
+            base, ext = os.path.splitext(arcname)
+            counter = 1
+            while arcname in used:
+                counter += 1
+                arcname = f"{base} ({counter}){ext}"
+            used.add(arcname)
+            entries.append((path, arcname))
+        return entries
+
+
+class _PartWriter:
+    """كاتب أجزاء الأرشيف: يبدأ جزءاً جديداً عندما لا يتسع العنصر التالي"""
+
+    def __init__(self, builder: ZipArchiveBuilder, name: str, max_part_bytes: Optional[int]):
+        self.builder = builder
+        self.name = name
+        self.max_part_bytes = max_part_bytes
+        self.parts: List[str] = []
+        self.stored = 0
+        self.deflated = 0
+        self.split_files = 0
+        self._zip: Optional[zipfile.ZipFile] = None
+        # حجم الدليل المركزي للجزء الحالي (يُكتب عند إغلاق الجزء)
+        self._central = 0
+
+    def add(self, path: str, arcname: str):
+        size = os.path.getsize(path)
+        compression = self.builder.compression_for(path)
+        if compression == zipfile.ZIP_STORED:
+            self.stored += 1
+        else:
+            self.deflated += 1
+
+        if self.max_part_bytes is None or self._estimate(size, arcname) <= self._capacity():
+            self._ensure_room(self._estimate(size, arcname))
+            self._write(path, arcname, compression, 0, size)
+            return
+
+        # الملف لا يتسع في جزء كامل: يُقسم إلى قطع مخزنة دون ضغط يمكن جمعها لاحقاً بالترتيب
+        self.split_files += 1
+        # اسم القطعة بعدد خانات كافٍ لكل القطع (قد يزيد عن 3 خانات للملفات الضخمة)
+        chunk = self._capacity() - self._entry_overhead(f"{arcname}.{size:03d}")
+        pieces = -(-size // chunk)
+        for index in range(pieces):
+            piece_name = f"{arcname}.{index + 1:03d}"
+            length = min(chunk, size - index * chunk)
+            self._ensure_room(length + self._entry_overhead(piece_name))
+            self._write(path, piece_name, zipfile.ZIP_STORED, index * chunk, length)
+
+    def finish(self) -> List[str]:
+        self._close_current()
+        return self.parts
+
+    def abort(self):
+        self._close_current()
+        for part in self.parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+    def _capacity(self) -> int:
+        return self.max_part_bytes - _END_OVERHEAD
+
+    @staticmethod
+    def _entry_overhead(arcname: str) -> int:
+        """حجم رؤوس العنصر: الاسم بالبايتات مرة في الرأس المحلي ومرة في الدليل المركزي"""
+        return _ENTRY_OVERHEAD + len(arcname.encode('utf-8')) * 2
+
+    @classmethod
+    def _estimate(cls, size: int, arcname: str) -> int:
+        # أسوأ حالة لـ DEFLATE أكبر قليلاً من الحجم الأصلي للبيانات غير القابلة للضغط
+        return size + size // 1000 + 64 + cls._entry_overhead(arcname)
+
+    def _ensure_room(self, needed: int):
+        if self._zip is not None and self.max_part_bytes is not None:
+            if self._zip.fp.tell() + self._central + needed > self._capacity():
+                self._close_current()
+        if self._zip is None:
+            self._open_part()
+
+    def _open_part(self):
+        suffix = f"_part{len(self.parts) + 1}" if self.max_part_bytes is not None else ""
+        path = os.path.join(self.builder.output_dir, f"{self.name}{suffix}.zip")
+        self._zip = zipfile.ZipFile(path, 'w', allowZip64=True)
+        self._central = 0
+        self.parts.append(path)
+
+    def _close_current(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def _write(self, path: str, arcname: str, compression: int, offset: int, length: int):
+        info = zipfile.ZipInfo.from_file(path, arcname)
+        info.compress_type = compression
+        info.file_size = length
+        self._central += 46 + 32 + len(arcname.encode('utf-8'))
+        # القراءة والكتابة على دفعات: لا يُحمّل الملف في الذاكرة ولا تُنشأ نسخة وسيطة
+        with open(path, 'rb') as source, self._zip.open(info, 'w', force_zip64=length > 0x7FFFFFFF) as target:
+            source.seek(offset)
+            remaining = length
+            while remaining > 0:
+                data = source.read(min(self.builder.chunk_size, remaining))
+                if not data:
+                    break
+                target.write(data)
+                remaining -= len(data)
+
+
+# إنشاء مثيل وحيد
+zip_builder = ZipArchiveBuilder()
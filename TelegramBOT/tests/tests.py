@@ -5,15 +5,41 @@ tests.py - نظام اختبارات شامل للمشروع
 
 import unittest
 import os
+import json
+import time
 import tempfile
 import shutil
+import asyncio
+import threading
 from unittest.mock import Mock, patch, MagicMock
 import sys
-sys.path.append('.')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from yt_dlp_wrapper import AdvancedMediaDownloader
-from ai_agent import SmartMediaAgent, MultiModelAIManager
-from performance_monitor import PerformanceMonitor
+from src.yt_dlp_wrapper import AdvancedMediaDownloader
+from src.ai_agent import SmartMediaAgent, MultiModelAIManager
+from src.performance_monitor import PerformanceMonitor
+from src.cache_utils import TTLCache
+from src.job_queue import DownloadJobQueue, JobState
+from src.file_id_cache import TelegramFileIdCache
+from src.media_store import MediaStore
+from src.progress import (StreamingMessageEditor, ThrottledMessageEditor, format_progress, markdown_safe,
+                          normalize_progress, split_message)
+from src.webhook_server import WebhookDispatcher
+from src.stages import StageBusyError, StageExecutor
+from src.resilience import CircuitBreaker, CircuitOpenError, PlatformGuard, classify_error
+from src.state_store import MemoryStateBackend, SQLiteStateBackend, StateNamespace
+from src.bulk_downloader import BulkDownloadEngine
+from src.ffmpeg_pool import FFmpegPool
+from src.converter import MediaConverter
+from src.media_editor import MediaEditor, parse_timestamp
+from src.oversize import OversizeHandler
+from src.image_processor import ImageProcessor, PIL_AVAILABLE
+from src.zip_builder import ZipArchiveBuilder
+from src.llm_transport import ProviderBusyError, ProviderTransport
+from src.conversation_memory import ConversationMemory
+from src.intent_router import IntentRouter, NaiveBayesIntentClassifier
+from src.response_cache import ResponseCache
+from src import utils
 
 class TestAdvancedMediaDownloader(unittest.TestCase):
     """اختبارات منزل الوسائط"""
@@ -61,7 +87,7 @@ class TestAdvancedMediaDownloader(unittest.TestCase):
     def test_get_video_info_success(self, mock_ydl):
         """اختبار استخراج معلومات الفيديو بنجاح"""
         mock_instance = Mock()
-        mock_ydl.return_value.__enter__.return_value = mock_instance
+        mock_ydl.return_value = mock_instance
         
         mock_info = {
             'title': 'Test Video',
@@ -77,6 +103,1443 @@ class TestAdvancedMediaDownloader(unittest.TestCase):
         self.assertEqual(result['title'], 'Test Video')
         self.assertEqual(result['uploader'], 'Test Channel')
         self.assertEqual(result['duration'], 180)
+    
+    def test_estimate_filesize(self):
+        """اختبار تقدير الحجم من الحجم الفعلي أو التقريبي أو معدل البت"""
+        self.assertEqual(self.downloader._estimate_filesize({'filesize': 100}, 60), 100)
+        self.assertEqual(self.downloader._estimate_filesize({'filesize_approx': 200}, 60), 200)
+        self.assertEqual(self.downloader._estimate_filesize({'tbr': 800}, 10), 1000000)
+        self.assertIsNone(self.downloader._estimate_filesize({}, 10))
+    
+    def test_select_format_respects_size_budget(self):
+        """اختبار اختيار أفضل صيغة ضمن حد الحجم"""
+        mb = 1024 * 1024
+        formats_info = {
+            'combined': [
+                {'format_id': '1080', 'quality': '1080p', 'estimated_size': 120 * mb},
+                {'format_id': '720', 'quality': '720p', 'estimated_size': 45 * mb},
+                {'format_id': '360', 'quality': '360p', 'estimated_size': 10 * mb},
+            ],
+            'video_only': []
+        }
+        
+        self.assertEqual(self.downloader._select_best_available_format(formats_info, 'best')['format_id'], '1080')
+        self.assertEqual(self.downloader._select_best_available_format(formats_info, 'best', 50 * mb)['format_id'], '720')
+        self.assertIsNone(self.downloader._select_best_available_format(formats_info, 'best', 5 * mb))
+    
+    def test_oversize_budget_prefers_formats_near_upload_limit(self):
+        """اختبار أن التحميل البديل يقتصر على ضعف حد الإرسال أو أصغر صيغة متاحة"""
+        mb = 1024 * 1024
+        self.downloader.max_upload_bytes = 50 * mb
+        formats_info = {
+            'combined': [
+                {'format_id': '2160', 'quality': '2160p', 'estimated_size': 900 * mb},
+                {'format_id': '1080', 'quality': '1080p', 'estimated_size': 95 * mb},
+                {'format_id': '720', 'quality': '720p', 'estimated_size': 60 * mb},
+            ],
+            'video_only': []
+        }
+        
+        budget = self.downloader.oversize_budget({'smallest_bytes': 60 * mb}, 1024 * mb)
+        self.assertEqual(budget, 100 * mb)
+        self.assertEqual(self.downloader._select_best_available_format(formats_info, 'best', budget)['format_id'], '1080')
+        self.assertEqual(self.downloader.oversize_budget({'smallest_bytes': 300 * mb}, 1024 * mb), 300 * mb)
+        self.assertEqual(self.downloader.oversize_budget({'smallest_bytes': 2048 * mb}, 1024 * mb), 1024 * mb)
+    
+    def test_select_format_builds_merge_spec(self):
+        """اختبار بناء مواصفة دمج video+audio بدلاً من اختيار فيديو صامت"""
+        mb = 1024 * 1024
+        formats_info = {
+            'combined': [{'format_id': '18', 'quality': '360p', 'ext': 'mp4', 'estimated_size': 10 * mb}],
+            'video_only': [
+                {'format_id': '137', 'quality': '1080p', 'ext': 'mp4', 'estimated_size': 60 * mb},
+                {'format_id': '248', 'quality': '1080p', 'ext': 'webm', 'estimated_size': 40 * mb},
+                {'format_id': '136', 'quality': '720p', 'ext': 'mp4', 'estimated_size': 30 * mb},
+            ],
+            'audio_only': [
+                {'format_id': '251', 'ext': 'webm', 'abr': 160, 'estimated_size': 4 * mb},
+                {'format_id': '140', 'ext': 'm4a', 'abr': 128, 'estimated_size': 3 * mb},
+            ]
+        }
+        
+        best = self.downloader._select_best_available_format(formats_info, 'best')
+        self.assertEqual(best['format_id'], '137+140')
+        self.assertEqual(best['merge_output_format'], 'mp4')
+        self.assertEqual(best['estimated_size'], 63 * mb)
+        
+        within_budget = self.downloader._select_best_available_format(formats_info, 'best', 50 * mb)
+        self.assertEqual(within_budget['format_id'], '248+251')
+        self.assertEqual(within_budget['merge_output_format'], 'webm')
+        
+        no_audio = dict(formats_info, audio_only=[])
+        self.assertEqual(self.downloader._select_best_available_format(no_audio, 'best')['format_id'], '18')
+    
+    def test_canonical_url(self):
+        """اختبار توحيد الروابط"""
+        expected = "https://youtube.com/watch?v=abc123"
+        for url in [
+            "https://youtu.be/abc123?si=xyz",
+            "https://www.youtube.com/watch?v=abc123&feature=share",
+            "https://m.youtube.com/shorts/abc123",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.downloader.canonical_url(url), expected)
+    
+    @patch('yt_dlp.YoutubeDL')
+    def test_single_extraction_per_url(self, mock_ydl):
+        """اختبار أن الرابط يُستخرج مرة واحدة فقط"""
+        mock_instance = Mock()
+        mock_ydl.return_value = mock_instance
+        mock_instance.extract_info.return_value = {'title': 'Test Video', 'formats': []}
+        
+        self.downloader.get_video_info(self.test_url)
+        self.downloader.get_available_formats(self.test_url)
+        self.downloader.get_video_info("https://www.youtube.com/watch?v=test123&utm_source=x")
+        
+        self.assertEqual(mock_instance.extract_info.call_count, 1)
+    
+    @patch('yt_dlp.YoutubeDL')
+    def test_youtubedl_instances_are_pooled(self, mock_ydl):
+        """اختبار إعادة استخدام نسخة YoutubeDL وتطبيق إعدادات كل استدعاء ثم استعادتها"""
+        instance = Mock()
+        instance.params = {'outtmpl': {'default': '%(title)s.%(ext)s'}}
+        mock_ydl.return_value = instance
+        pool = self.downloader._ydl_pool
+        
+        with pool.checkout('video', {}, outtmpl='a/%(id)s', format='18', max_filesize=100) as ydl:
+            self.assertEqual(ydl.params['outtmpl']['default'], 'a/%(id)s')
+            self.assertEqual(ydl.params['max_filesize'], 100)
+        with pool.checkout('video', {}, format='22') as ydl:
+            self.assertEqual(ydl.params['outtmpl']['default'], '%(title)s.%(ext)s')
+            self.assertNotIn('max_filesize', ydl.params)
+        
+        self.assertEqual(mock_ydl.call_count, 1)
+        instance.build_format_selector.assert_any_call('22')
+        self.assertEqual(self.downloader.pool_stats()['hit_rate'], 0.5)
+
+    @patch('src.yt_dlp_wrapper.YT_DLP_AVAILABLE', True)
+    def test_concurrent_downloads_are_coalesced(self):
+        """اختبار دمج التحميلات المتطابقة المتزامنة وتثبيت الملف حتى آخر تحرير"""
+        store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        filepath = os.path.join(self.temp_dir, "video.mp4")
+        calls = []
+        
+        def fake_download(url, format_id, output_dir, max_bytes=None, progress_hooks=None, merge_output_format=None):
+            calls.append(format_id)
+            time.sleep(0.2)
+            with open(filepath, 'wb') as f:
+                f.write(b"video")
+            return {'success': True, 'filepath': filepath, 'format_id': format_id, 'title': 'Test'}
+        
+        results = []
+        with patch('src.yt_dlp_wrapper.media_store', store), \
+                patch.object(self.downloader, '_download_with_format_id', side_effect=fake_download):
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    self.downloader.download_with_format_id(self.test_url, "22", self.temp_dir, max_bytes=0)))
+                for _ in range(5)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(len(results), 5)
+            self.assertEqual(sum(1 for r in results if r['shared']), 4)
+            
+            # الملف محفوظ في المخزن ولا يُطرد ما دام مثبتاً
+            stored_path = results[0]['filepath']
+            store.max_age = -1
+            for r in results:
+                self.assertEqual(store.evict()['removed'], 0)
+                self.downloader.release_download(r)
+            self.assertEqual(store.evict()['removed'], 1)
+            self.assertFalse(os.path.exists(stored_path))
+    
+    @patch('src.yt_dlp_wrapper.YT_DLP_AVAILABLE', True)
+    def test_different_budgets_are_not_coalesced(self):
+        """اختبار أن طلبين لنفس الصيغة بحدي حجم مختلفين لا يتشاركان التحميل"""
+        store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        budgets = []
+        
+        def fake_download(url, format_id, output_dir, max_bytes=None, progress_hooks=None, merge_output_format=None):
+            budgets.append(max_bytes)
+            time.sleep(0.1)
+            path = os.path.join(self.temp_dir, f"video_{max_bytes}.mp4")
+            with open(path, 'wb') as f:
+                f.write(b"video")
+            return {'success': True, 'filepath': path, 'title': 'Test'}
+        
+        results = []
+        with patch('src.yt_dlp_wrapper.media_store', store), \
+                patch.object(self.downloader, 'estimate_format_size', return_value=None), \
+                patch.object(self.downloader, '_download_with_format_id', side_effect=fake_download):
+            threads = [
+                threading.Thread(target=lambda budget=budget: results.append(
+                    self.downloader.download_with_format_id(self.test_url, "22", self.temp_dir, max_bytes=budget)))
+                for budget in (0, 50 * 1024 * 1024)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        
+        self.assertCountEqual(budgets, [None, 50 * 1024 * 1024])
+        self.assertFalse(any(r['shared'] for r in results))
+    
+    def test_expired_info_is_extracted_again_once(self):
+        """اختبار حذف المعلومات المخزنة وإعادة استخراجها مرة واحدة عند انتهاء صلاحية روابط البث"""
+        stale, fresh = {'title': 'old'}, {'title': 'new'}
+        ydl = Mock()
+        ydl.process_ie_result.side_effect = [Exception("HTTP Error 403: Forbidden"), {'title': 'new'}]
+        
+        with patch.object(self.downloader, '_extract_info', side_effect=[stale, fresh]), \
+                patch.object(self.downloader, 'invalidate_info') as invalidate:
+            self.assertEqual(self.downloader._process_info(ydl, self.test_url), {'title': 'new'})
+        invalidate.assert_called_once_with(self.test_url)
+        self.assertEqual(ydl.process_ie_result.call_args[0][0], fresh)
+        
+        ydl.process_ie_result.side_effect = Exception("HTTP Error 410: Gone")
+        with patch.object(self.downloader, '_extract_info', return_value=stale):
+            with self.assertRaises(Exception):
+                self.downloader._process_info(ydl, self.test_url)
+        self.assertEqual(ydl.process_ie_result.call_count, 4)
+    
+    def test_retry_gets_unmodified_info(self):
+        """اختبار أن إعادة المحاولة بعد خطأ عابر تعمل على نسخة لم تعدلها المحاولة الفاشلة"""
+        seen = []
+        
+        def process(info, download=True):
+            seen.append(dict(info))
+            info['requested_downloads'] = [{'filepath': 'partial'}]
+            if len(seen) == 1:
+                raise Exception("Read timed out")
+            return info
+        
+        ydl = Mock()
+        ydl.process_ie_result.side_effect = process
+        self.downloader.platform_guard = PlatformGuard(base_delay=0)
+        with patch.object(self.downloader, '_extract_info', return_value={'title': 'Test'}):
+            self.downloader._process_info(ydl, self.test_url)
+        self.assertEqual(seen, [{'title': 'Test'}, {'title': 'Test'}])
+    
+    @patch('src.yt_dlp_wrapper.YT_DLP_AVAILABLE', True)
+    def test_repeat_download_served_from_store(self):
+        """اختبار إعادة استخدام الملف المخزن بدلاً من تحميل جديد"""
+        store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        
+        def fake_download(url, format_id, output_dir, max_bytes=None, progress_hooks=None, merge_output_format=None):
+            path = os.path.join(self.temp_dir, "video.mp4")
+            with open(path, 'wb') as f:
+                f.write(b"video")
+            return {'success': True, 'filepath': path, 'title': 'Test'}
+        
+        with patch('src.yt_dlp_wrapper.media_store', store), \
+                patch.object(self.downloader, '_download_with_format_id', side_effect=fake_download) as mock_download:
+            first = self.downloader.download_with_format_id(self.test_url, "22", self.temp_dir, max_bytes=0)
+            second = self.downloader.download_with_format_id("https://youtu.be/test123", "22", self.temp_dir, max_bytes=0)
+        
+        self.assertEqual(mock_download.call_count, 1)
+        self.assertTrue(second['from_cache'])
+        self.assertEqual(first['filepath'], second['filepath'])
+        self.assertEqual(second['title'], 'Test')
+
+    @patch('src.yt_dlp_wrapper.YT_DLP_AVAILABLE', True)
+    def test_audio_native_by_default_and_transcode_on_request(self):
+        """اختبار أن الصوت يُنسخ دون تحويل افتراضياً وأن MP3 يُحول من المسار الأصلي المخزن"""
+        store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        pool = Mock()
+        
+        def fake_native(url, output_dir, progress_hooks=None):
+            path = os.path.join(self.temp_dir, "song.m4a")
+            with open(path, 'wb') as f:
+                f.write(b"aac")
+            return {'success': True, 'filepath': path, 'title': 'Song'}
+        
+        def fake_transcode(source, output_base, codec, quality):
+            with open(f"{output_base}.mp3", 'wb') as f:
+                f.write(b"mp3")
+            return {'success': True, 'output': f"{output_base}.mp3"}
+        
+        pool.transcode_audio.side_effect = fake_transcode
+        with patch('src.yt_dlp_wrapper.media_store', store), \
+                patch('src.yt_dlp_wrapper.ffmpeg_pool', pool), \
+                patch.object(self.downloader, '_download_audio', side_effect=fake_native) as mock_native:
+            native = self.downloader.download_audio(self.test_url, self.temp_dir)
+            mp3 = self.downloader.download_audio(self.test_url, self.temp_dir, codec='mp3')
+        
+        self.assertTrue(native['filepath'].endswith('song.m4a'))
+        self.assertTrue(mp3['filepath'].endswith('song.mp3'))
+        self.assertEqual(mock_native.call_count, 1)
+        self.assertEqual(pool.transcode_audio.call_count, 1)
+
+class TestFFmpegPool(unittest.TestCase):
+    """اختبارات مجمع FFmpeg"""
+    
+    def test_rejects_when_pending_limit_reached(self):
+        """اختبار رفض العمل عند امتلاء الطابور"""
+        pool = FFmpegPool(max_workers=1, max_pending=0)
+        self.assertFalse(pool.run(['-version'])['success'])
+        self.assertEqual(pool.stats()['rejected'], 1)
+    
+    def test_missing_binary_and_unknown_codec(self):
+        """اختبار الإبلاغ عن غياب FFmpeg والترميز غير المدعوم"""
+        pool = FFmpegPool(max_workers=1, ffmpeg_path="ffmpeg-missing-binary")
+        self.assertFalse(pool.is_available())
+        self.assertIn("FFmpeg", pool.run(['-version'])['error'])
+        self.assertFalse(pool.transcode_audio("a.m4a", "a", codec="xyz")['success'])
+
+class TestMediaConverter(unittest.TestCase):
+    """اختبارات محرك التحويل"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pool = Mock()
+        self.store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        self.converter = MediaConverter(self.pool, self.store, output_dir=os.path.join(self.temp_dir, "out"))
+        self.source = os.path.join(self.temp_dir, "clip.webm")
+        with open(self.source, 'wb') as f:
+            f.write(b"webm")
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_build_command_copies_compatible_streams(self):
+        """اختبار اختيار النسخ المباشر للترميزات المتوافقة والترميز لغيرها"""
+        codecs = {'video': 'vp9', 'audio': 'opus'}
+        mkv = self.converter.build_command("in.webm", codecs, 'mkv', "out.mkv")
+        self.assertEqual(mkv['stream_copy'], ['video', 'audio'])
+        self.assertEqual(mkv['transcoded'], [])
+        
+        mp4 = self.converter.build_command("in.webm", codecs, 'mp4', "out.mp4")
+        self.assertIn('libx264', mp4['args'])
+        self.assertEqual(mp4['stream_copy'], ['audio'])
+        self.assertEqual(mp4['args'][-1], "out.mp4")
+        
+        opus = self.converter.build_command("in.webm", codecs, 'opus', "out.opus")
+        self.assertIn('-vn', opus['args'])
+        self.assertEqual(opus['stream_copy'], ['audio'])
+    
+    def test_same_conversion_is_served_from_store(self):
+        """اختبار عدم تكرار التحويل نفسه"""
+        def fake_run(args, timeout=None, job_id=None):
+            with open(args[-1], 'wb') as f:
+                f.write(b"mkv")
+            return {'success': True}
+        
+        self.pool.run.side_effect = fake_run
+        with patch.object(self.converter, 'probe', return_value={'video': 'vp9', 'audio': 'opus'}):
+            first = self.converter.convert(self.source, 'mkv')
+            second = self.converter.convert(self.source, 'MKV')
+        
+        self.assertTrue(first['success'])
+        self.assertTrue(second['from_cache'])
+        self.assertEqual(first['filepath'], second['filepath'])
+        self.assertEqual(self.pool.run.call_count, 1)
+    
+    def test_rejects_unknown_format_and_missing_file(self):
+        """اختبار رفض الصيغ غير المدعومة والملفات المفقودة"""
+        self.assertFalse(self.converter.convert(self.source, 'xyz')['success'])
+        self.assertFalse(self.converter.convert("missing.mp4", 'mp3')['success'])
+
+class TestMediaEditor(unittest.TestCase):
+    """اختبارات القص والدمج"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pool = Mock()
+        self.commands = []
+        
+        def fake_run(args, timeout=None, job_id=None):
+            self.commands.append(args)
+            with open(args[-1], 'wb') as f:
+                f.write(b"out")
+            return {'success': True}
+        
+        self.pool.run.side_effect = fake_run
+        self.store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        self.editor = MediaEditor(self.pool, self.store, output_dir=os.path.join(self.temp_dir, "out"))
+        self.h264 = {'duration': 60.0, 'video': ('h264', 1280, 720, 'yuv420p'), 'audio': ('aac', '44100', 2)}
+        self.sources = []
+        for name in ("a.mp4", "b.mp4", "c.mp4"):
+            path = os.path.join(self.temp_dir, name)
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+            self.sources.append(path)
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_parse_timestamp(self):
+        """اختبار تحويل صيغ الوقت"""
+        self.assertEqual(parse_timestamp("1:30"), 90)
+        self.assertEqual(parse_timestamp("01:00:05.5"), 3605.5)
+        self.assertEqual(parse_timestamp(12), 12)
+    
+    def test_trim_on_keyframe_uses_stream_copy(self):
+        """اختبار القص بنسخ مباشر عند البدء من إطار مفتاحي"""
+        with patch.object(self.editor, 'stream_signature', return_value=self.h264), \
+             patch.object(self.editor, 'keyframes', return_value=[0.0, 10.0, 20.0]):
+            result = self.editor.trim(self.sources[0], "0:10", "0:25")
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['method'], 'stream_copy')
+        self.assertEqual(len(self.commands), 1)
+        self.assertIn('copy', self.commands[0])
+        self.assertNotIn('libx264', self.commands[0])
+    
+    def test_trim_off_keyframe_reencodes_only_head(self):
+        """اختبار إعادة ترميز الجزء حتى أول إطار مفتاحي فقط ثم النسخ"""
+        with patch.object(self.editor, 'stream_signature', return_value=self.h264), \
+             patch.object(self.editor, 'keyframes', return_value=[0.0, 10.0, 20.0]):
+            result = self.editor.trim(self.sources[0], 12, 30)
+            cached = self.editor.trim(self.sources[0], 12, 30)
+        
+        self.assertEqual(result['method'], 'smart_cut')
+        head, tail, joined = self.commands
+        self.assertIn('libx264', head)
+        self.assertEqual(head[head.index('-t') + 1], "8.000")
+        self.assertEqual(tail[tail.index('-ss') + 1], "20.000")
+        self.assertIn('copy', tail)
+        self.assertIn('concat', joined)
+        self.assertTrue(cached['from_cache'])
+        self.assertEqual(len(self.commands), 3)
+    
+    def test_concat_normalizes_only_mismatched_inputs(self):
+        """اختبار دمج الملفات المتطابقة بالنسخ وتوحيد المختلف منها فقط"""
+        vp9 = {'duration': 30.0, 'video': ('vp9', 640, 360, 'yuv420p'), 'audio': ('opus', '48000', 2)}
+        signatures = {self.sources[0]: self.h264, self.sources[1]: vp9, self.sources[2]: self.h264}
+        with patch.object(self.editor, 'stream_signature', side_effect=lambda p: signatures[p]):
+            result = self.editor.concat(self.sources)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['method'], 'partial_reencode')
+        self.assertEqual(result['normalized'], 1)
+        normalize, joined = self.commands
+        self.assertIn(self.sources[1], normalize)
+        self.assertIn('libx264', normalize)
+        self.assertIn('1280', normalize[normalize.index('-vf') + 1])
+        self.assertIn('copy', joined)
+    
+    def test_concat_unsupported_codec_normalizes_to_first_input(self):
+        """اختبار توحيد كل الملفات بأبعاد الملف الأول عند عدم دعم ترميزه"""
+        prores = {'duration': 20.0, 'video': ('prores', 1920, 1080, 'yuv422p10le'), 'audio': ('pcm_s16le', '48000', 2)}
+        small = {'duration': 10.0, 'video': ('h264', 640, 360, 'yuv420p'), 'audio': ('aac', '44100', 1)}
+        signatures = {self.sources[0]: prores, self.sources[1]: small}
+        with patch.object(self.editor, 'stream_signature', side_effect=lambda p: signatures[p]):
+            result = self.editor.concat(self.sources[:2])
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['normalized'], 2)
+        for command in self.commands[:2]:
+            self.assertIn('libx264', command)
+            self.assertIn('1920', command[command.index('-vf') + 1])
+            self.assertEqual(command[command.index('-ar') + 1], '48000')
+    
+    def test_trim_rejects_invalid_range(self):
+        """اختبار رفض أوقات غير صحيحة"""
+        self.assertFalse(self.editor.trim(self.sources[0], "2:00", "1:00")['success'])
+        self.assertFalse(self.editor.trim(self.sources[0], "abc", "1:00")['success'])
+        self.pool.run.assert_not_called()
+
+class TestOversizeHandler(unittest.TestCase):
+    """اختبارات تجهيز الملفات الكبيرة"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pool = Mock()
+        self.commands = []
+        self.segment_sizes = [[900, 400], [300, 300, 300, 200]]
+        
+        def fake_run(args, timeout=None, job_id=None):
+            self.commands.append(args)
+            if 'segment' in args:
+                for index, size in enumerate(self.segment_sizes.pop(0)):
+                    with open(args[-1] % index, 'wb') as f:
+                        f.write(bytes([65 + index]) * size)
+            elif args[-1] != os.devnull:
+                with open(args[-1], 'wb') as f:
+                    f.write(b"x" * 400)
+            return {'success': True}
+        
+        self.pool.run.side_effect = fake_run
+        self.store = MediaStore(root=os.path.join(self.temp_dir, "store"))
+        self.editor = Mock()
+        self.editor.stream_signature.return_value = {'duration': 100.0, 'video': ('h264', 1920, 1080, 'yuv420p'),
+                                                     'audio': ('aac', '44100', 2)}
+        self.handler = OversizeHandler(self.pool, self.store, self.editor, output_dir=os.path.join(self.temp_dir, "out"))
+        self.source = os.path.join(self.temp_dir, "big.mp4")
+        with open(self.source, 'wb') as f:
+            f.write(b"x" * 1300)
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_split_retries_until_parts_fit(self):
+        """اختبار إعادة التقسيم بأجزاء أقصر إذا تجاوز جزء الحد"""
+        result = self.handler.fit(self.source, 500, 'split')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(len(set(result['parts'])), 4)
+        self.assertTrue(all(os.path.getsize(p) <= 500 for p in result['parts']))
+        first, second = [float(c[c.index('-segment_time') + 1]) for c in self.commands]
+        self.assertLess(second, first)
+        self.assertIn('copy', self.commands[0])
+        
+        cached = self.handler.fit(self.source, 500, 'split')
+        self.assertTrue(cached['from_cache'])
+        self.assertEqual(cached['parts'], result['parts'])
+    
+    def test_compress_uses_two_pass_target_bitrate(self):
+        """اختبار الضغط بمرورين بمعدل بت محسوب من الحد والمدة"""
+        max_bytes = 50 * 1024 * 1024
+        with open(self.source, 'wb') as f:
+            f.write(b"x" * (max_bytes + 1))
+        result = self.handler.fit(self.source, max_bytes, 'compress')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['method'], 'compress')
+        first, second = self.commands
+        self.assertEqual(first[first.index('-pass') + 1], '1')
+        self.assertEqual(second[second.index('-pass') + 1], '2')
+        video_kbps = int(second[second.index('-b:v') + 1].rstrip('k'))
+        self.assertLess((video_kbps + 128) * 100 / 8 * 1000, max_bytes)
+    
+    def test_compress_falls_back_to_split_when_bitrate_too_low(self):
+        """اختبار الرجوع إلى التقسيم عندما يكون الضغط غير عملي"""
+        result = self.handler.fit(self.source, 500, 'compress')
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['method'], 'split')
+        self.assertFalse(any('-pass' in c for c in self.commands))
+
+@unittest.skipUnless(PIL_AVAILABLE, "Pillow غير مثبتة")
+class TestImageProcessor(unittest.TestCase):
+    """اختبارات معالجة الصور"""
+    
+    def setUp(self):
+        from PIL import Image
+        self.Image = Image
+        self.temp_dir = tempfile.mkdtemp()
+        self.processor = ImageProcessor(max_workers=2, output_dir=os.path.join(self.temp_dir, "out"),
+                                        max_pixels=1_000_000, tile_size=256)
+        self.jpeg = os.path.join(self.temp_dir, "big.jpg")
+        Image.new('RGB', (3200, 2400), (180, 90, 40)).save(self.jpeg)
+    
+    def tearDown(self):
+        self.processor.shutdown()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_resize_uses_draft_decoding(self):
+        """اختبار تصغير JPEG عبر draft دون فك الدقة الكاملة"""
+        from PIL import JpegImagePlugin
+        original_draft = JpegImagePlugin.JpegImageFile.draft
+        drafts = []
+        
+        def tracking_draft(image, mode, size):
+            drafts.append(size)
+            return original_draft(image, mode, size)
+        
+        with patch.object(JpegImagePlugin.JpegImageFile, 'draft', tracking_draft):
+            result = self.processor.process(self.jpeg, 'resize', max_side=400)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['size'], (400, 300))
+        self.assertEqual(drafts, [(400, 400)])
+    
+    def test_large_images_are_bounded_by_max_pixels(self):
+        """اختبار العمل على نسخة مصغرة للصور التي تتجاوز حد البكسلات"""
+        result = self.processor.process(self.jpeg, 'filters', name='blur')
+        
+        width, height = result['size']
+        self.assertLessEqual(width * height, 1_000_000)
+        self.assertAlmostEqual(width / height, 4 / 3, places=2)
+    
+    def test_tiled_filter_matches_whole_image(self):
+        """اختبار تطابق الفلتر المطبق على مربعات مع تطبيقه على الصورة كاملة"""
+        from PIL import ImageChops, ImageFilter
+        image = self.Image.effect_noise((600, 500), 64).convert('RGB')
+        tiled = self.processor._apply_tiled(image, lambda tile: tile.filter(ImageFilter.SHARPEN))
+        
+        self.assertIsNone(ImageChops.difference(tiled, image.filter(ImageFilter.SHARPEN)).getbbox())
+    
+    def test_batch_streams_every_result(self):
+        """اختبار إرجاع نتيجة كل صورة في الدفعة مع الأخطاء"""
+        paths = [self.jpeg, os.path.join(self.temp_dir, "missing.jpg"), self.jpeg]
+        results = dict(self.processor.process_batch(paths, 'compress', quality=60))
+        
+        self.assertEqual(sorted(results), [0, 1, 2])
+        self.assertTrue(results[0]['success'])
+        self.assertFalse(results[1]['success'])
+        self.assertTrue(results[2]['filepath'].endswith('.jpg'))
+
+class TestTTLCache(unittest.TestCase):
+    """اختبارات الذاكرة المؤقتة"""
+    
+    def test_lru_eviction(self):
+        """اختبار طرد الأقدم استخداماً"""
+        cache = TTLCache(max_size=2, ttl=None)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+    
+    def test_expiry(self):
+        """اختبار انتهاء الصلاحية"""
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set('a', 1, ttl=-1)
+        
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+
+class TestDownloadJobQueue(unittest.TestCase):
+    """اختبارات طابور التحميل"""
+    
+    def test_jobs_run_and_record_state(self):
+        """اختبار تنفيذ المهام وتسجيل حالتها"""
+        done = []
+        queue = DownloadJobQueue(lambda chat_id, user_id, url, kind: done.append(url) or url != "bad", max_workers=1)
+        ok = queue.submit(1, 1, "good", "download_best")['job']
+        bad = queue.submit(2, 2, "bad", "download_best")['job']
+        queue.stop()
+        
+        self.assertEqual(done, ["good", "bad"])
+        self.assertEqual(ok.state, JobState.DONE)
+        self.assertEqual(bad.state, JobState.FAILED)
+    
+    def test_per_user_and_queue_limits(self):
+        """اختبار حدود المستخدم وطول الطابور"""
+        queue = DownloadJobQueue(lambda *args: True, max_workers=1, max_queue_size=2, max_jobs_per_user=1)
+        queue._running = True  # منع العمال من سحب المهام أثناء الاختبار
+        
+        self.assertEqual(queue.submit(1, 1, "a", "download_best")['position'], 1)
+        self.assertFalse(queue.submit(1, 1, "b", "download_best")['success'])
+        self.assertEqual(queue.submit(2, 2, "c", "download_best")['position'], 2)
+        self.assertFalse(queue.submit(3, 3, "d", "download_best")['success'])
+
+    def test_custom_task_shares_limits(self):
+        """اختبار تنفيذ المهام المخصصة بدل المعالج مع خضوعها لحد المستخدم"""
+        handler = Mock(return_value=True)
+        queue = DownloadJobQueue(handler, max_workers=1, max_jobs_per_user=1)
+        queue._running = True
+        
+        job = queue.submit(1, 1, "a", "edit_trim", task=lambda: False)['job']
+        self.assertFalse(queue.submit(1, 1, "b", "download_best")['success'])
+        
+        queue._running = False
+        worker = threading.Thread(target=queue._worker_loop)
+        worker.start()
+        worker.join(5)
+        self.assertEqual(job.state, JobState.FAILED)
+        handler.assert_not_called()
+
+class TestTelegramFileIdCache(unittest.TestCase):
+    """اختبارات ذاكرة معرفات ملفات تيليجرام"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "file_ids.json")
+        self.url = "https://youtube.com/watch?v=test123"
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_persists_across_instances(self):
+        """اختبار حفظ المعرفات واستعادتها بعد إعادة التشغيل"""
+        TelegramFileIdCache(self.path).put(self.url, "download_best", "video", file_id="abc", send_as="video")
+        
+        entry = TelegramFileIdCache(self.path).get(self.url, "download_best", "video")
+        self.assertEqual(entry['file_id'], "abc")
+        self.assertIsNone(TelegramFileIdCache(self.path).get(self.url, "download_audio_best", "audio"))
+    
+    def test_invalidate_and_bounds(self):
+        """اختبار الإبطال وحدود العدد والعمر"""
+        cache = TelegramFileIdCache(self.path, max_entries=2)
+        cache.put(self.url, "download_best", "video", file_id="a", send_as="video")
+        cache.put(self.url, "download_720p", "video", file_id="b", send_as="video")
+        cache.put(self.url, "download_audio_best", "audio", file_id="c", send_as="audio")
+        self.assertEqual(cache.stats()['entries'], 2)
+        
+        self.assertEqual(cache.invalidate(self.url, media_kind="audio"), 1)
+        self.assertIsNone(cache.get(self.url, "download_audio_best", "audio"))
+        
+        cache.max_age = -1
+        self.assertIsNone(cache.get(self.url, "download_720p", "video"))
+
+class TestMediaStore(unittest.TestCase):
+    """اختبارات مخزن الوسائط"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = MediaStore(root=os.path.join(self.temp_dir, "store"), max_bytes=10)
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def _make_file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+    
+    def test_identical_content_stored_once(self):
+        """اختبار تخزين المحتوى المتطابق مرة واحدة"""
+        first = self.store.put(self._make_file("a.mp4", b"same"), "url1|format|22")
+        second = self.store.put(self._make_file("b.mp4", b"same"), "url2|format|22")
+        
+        self.assertEqual(first, second)
+        self.assertEqual(self.store.stats()['files'], 1)
+        self.assertEqual(self.store.lookup("url2|format|22")['path'], first)
+    
+    def test_contains_only_stored_files(self):
+        """اختبار التمييز بين ملفات المخزن وأي مسار آخر على الخادم"""
+        stored = self.store.put(self._make_file("a.mp4", b"data"), "key")
+        outside = self._make_file("secret.txt", b"x")
+        
+        self.assertTrue(self.store.contains(stored))
+        self.assertFalse(self.store.contains(outside))
+        self.assertFalse(self.store.contains(os.path.join(self.store.root, "..", "secret.txt")))
+    
+    def test_lru_eviction_under_quota(self):
+        """اختبار طرد الأقل استخداماً عند تجاوز الحصة"""
+        old = self.store.put(self._make_file("old.mp4", b"123456"), "old")
+        time.sleep(0.01)
+        new = self.store.put(self._make_file("new.mp4", b"abcdef"), "new")
+        
+        result = self.store.evict()
+        
+        self.assertEqual(result['removed'], 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertIsNone(self.store.lookup("old"))
+    
+    def test_index_survives_restart(self):
+        """اختبار استعادة الفهرس بعد إعادة التشغيل"""
+        path = self.store.put(self._make_file("a.mp4", b"data"), "key", {'title': 'T'})
+        
+        reloaded = MediaStore(root=self.store.root)
+        entry = reloaded.lookup("key")
+        self.assertEqual(entry['path'], path)
+        self.assertEqual(entry['metadata']['title'], 'T')
+
+class TestProgressReporting(unittest.TestCase):
+    """اختبارات تقارير التقدم"""
+    
+    def test_editor_coalesces_updates(self):
+        """اختبار دمج التحديثات المتقاربة في تعديل واحد"""
+        bot = Mock()
+        editor = ThrottledMessageEditor(bot, chat_id=-1001, message_id=1, min_interval=0.2)
+        for text in ["10%", "20%", "30%"]:
+            editor.update(text)
+        time.sleep(0.35)
+        
+        edited = [c.args[0] for c in bot.edit_message_text.call_args_list]
+        self.assertEqual(edited, ["10%", "30%"])
+    
+    def test_editor_close_drops_pending(self):
+        """اختبار إلغاء التحديث المؤجل عند الإغلاق"""
+        bot = Mock()
+        editor = ThrottledMessageEditor(bot, chat_id=-1002, message_id=1, min_interval=0.2)
+        editor.update("a")
+        editor.update("b")
+        editor.close()
+        time.sleep(0.3)
+        
+        self.assertEqual(bot.edit_message_text.call_count, 1)
+    
+    def test_editor_edits_outside_lock_and_prunes_chats(self):
+        """اختبار إرسال التعديل خارج قفل الحالة وحذف المحادثات المنتهية من السجل المشترك"""
+        bot = Mock()
+        first = ThrottledMessageEditor(bot, chat_id=-1004, message_id=1, min_interval=0.05)
+        bot.edit_message_text.side_effect = lambda *args, **kwargs: self.assertFalse(first._lock.locked())
+        first.update("a")
+        time.sleep(0.1)
+        ThrottledMessageEditor(bot, chat_id=-1005, message_id=1, min_interval=0.05).update("b")
+        
+        self.assertEqual(bot.edit_message_text.call_count, 2)
+        self.assertNotIn(-1004, ThrottledMessageEditor._last_edit_by_chat)
+        self.assertIn(-1005, ThrottledMessageEditor._last_edit_by_chat)
+    
+    def test_format_progress(self):
+        """اختبار نص التقدم"""
+        event = normalize_progress({'status': 'downloading', 'downloaded_bytes': 512, 'total_bytes': 1024,
+                                    'speed': 2048, 'eta': 65})
+        text = format_progress(event)
+        
+        self.assertIn("50.0%", text)
+        self.assertIn("2.0 KB/s", text)
+        self.assertIn("01:05", text)
+    
+    def test_markdown_safe_closes_partial_entities(self):
+        """اختبار إغلاق وسوم Markdown المفتوحة في النص الجزئي"""
+        self.assertEqual(markdown_safe("مرحبا *بالعا"), "مرحبا *بالعا*")
+        self.assertEqual(markdown_safe("```py\nx = 1"), "```py\nx = 1\n```")
+        self.assertEqual(markdown_safe("`a_b` و _مائل"), "`a_b` و _مائل_")
+        self.assertEqual(markdown_safe("انظر [الرابط](https://exa"), "انظر ")
+        self.assertEqual(markdown_safe("[1] عنصر *كامل*"), "[1] عنصر *كامل*")
+    
+    def test_split_message(self):
+        """اختبار تقسيم الرد الطويل عند فواصل الأسطر"""
+        chunks = split_message("سطر\n" * 3000, limit=4096)
+        
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+        self.assertEqual(sum(chunk.count("سطر") for chunk in chunks), 3000)
+    
+    def test_streaming_editor(self):
+        """اختبار عرض الرد تدريجياً ثم كتابته كاملاً مع بديل للـ Markdown غير الصالح"""
+        bot = Mock()
+        bot.edit_message_text.side_effect = [None, Exception("Bad Request: can't parse entities"), None]
+        editor = StreamingMessageEditor(bot, chat_id=-1003, message_id=1, min_interval=0.2)
+        editor.feed("جزء *أول")
+        editor.feed("جزء *أول* وثاني")
+        editor.finish("جزء *أول* وثاني_")
+        time.sleep(0.3)
+        
+        calls = bot.edit_message_text.call_args_list
+        self.assertEqual(calls[0].args[0], "جزء *أول* ▌")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[2].args[0], "جزء *أول* وثاني_")
+        self.assertIsNone(calls[2].kwargs.get('parse_mode'))
+
+class TestWebhookDispatcher(unittest.TestCase):
+    """اختبارات استقبال تحديثات Webhook"""
+    
+    def setUp(self):
+        self.bot = Mock()
+        self.dispatcher = WebhookDispatcher(self.bot, secret_token="s3cret", workers=1)
+        self.update = json.dumps({'update_id': 1001}).encode('utf-8')
+    
+    def test_valid_update_is_dispatched(self):
+        """اختبار قبول التحديث ذي الرمز الصحيح وتمريره للبوت"""
+        self.dispatcher.start()
+        status, _ = self.dispatcher.handle(self.update, "s3cret")
+        self.dispatcher.stop()
+        
+        self.assertEqual(status, 200)
+        updates = self.bot.process_new_updates.call_args.args[0]
+        self.assertEqual(updates[0].update_id, 1001)
+    
+    def test_rejects_bad_secret_and_body(self):
+        """اختبار رفض الرمز الخاطئ والجسم غير الصالح"""
+        self.assertEqual(self.dispatcher.handle(self.update, "wrong")[0], 403)
+        self.assertEqual(self.dispatcher.handle(self.update, None)[0], 403)
+        self.assertEqual(self.dispatcher.handle(b"not json", "s3cret")[0], 400)
+        self.assertEqual(self.dispatcher.stats()['rejected'], 3)
+
+class TestStageExecutor(unittest.TestCase):
+    """اختبارات منفذات المراحل في وضع asyncio"""
+    
+    def setUp(self):
+        self.stage = StageExecutor('test', max_concurrency=1, max_pending=1)
+    
+    def tearDown(self):
+        self.stage.shutdown()
+    
+    def test_run_blocking_function(self):
+        """اختبار تشغيل دالة حاجبة في المنفذ"""
+        result = asyncio.run(self.stage.run(lambda x: x * 2, 21))
+        self.assertEqual(result, 42)
+        self.assertEqual(self.stage.stats()['pending'], 0)
+    
+    def test_rejects_when_pending_limit_reached(self):
+        """اختبار رفض العمل عند امتلاء حد الانتظار"""
+        release = threading.Event()
+        
+        async def scenario():
+            first = asyncio.ensure_future(self.stage.run(release.wait, 5))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(StageBusyError):
+                await self.stage.guard(asyncio.sleep(0))
+            release.set()
+            return await first
+        
+        self.assertTrue(asyncio.run(scenario()))
+
+class TestStateStore(unittest.TestCase):
+    """اختبارات مخزن حالة المستخدمين"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "state.db")
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_memory_backend_is_bounded_and_expires(self):
+        """اختبار حد الحجم وانتهاء الصلاحية في مخزن الذاكرة"""
+        states = StateNamespace(MemoryStateBackend(max_entries=2), "pending", ttl=0.05)
+        states[1] = {'url': 'a'}
+        states[2] = {'url': 'b'}
+        states[3] = {'url': 'c'}
+        self.assertNotIn(1, states)
+        self.assertEqual(states[3]['url'], 'c')
+        
+        time.sleep(0.1)
+        self.assertNotIn(3, states)
+        self.assertEqual(len(states), 0)
+    
+    def test_sqlite_backend_persists_across_restarts(self):
+        """اختبار بقاء الحالة بعد إعادة فتح قاعدة البيانات"""
+        backend = SQLiteStateBackend(self.db_path, flush_interval=60)
+        stats = StateNamespace(backend, "statistics")
+        stats[42] = {'downloads': 3}
+        self.assertEqual(stats[42]['downloads'], 3)
+        self.assertEqual(backend.stats()['pending_writes'], 1)
+        backend.close()
+        
+        reopened = SQLiteStateBackend(self.db_path, flush_interval=60)
+        try:
+            self.assertEqual(StateNamespace(reopened, "statistics")[42], {'downloads': 3})
+        finally:
+            reopened.close()
+    
+    def test_sqlite_backend_ttl_and_delete(self):
+        """اختبار انتهاء الحالة المؤقتة والحذف والتقليم"""
+        backend = SQLiteStateBackend(self.db_path, max_entries=2, flush_interval=60)
+        try:
+            pending = StateNamespace(backend, "pending", ttl=0.05)
+            prefs = StateNamespace(backend, "preferences")
+            pending[1] = {'url': 'x'}
+            for user_id in range(3):
+                prefs[user_id] = {'quality': '720'}
+            del prefs[0]
+            backend.flush()
+            
+            time.sleep(0.1)
+            self.assertNotIn(1, pending)
+            self.assertEqual(len(prefs), 2)
+            with self.assertRaises(KeyError):
+                prefs[0]
+        finally:
+            backend.close()
+
+class TestPlatformResilience(unittest.TestCase):
+    """اختبارات قواطع الدائرة وحدود المنصات"""
+    
+    def test_classify_error(self):
+        """اختبار تصنيف الأخطاء"""
+        self.assertEqual(classify_error("HTTP Error 429: Too Many Requests"), 'throttled')
+        self.assertEqual(classify_error("Read timed out"), 'transient')
+        self.assertEqual(classify_error("Private video"), 'permanent')
+    
+    def test_breaker_opens_and_half_opens(self):
+        """اختبار فتح القاطع بعد الأخطاء المتتالية ثم السماح بطلب اختبار واحد"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_throttled_platform_is_isolated(self):
+        """اختبار أن تقييد منصة يفتح قاطعها فقط"""
+        guard = PlatformGuard({'TikTok': 1}, failure_threshold=3, max_attempts=3, base_delay=0)
+        throttled = Mock(side_effect=Exception("HTTP Error 429: Too Many Requests"))
+        
+        with self.assertRaises(Exception):
+            guard.call('TikTok', throttled)
+        with self.assertRaises(CircuitOpenError):
+            guard.call('TikTok', throttled)
+        
+        self.assertEqual(throttled.call_count, 1)
+        self.assertEqual(guard.call('YouTube', lambda: 'ok'), 'ok')
+    
+    def test_breaker_opening_mid_retry_keeps_real_error(self):
+        """اختبار إعادة الخطأ الفعلي (لا CircuitOpenError) إذا فُتح القاطع أثناء إعادة المحاولة"""
+        guard = PlatformGuard(failure_threshold=2, max_attempts=3, base_delay=0)
+        flaky = Mock(side_effect=Exception("Read timed out"))
+        
+        with self.assertRaises(Exception) as context:
+            guard.call('YouTube', flaky)
+        self.assertNotIsInstance(context.exception, CircuitOpenError)
+        self.assertIn("timed out", str(context.exception))
+        self.assertEqual(flaky.call_count, 2)
+    
+    def test_transient_errors_are_retried(self):
+        """اختبار إعادة المحاولة للأخطاء العابرة"""
+        guard = PlatformGuard(max_attempts=3, base_delay=0)
+        flaky = Mock(side_effect=[Exception("Connection reset by peer"), 'done'])
+        self.assertEqual(guard.call('YouTube', flaky), 'done')
+        self.assertEqual(flaky.call_count, 2)
+
+class TestBulkDownloadEngine(unittest.TestCase):
+    """اختبارات محرك التحميل المجمع"""
+    
+    def setUp(self):
+        self.state = StateNamespace(MemoryStateBackend(), "bulk")
+        self.delivered = []
+    
+    def deliver(self, job, index, result):
+        self.delivered.append((index, result['url']))
+    
+    def test_extract_urls(self):
+        """اختبار استخراج جميع الروابط دون تكرار"""
+        text = "https://a.com/1\nhttps://b.com/2 و https://a.com/1"
+        self.assertEqual(utils.extract_urls(text), ["https://a.com/1", "https://b.com/2"])
+        self.assertEqual(utils.extract_urls("لا يوجد"), [])
+    
+    def test_parallel_download_ordered_delivery(self):
+        """اختبار التسليم بالترتيب رغم اكتمال التحميلات بترتيب مختلف"""
+        delays = {'u0': 0.1, 'u1': 0.0, 'u2': 0.05, 'u3': 0.0}
+        
+        def download(url, download_type):
+            time.sleep(delays[url])
+            return {'success': url != 'u2', 'url': url}
+        
+        engine = BulkDownloadEngine(download, self.deliver, self.state, max_parallel=3)
+        job = engine.start(1, 2, list(delays))['job']
+        engine.wait(job['job_id'], 5)
+        
+        self.assertEqual([index for index, _ in self.delivered], [0, 1, 2, 3])
+        saved = engine.get_job(job['job_id'])
+        self.assertTrue(saved['finished'])
+        self.assertEqual((saved['succeeded'], saved['failed']), (3, 1))
+        self.assertEqual(self.state.get('active'), [])
+    
+    def test_resume_from_first_undelivered_item(self):
+        """اختبار استئناف مهمة غير مكتملة بعد إعادة التشغيل"""
+        self.state['job1'] = {
+            'job_id': 'job1', 'chat_id': 1, 'user_id': 2, 'title': None, 'download_type': 'download_best',
+            'urls': ['u0', 'u1', 'u2'], 'truncated': False, 'delivered': 2, 'succeeded': 2, 'failed': 0,
+            'finished': False
+        }
+        self.state['active'] = ['job1']
+        downloads = []
+        
+        def download(url, download_type):
+            downloads.append(url)
+            return {'success': True, 'url': url}
+        
+        engine = BulkDownloadEngine(download, self.deliver, self.state)
+        self.assertEqual(engine.resume_all(), 1)
+        engine.wait('job1', 5)
+        
+        self.assertEqual(downloads, ['u2'])
+        self.assertEqual(self.delivered, [(2, 'u2')])
+        self.assertTrue(engine.get_job('job1')['finished'])
+    
+    def test_on_complete_runs_once_after_last_item(self):
+        """اختبار تنفيذ خطوة الإنهاء (مثل الأرشيف) بعد تسليم كل العناصر"""
+        completed = []
+        engine = BulkDownloadEngine(lambda url, download_type: {'success': True, 'url': url}, self.deliver,
+                                    self.state, on_complete=lambda job: completed.append(list(self.delivered)))
+        job = engine.start(1, 2, ['u0', 'u1'], deliver_as='zip')['job']
+        engine.wait(job['job_id'], 5)
+        
+        self.assertEqual(completed, [[(0, 'u0'), (1, 'u1')]])
+        self.assertEqual(engine.get_job(job['job_id'])['deliver_as'], 'zip')
+
+    def test_on_abort_receives_undelivered_results(self):
+        """اختبار تمرير التحميلات غير المسلمة لخطوة التحرير عند توقف المهمة قبل اكتمالها"""
+        aborted = []
+        engine = BulkDownloadEngine(lambda url, download_type: {'success': True, 'url': url}, self.deliver,
+                                    self.state, max_parallel=3, on_complete=lambda job: aborted.append('complete'),
+                                    on_abort=lambda job, results: aborted.append(sorted(r['url'] for r in results)))
+        save = engine._save
+        
+        def failing_save(job):
+            if job['delivered'] == 1:
+                raise RuntimeError("state backend unavailable")
+            save(job)
+        
+        with patch.object(engine, '_save', side_effect=failing_save):
+            job = engine.start(1, 2, ['u0', 'u1', 'u2'])['job']
+            engine.wait(job['job_id'], 5)
+        
+        self.assertEqual(self.delivered, [(0, 'u0')])
+        self.assertEqual(aborted, [['u1', 'u2']])
+
+    def test_per_user_job_limit(self):
+        """اختبار رفض مهمة مجمعة جديدة للمستخدم قبل انتهاء مهمته الحالية"""
+        release = threading.Event()
+
+        def download(url, download_type):
+            release.wait(5)
+            return {'success': True, 'url': url}
+
+        engine = BulkDownloadEngine(download, self.deliver, self.state, max_jobs_per_user=1)
+        job = engine.start(1, 2, ['u0'])['job']
+        self.assertFalse(engine.start(1, 2, ['u1'])['success'])
+        self.assertTrue(engine.start(1, 3, ['u2'])['success'])
+
+        release.set()
+        engine.wait(job['job_id'], 5)
+        self.assertTrue(engine.start(1, 2, ['u1'])['success'])
+
+    def test_shares_download_slots(self):
+        """اختبار تقييد تحميلات المهام المجمعة بخانات طابور التحميل المشتركة"""
+        slots = threading.BoundedSemaphore(2)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def download(url, download_type):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return {'success': True, 'url': url}
+
+        engine = BulkDownloadEngine(download, self.deliver, self.state, max_parallel=3, slots=slots)
+        first = engine.start(1, 2, ['a0', 'a1', 'a2', 'a3'])['job']
+        second = engine.start(1, 3, ['b0', 'b1', 'b2', 'b3'])['job']
+        engine.wait(first['job_id'], 5)
+        engine.wait(second['job_id'], 5)
+
+        self.assertEqual(len(self.delivered), 8)
+        self.assertEqual(running[1], 2)
+
+class TestZipArchiveBuilder(unittest.TestCase):
+    """اختبارات بناء الأرشيفات"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.builder = ZipArchiveBuilder(output_dir=os.path.join(self.temp_dir, "out"), chunk_size=4096)
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def make_file(self, name, data):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    
+    def test_media_is_stored_and_text_deflated(self):
+        """اختبار تخزين الوسائط دون ضغط وضغط الملفات النصية"""
+        import zipfile
+        video = self.make_file("clip.mp4", os.urandom(20000))
+        notes = self.make_file("notes.txt", b"hello " * 5000)
+        result = self.builder.build([video, notes, (video, "copy.mp4")], "media")
+        
+        self.assertEqual(len(result['parts']), 1)
+        with zipfile.ZipFile(result['parts'][0]) as archive:
+            types = {info.filename: info.compress_type for info in archive.infolist()}
+            self.assertEqual(archive.read("clip.mp4"), open(video, 'rb').read())
+        self.assertEqual(types, {'clip.mp4': zipfile.ZIP_STORED, 'notes.txt': zipfile.ZIP_DEFLATED,
+                                 'copy.mp4': zipfile.ZIP_STORED})
+    
+    def test_parts_stay_under_limit_and_large_files_are_chunked(self):
+        """اختبار تقسيم الأرشيف إلى أجزاء مستقلة تحت الحد وتقطيع الملف الأكبر من جزء"""
+        import zipfile
+        files = [self.make_file(f"v{i}.mp4", os.urandom(size)) for i, size in enumerate((6000, 7000, 25000, 300))]
+        result = self.builder.build(files, "bulk", max_part_bytes=10000)
+        
+        self.assertGreater(len(result['parts']), 3)
+        self.assertEqual(result['split_files'], 1)
+        chunks = {}
+        for part in result['parts']:
+            self.assertLessEqual(os.path.getsize(part), 10000)
+            with zipfile.ZipFile(part) as archive:
+                self.assertIsNone(archive.testzip())
+                for name in archive.namelist():
+                    chunks[name] = archive.read(name)
+        
+        rebuilt = b"".join(chunks[name] for name in sorted(chunks) if name.startswith("v2.mp4."))
+        self.assertEqual(rebuilt, open(files[2], 'rb').read())
+        self.assertEqual(chunks['v3.mp4'], open(files[3], 'rb').read())
+    
+    def test_long_non_ascii_names_stay_under_limit(self):
+        """اختبار حساب أسماء UTF-8 الطويلة بالبايتات عند تقطيع الملف"""
+        import zipfile
+        name = "ملف" * 40 + ".bin"
+        source = self.make_file("source.bin", os.urandom(50000))
+        result = self.builder.build([(source, name)], "arabic", max_part_bytes=8000)
+        
+        self.assertGreater(len(result['parts']), 1)
+        chunks = {}
+        for part in result['parts']:
+            self.assertLessEqual(os.path.getsize(part), 8000)
+            with zipfile.ZipFile(part) as archive:
+                chunks.update((n, archive.read(n)) for n in archive.namelist())
+        self.assertEqual(b"".join(chunks[n] for n in sorted(chunks)), open(source, 'rb').read())
+    
+    def test_missing_files_are_skipped(self):
+        """اختبار تجاهل الملفات المفقودة ورفض الأرشيف الفارغ"""
+        self.assertFalse(self.builder.build([os.path.join(self.temp_dir, "missing.mp4")])['success'])
+
+class TestProviderTransport(unittest.TestCase):
+    """اختبارات طبقة النقل المشتركة لموفري الذكاء الاصطناعي"""
+    
+    def setUp(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        test = self
+        self.connections = 0
+        self.statuses = []
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def setup(self):
+                super().setup()
+                test.connections += 1
+            
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status = test.statuses.pop(0) if test.statuses else 200
+                body = b'{"ok": true}'
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/generate"
+        self.transport = ProviderTransport('test', max_concurrency=2, backoff_factor=0.01, queue_timeout=0.1)
+    
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_session_reuses_connection(self):
+        """اختبار إعادة استخدام الاتصال نفسه بين الطلبات (keep-alive)"""
+        for _ in range(3):
+            self.assertEqual(self.transport.post(self.url, json={}).status_code, 200)
+        self.assertEqual(self.connections, 1)
+    
+    def test_retries_throttling_and_server_errors(self):
+        """اختبار إعادة المحاولة عند 429 و 503"""
+        self.statuses = [429, 503]
+        self.assertEqual(self.transport.post(self.url, json={}).status_code, 200)
+        self.assertEqual(self.statuses, [])
+    
+    def test_async_post_retries(self):
+        """اختبار إعادة المحاولة في الطلبات غير المتزامنة"""
+        self.statuses = [503]
+        
+        async def run():
+            try:
+                return await self.transport.apost(self.url, json={})
+            finally:
+                await self.transport.async_http_client().aclose()
+        
+        self.assertEqual(asyncio.run(run()).status_code, 200)
+        self.assertEqual(self.transport.retries, 1)
+    
+    def test_async_acquire_waits_for_sync_slot(self):
+        """اختبار انتظار الطلبات غير المتزامنة على حد التزامن المشترك دون استطلاع متكرر"""
+        release = self.transport.acquire()
+        hold = self.transport.acquire()
+        
+        async def run():
+            with self.assertRaises(ProviderBusyError):
+                await self.transport.aacquire()
+            waiting = asyncio.ensure_future(self.transport.aacquire())
+            await asyncio.sleep(0.02)
+            release()
+            return await waiting
+        
+        asyncio.run(run())()
+        hold()
+        self.assertEqual(self.transport.rejected, 1)
+        self.assertEqual(self.transport._semaphore._value, 2)
+    
+    def test_concurrency_limit_is_shared(self):
+        """اختبار أن حد التزامن يشمل الجلسة وعميل httpx معاً"""
+        with self.transport.slot(), self.transport.slot():
+            with self.assertRaises(ProviderBusyError):
+                self.transport.post(self.url, json={})
+        
+        # الاستجابة المتدفقة تحجز مكانها حتى إغلاقها
+        with self.transport.stream(self.url, json={}) as response:
+            self.assertEqual(response.status_code, 200)
+            with self.transport.slot(), self.assertRaises(ProviderBusyError):
+                self.transport.post(self.url, json={})
+        
+        # الاستجابة تحرر مكانها بعد قراءتها بالكامل
+        for _ in range(3):
+            self.assertEqual(self.transport.http_client().post(self.url, json={}).json(), {'ok': True})
+        self.assertEqual(self.transport.rejected, 2)
+    
+    def test_async_requests_share_the_sync_limit(self):
+        """اختبار أن الطلبات غير المتزامنة تخضع لحد التزامن ومهلة الانتظار نفسيهما"""
+        async def run():
+            try:
+                with self.transport.slot(), self.transport.slot():
+                    with self.assertRaises(ProviderBusyError):
+                        await self.transport.apost(self.url, json={})
+                return await self.transport.apost(self.url, json={})
+            finally:
+                await self.transport.async_http_client().aclose()
+        
+        self.assertEqual(asyncio.run(run()).status_code, 200)
+        self.assertEqual(self.transport.rejected, 1)
+    
+    def test_configure_rebuilds_clients_with_new_limits(self):
+        """اختبار إعادة إنشاء عملاء httpx عند تغير حد التزامن"""
+        client = self.transport.http_client()
+        self.transport.configure(read_timeout=30)
+        self.assertIs(self.transport.http_client(), client)
+        self.transport.configure(max_concurrency=4)
+        self.assertIsNot(self.transport.http_client(), client)
+        self.assertEqual(self.transport.max_concurrency, 4)
+
+class TestConversationMemory(unittest.TestCase):
+    """اختبارات ذاكرة المحادثة لكل مستخدم"""
+    
+    def test_users_are_isolated(self):
+        """اختبار أن لكل مستخدم سجله الخاص"""
+        memory = ConversationMemory()
+        memory.add_turn("1", "سؤال الأول", "جواب الأول")
+        memory.add_turn("2", "سؤال الثاني", "جواب الثاني")
+        
+        self.assertEqual(memory.messages("1"), [('human', "سؤال الأول"), ('ai', "جواب الأول")])
+        memory.clear("1")
+        self.assertEqual(memory.messages("1"), [])
+        self.assertEqual(len(memory.messages("2")), 2)
+    
+    def test_window_folds_old_turns_into_summary(self):
+        """اختبار قص السجل إلى النافذة وتلخيص الأدوار القديمة"""
+        memory = ConversationMemory(window_turns=2)
+        for i in range(5):
+            memory.add_turn("1", f"سؤال {i}", f"جواب {i}")
+        
+        history = memory.messages("1")
+        self.assertEqual(history[0][0], 'system')
+        self.assertIn("سؤال 0", history[0][1])
+        self.assertIn("جواب 0", history[0][1])
+        self.assertEqual([text for role, text in history[1:] if role == 'human'], ["سؤال 3", "سؤال 4"])
+    
+    def test_token_budget(self):
+        """اختبار احترام ميزانية الرموز"""
+        memory = ConversationMemory(window_turns=50, max_context_tokens=200)
+        for i in range(10):
+            memory.add_turn("1", "س" * 150, "ج" * 150)
+        
+        self.assertLessEqual(memory.context_tokens("1"), 200 + 100)
+        self.assertLess(len(memory.messages("1")), 20)
+    
+    def test_evicted_history_is_restored_from_store(self):
+        """اختبار استعادة سجل مستخدم مطرود من المخزن الدائم"""
+        store = StateNamespace(MemoryStateBackend(), "conversations")
+        memory = ConversationMemory(max_users=1, store=store)
+        memory.add_turn("1", "مرحبا", "أهلاً")
+        memory.add_turn("2", "سؤال", "جواب")
+        
+        self.assertEqual(memory.stats()['size'], 1)
+        self.assertEqual(memory.messages("1"), [('human', "مرحبا"), ('ai', "أهلاً")])
+
+class TestIntentRouter(unittest.TestCase):
+    """اختبارات التصنيف المحلي للرسائل قبل وكيل الذكاء الاصطناعي"""
+    
+    def setUp(self):
+        self.router = IntentRouter()
+    
+    def test_rules_answer_common_requests(self):
+        """اختبار تصنيف الطلبات الشائعة بالكلمات المفتاحية"""
+        cases = {
+            "مرحبا": 'greeting',
+            "السلامُ عليكم": 'greeting',
+            "مرحبا، حمّل فيديو": 'download',
+            "download video": 'download',
+            "حمل صوت الفيديو": 'audio',
+            "قص الفيديو": 'edit',
+            "حوّل الملف إلى mp3": 'convert',
+            "القائمة الرئيسية": 'menu',
+            "شكراً": 'thanks'
+        }
+        for text, intent in cases.items():
+            match = self.router.route(text)
+            self.assertIsNotNone(match, text)
+            self.assertEqual((match.intent, match.source), (intent, 'rules'), text)
+    
+    def test_ambiguous_and_open_questions_go_to_llm(self):
+        """اختبار تمرير الأسئلة المفتوحة والمشاكل والرسائل الطويلة للنموذج"""
+        for text in ["لماذا فشل التحميل؟", "اكتب لي قصة قصيرة عن قطة", "ما رأيك في الذكاء الاصطناعي",
+                     "قص الصورة", "أريد أن أعرف كيف يمكنني تحميل فيديو طويل من يوتيوب بجودة عالية"]:
+            self.assertIsNone(self.router.route(text), text)
+        
+        self.assertEqual(self.router.stats()['llm'], 5)
+    
+    def test_service_questions_go_to_llm(self):
+        """اختبار تمرير الأسئلة عن الخدمات للنموذج مع بقاء أسئلة المساعدة محلية"""
+        for text in ["what is the best video format for instagram", "ما أفضل صيغة فيديو لانستجرام",
+                     "هل يمكن تحميل فيديو من تيك توك؟", "how to convert video"]:
+            self.assertIsNone(self.router.route(text), text)
+        self.assertEqual(self.router.route("ماذا تستطيع؟").intent, 'help')
+        self.assertEqual(self.router.route("حمل فيديو").intent, 'download')
+    
+    def test_classifier_fallback(self):
+        """اختبار المصنف الاحتياطي عند عدم تطابق القواعد"""
+        match = self.router.route("جيب لي المقطع")
+        self.assertEqual((match.intent, match.source), ('download', 'classifier'))
+        
+        classifier = NaiveBayesIntentClassifier().train([("hello there", 'greeting'), ("bye now", 'other')])
+        intent, probability = classifier.predict("hello")
+        self.assertEqual(intent, 'greeting')
+        self.assertGreater(probability, 0.5)
+        
+        self.router.configure(use_classifier=False)
+        self.assertIsNone(self.router.route("جيب لي المقطع"))
+    
+    def test_disabled_router(self):
+        """اختبار تعطيل الموجه"""
+        self.router.configure(enabled=False)
+        self.assertIsNone(self.router.route("مرحبا"))
+
+class TestResponseCache(unittest.TestCase):
+    """اختبارات ذاكرة ردود النموذج"""
+    
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=3, ttl=60)
+        self.cache.set("google/gemini", "كيف أحمل من تيك توك؟", "رد تيك توك")
+    
+    def test_exact_and_similar_hits(self):
+        """اختبار المطابقة بعد التطبيع والمطابقة التقريبية"""
+        self.assertEqual(self.cache.get("google/gemini", "كيف احمّل من تيك توك"), "رد تيك توك")
+        self.cache.set("google/gemini", "what formats are supported", "formats")
+        self.assertEqual(self.cache.get("google/gemini", "What formats are supportd?"), "formats")
+        
+        stats = self.cache.stats()
+        self.assertEqual((stats['exact_hits'], stats['similar_hits']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 1.0)
+    
+    def test_different_questions_miss(self):
+        """اختبار رفض الأسئلة المتشابهة حرفياً والمختلفة في المعنى"""
+        self.cache.set("google/gemini", "what formats are supported", "formats")
+        self.assertIsNone(self.cache.get("google/gemini", "كيف أحمل من يوتيوب؟"))
+        self.assertIsNone(self.cache.get("google/gemini", "what formats are not supported"))
+        self.assertIsNone(self.cache.get("google/gemini", "وتيك توك؟"))
+        self.assertEqual(self.cache.stats()['misses'], 2)
+    
+    def test_partitions_and_eviction(self):
+        """اختبار فصل الردود لكل نموذج وطرد الأقدم"""
+        self.assertIsNone(self.cache.get("openai/gpt-4", "كيف أحمل من تيك توك؟"))
+        
+        for i in range(3):
+            self.cache.set("openai/gpt-4", f"سؤال رقم {i} عن الصيغ", f"رد {i}")
+        self.assertIsNone(self.cache.get("google/gemini", "كيف أحمل من تيك توك؟"))
+        self.assertEqual(self.cache.get("openai/gpt-4", "سؤال رقم 2 عن الصيغ"), "رد 2")
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+    
+    def test_answers_shaped_by_history_are_not_shared(self):
+        """اختبار أن رد مستخدم له سجل محادثة لا يُعاد لمستخدم آخر"""
+        memory = ConversationMemory()
+        memory.add_turn("1", "اسمي أحمد", "أهلاً أحمد")
+        memory.add_turn("2", "اسمي سارة", "أهلاً سارة")
+        question = "ما هو اسمي من فضلك"
+        
+        self.cache.set("google/gemini", question, "اسمك أحمد", memory.messages("1"))
+        self.assertIsNone(self.cache.get("google/gemini", question, memory.messages("2")))
+        self.assertIsNone(self.cache.get("google/gemini", question, memory.messages("3")))
+        self.assertIsNone(self.cache.get("google/gemini", "كيف أحمل من تيك توك؟", memory.messages("2")))
 
 class TestMultiModelAIManager(unittest.TestCase):
     """اختبارات مدير النماذج المتعددة"""
@@ -186,6 +1649,26 @@ def run_all_tests():
     # إضافة اختبارات الوحدة
     test_classes = [
         TestAdvancedMediaDownloader,
+        TestFFmpegPool,
+        TestMediaConverter,
+        TestMediaEditor,
+        TestOversizeHandler,
+        TestImageProcessor,
+        TestTTLCache,
+        TestDownloadJobQueue,
+        TestTelegramFileIdCache,
+        TestMediaStore,
+        TestProgressReporting,
+        TestWebhookDispatcher,
+        TestStageExecutor,
+        TestStateStore,
+        TestPlatformResilience,
+        TestBulkDownloadEngine,
+        TestZipArchiveBuilder,
+        TestProviderTransport,
+        TestConversationMemory,
+        TestIntentRouter,
+        TestResponseCache,
         TestMultiModelAIManager,
         TestPerformanceMonitor,
         TestIntegration